@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+异步对话并发基准测试
+比较线程池驱动的同步 chat 与单个事件循环驱动的 achat 在大量并发会话下的总耗时
+
+使用本地模拟LLM（每次调用固定延迟），每个会话一个Agent、发送一轮消息：
+    python benchmarks/bench_async_chat.py --sessions 100 1000 --threads 32
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from core import LittlePrinceAgent
+from utils.logger import setup_logger
+
+
+def run_threads(agents: list, threads: int) -> float:
+    """线程池并发调用同步chat，返回总耗时（秒）"""
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda agent: agent.chat("你好，小王子"), agents))
+    return time.perf_counter() - start_time
+
+
+def run_async(agents: list) -> float:
+    """单个事件循环并发调用achat，返回总耗时（秒）"""
+    async def run_all():
+        await asyncio.gather(*(agent.achat("你好，小王子") for agent in agents))
+
+    start_time = time.perf_counter()
+    asyncio.run(run_all())
+    return time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="异步对话并发基准测试")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[100, 1000], help="并发会话数")
+    parser.add_argument("--threads", type=int, default=32, help="同步方式的线程池大小")
+    parser.add_argument("--latency", type=float, default=0.5, help="模拟LLM每次调用的延迟（秒）")
+    args = parser.parse_args()
+
+    os.environ.setdefault("LLM_API_KEY", "benchmark_key")
+    setup_logger("WARNING")
+
+    print(f"{'会话数':>6} {'方式':<14} {'总耗时s':>8} {'吞吐(轮/秒)':>12}")
+    for sessions in args.sessions:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = Config(MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"), LLM_PROVIDER="fake",
+                            MEMORY_UPDATE_INTERVAL=1000)
+            agents = [LittlePrinceAgent(config, f"bench_user_{i}") for i in range(sessions)]
+            for agent in agents:
+                agent.llm.llm.latency = args.latency
+
+            for mode, elapsed in ((f"chat x{args.threads}线程", run_threads(agents, args.threads)),
+                                  ("achat", run_async(agents))):
+                print(f"{sessions:>6} {mode:<14} {elapsed:>8.2f} {sessions / elapsed:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
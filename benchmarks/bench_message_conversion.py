@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+LangChain消息转换微基准测试
+比较每轮全部重新转换与复用上一轮已转换消息对象的耗时和新建对象数
+
+    python benchmarks/bench_message_conversion.py --rounds 10 50 200
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from core.llm import LLMInterface
+from utils.logger import setup_logger
+
+
+def build_context(rounds: int, turn: int) -> list:
+    """构建第turn轮时的上下文：系统提示词 + 长期记忆 + 最近rounds轮对话 + 当前输入"""
+    messages = [
+        {"role": "system", "content": "你是小王子，来自B-612星球。" * 20},
+        {"role": "system", "content": "基于我对您的了解：\n- 用户身份：小明"},
+    ]
+    for i in range(turn, turn + rounds):
+        messages.append({"role": "user", "content": f"第{i}轮：我今天想起了那朵玫瑰。"})
+        messages.append({"role": "assistant", "content": f"第{i}轮：真正重要的东西用眼睛是看不见的。"})
+    messages.append({"role": "user", "content": f"第{turn + rounds}轮的新问题"})
+    return messages
+
+
+def bench(llm: LLMInterface, rounds: int, turns: int, cached: bool) -> dict:
+    """模拟连续多轮对话的消息转换"""
+    llm.clear_message_cache()
+    before = llm.get_conversion_stats()['converted']
+    contexts = [build_context(rounds, turn) for turn in range(turns)]
+
+    start_time = time.perf_counter()
+    for messages in contexts:
+        if cached:
+            llm._convert_messages(messages, "bench_user", 1)
+        else:
+            llm._convert_messages(messages)
+    elapsed = time.perf_counter() - start_time
+
+    # 不使用缓存时不计入统计，按消息数计算新建对象数
+    converted = llm.get_conversion_stats()['converted'] - before if cached else sum(len(m) for m in contexts)
+    return {'us_per_turn': elapsed / turns * 1e6, 'objects_per_turn': converted / turns}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LangChain消息转换微基准测试")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 50, 200], help="上下文中的对话轮数")
+    parser.add_argument("--turns", type=int, default=200, help="模拟的对话轮次")
+    args = parser.parse_args()
+
+    os.environ.setdefault("LLM_API_KEY", "benchmark_key")
+    setup_logger("WARNING")
+    llm = LLMInterface(Config(LLM_PROVIDER="fake"))
+
+    print(f"{'上下文轮数':>8} {'方式':<8} {'耗时us/轮':>10} {'新建对象/轮':>12}")
+    for rounds in args.rounds:
+        for cached in (False, True):
+            result = bench(llm, rounds, args.turns, cached)
+            print(f"{rounds:>8} {'复用' if cached else '全量':<8} {result['us_per_turn']:>10.1f} {result['objects_per_turn']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
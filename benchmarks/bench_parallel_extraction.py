@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+按记忆部分并行提取基准测试
+比较单次调用（full）与三个部分并行调用（parallel）的记忆整合耗时和总token数
+
+使用本地模拟LLM，延迟按输出token数线性增长（长输出是整合中最慢的环节）：
+    python benchmarks/bench_parallel_extraction.py --rounds 10 20 --runs 3
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from core.llm import LLMInterface
+from core.memory import MemoryUpdateMechanism
+from utils.logger import setup_logger
+
+
+def build_conversations(rounds: int) -> list:
+    """构造一段会话"""
+    conversations = [{'user': "我叫小明", 'ai': "你好小明！很高兴认识你。"},
+                     {'user': "我喜欢玫瑰", 'ai': "玫瑰是我星球上最特别的花。"}]
+    for i in range(rounds - len(conversations)):
+        conversations.append({'user': f"第{i}天，我又看了一次日落，想起了狐狸说的话",
+                              'ai': "驯养就是建立联系，你为你的玫瑰花费的时间，使她变得重要。"})
+    return conversations
+
+
+def run_mode(mode: str, conversations: list, runs: int, base_latency: float, per_output_token: float) -> dict:
+    """运行多次记忆分析，返回耗时和token统计"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config(MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"), LLM_PROVIDER="fake",
+                        MEMORY_UPDATE_MODE=mode)
+        llm = LLMInterface(config)
+        llm.llm.latency = base_latency
+        llm.llm.latency_per_output_token = per_output_token
+        mechanism = MemoryUpdateMechanism(config, llm)
+
+        durations = []
+        tokens = []
+        for _ in range(runs):
+            start_time = time.perf_counter()
+            mechanism.update_memory(conversations, {})
+            durations.append(time.perf_counter() - start_time)
+            assert mechanism.last_error is None, mechanism.last_error
+            tokens.append(mechanism.last_usage.get('input_tokens', 0) + mechanism.last_usage.get('output_tokens', 0))
+
+        return {
+            'median_ms': statistics.median(durations) * 1000,
+            'tokens': statistics.mean(tokens),
+            'calls': mechanism.last_usage.get('calls', 0)
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按记忆部分并行提取基准测试")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 20], help="每次整合的对话轮数")
+    parser.add_argument("--runs", type=int, default=3, help="每种方式的运行次数（取中位数）")
+    parser.add_argument("--base-latency", type=float, default=0.2, help="模拟LLM每次调用的固定延迟（秒）")
+    parser.add_argument("--per-output-token", type=float, default=0.004, help="模拟LLM每个输出token的延迟（秒）")
+    args = parser.parse_args()
+
+    os.environ.setdefault("LLM_API_KEY", "benchmark_key")
+    setup_logger("WARNING")
+
+    print(f"{'轮数':>6} {'方式':<10} {'调用次数':>8} {'耗时中位数ms':>14} {'总tokens':>10}")
+    for rounds in args.rounds:
+        conversations = build_conversations(rounds)
+        for mode in ("full", "parallel"):
+            result = run_mode(mode, conversations, args.runs, args.base_latency, args.per_output_token)
+            print(f"{rounds:>6} {mode:<10} {result['calls']:>8} {result['median_ms']:>14.0f} {result['tokens']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
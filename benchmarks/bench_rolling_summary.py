@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+滚动对话摘要基准测试
+比较长会话下完整历史、固定窗口、窗口+滚动摘要三种方式的每轮token数和延迟
+
+使用本地模拟LLM，延迟按输入token数线性增长：
+    python benchmarks/bench_rolling_summary.py --rounds 50 100 200
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from core import LittlePrinceAgent
+from utils.logger import setup_logger
+
+
+def run_session(mode: str, rounds: int, window: int, per_token_latency: float) -> dict:
+    """运行一次长会话，返回每轮token数和延迟统计"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config(
+            MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"),
+            LLM_PROVIDER="fake",
+            SHORT_TERM_MAX_ROUNDS=rounds if mode == "full" else window,
+            MEMORY_UPDATE_INTERVAL=rounds + 1,
+            CONTEXT_TOKEN_BUDGETS={},
+            DEFAULT_CONTEXT_TOKEN_BUDGET=10 ** 7
+        )
+        agent = LittlePrinceAgent(config, f"bench_{mode}")
+        agent.llm.llm.latency_per_input_token = per_token_latency
+        agent.llm.llm.responses = ["这让我想起了B-612星球上的日落，朋友。你还想和我聊些什么呢？" * 2]
+
+        if mode == "window":
+            agent.memory_update_mechanism.update_rolling_summary = lambda overflow_turns: ""
+
+        # 分别统计对话调用和摘要调用的token
+        chat_tokens = []
+        summary_tokens = []
+        original_generate = agent.llm.generate
+        original_invoke_direct = agent.llm.invoke_direct
+
+        def counting_generate(messages, *args, **kwargs):
+            result = original_generate(messages, *args, **kwargs)
+            chat_tokens.append(agent.llm.last_usage.get('input_tokens', 0))
+            return result
+
+        def counting_invoke_direct(messages):
+            result = original_invoke_direct(messages)
+            summary_tokens.append(agent.llm.last_usage.get('input_tokens', 0) + agent.llm.last_usage.get('output_tokens', 0))
+            return result
+
+        agent.llm.generate = counting_generate
+        agent.llm.invoke_direct = counting_invoke_direct
+
+        latencies = []
+        for i in range(rounds):
+            start_time = time.perf_counter()
+            agent.chat(f"第{i}轮：今天我又想起了那朵玫瑰，还有狐狸说过的话，你觉得驯养意味着什么？")
+            latencies.append(time.perf_counter() - start_time)
+        # 摘要在后台任务中生成，统计token前等待其完成
+        agent.consolidation_worker.wait_idle(f"bench_{mode}")
+
+        # 只统计会话后半段，反映长会话的稳定状态
+        tail = slice(rounds // 2, None)
+        tail_latencies = sorted(latencies[tail])
+        return {
+            'chat_tokens_per_turn': sum(chat_tokens[tail]) / len(chat_tokens[tail]),
+            'total_tokens_per_turn': (sum(chat_tokens) + sum(summary_tokens)) / rounds,
+            'avg_latency_ms': sum(tail_latencies) / len(tail_latencies) * 1000,
+            'p95_latency_ms': tail_latencies[int(len(tail_latencies) * 0.95) - 1] * 1000,
+            'summary_calls': len(summary_tokens)
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="滚动对话摘要基准测试")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[50, 100, 200], help="会话轮数")
+    parser.add_argument("--window", type=int, default=10, help="短期记忆窗口轮数")
+    parser.add_argument("--per-token-latency", type=float, default=0.00002, help="模拟LLM每个输入token的延迟（秒）")
+    args = parser.parse_args()
+
+    os.environ.setdefault("LLM_API_KEY", "benchmark_key")
+    setup_logger("WARNING")
+
+    print(f"{'轮数':>6} {'方式':<10} {'对话tokens/轮':>14} {'总tokens/轮':>12} {'平均延迟ms':>10} {'p95延迟ms':>10} {'摘要调用':>8}")
+    for rounds in args.rounds:
+        for mode in ("full", "window", "summary"):
+            result = run_session(mode, rounds, args.window, args.per_token_latency)
+            print(f"{rounds:>6} {mode:<10} {result['chat_tokens_per_turn']:>14.0f} {result['total_tokens_per_turn']:>12.0f} "
+                  f"{result['avg_latency_ms']:>10.1f} {result['p95_latency_ms']:>10.1f} {result['summary_calls']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+流式对话首token时间基准测试
+比较 chat（等待完整回复）与 chat_stream（逐块输出）用户看到第一个字之前的等待时间
+
+使用本地模拟LLM，延迟由固定延迟和按输出token线性增长的生成时间组成：
+    python benchmarks/bench_streaming_ttft.py --turns 10 --reply-chars 200
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from core import LittlePrinceAgent
+from utils.logger import setup_logger
+
+
+def run_mode(mode: str, turns: int, reply: str, base_latency: float, per_output_token: float) -> dict:
+    """运行多轮对话，返回首字等待时间和完整回复耗时"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config(MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"), LLM_PROVIDER="fake",
+                        MEMORY_UPDATE_INTERVAL=1000)
+        agent = LittlePrinceAgent(config, f"bench_{mode}")
+        agent.llm.llm.responses = [reply]
+        agent.llm.llm.latency = base_latency
+        agent.llm.llm.latency_per_output_token = per_output_token
+
+        first_token = []
+        total = []
+        for i in range(turns):
+            start_time = time.perf_counter()
+            if mode == "chat":
+                agent.chat(f"第{i}轮，给我讲讲B-612星球")
+                first_token.append(time.perf_counter() - start_time)
+            else:
+                first = None
+                for _ in agent.chat_stream(f"第{i}轮，给我讲讲B-612星球"):
+                    if first is None:
+                        first = time.perf_counter() - start_time
+                first_token.append(first)
+            total.append(time.perf_counter() - start_time)
+
+        return {
+            'first_token_ms': statistics.median(first_token) * 1000,
+            'total_ms': statistics.median(total) * 1000
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式对话首token时间基准测试")
+    parser.add_argument("--turns", type=int, default=10, help="每种方式的对话轮数（取中位数）")
+    parser.add_argument("--reply-chars", type=int, default=200, help="模拟回复的字数")
+    parser.add_argument("--base-latency", type=float, default=0.1, help="模拟LLM每次调用的固定延迟（秒）")
+    parser.add_argument("--per-output-token", type=float, default=0.005, help="模拟LLM每个输出token的延迟（秒）")
+    args = parser.parse_args()
+
+    os.environ.setdefault("LLM_API_KEY", "benchmark_key")
+    setup_logger("WARNING")
+
+    reply = ("真正重要的东西用眼睛是看不见的。" * (args.reply_chars // 16 + 1))[:args.reply_chars]
+    print(f"{'方式':<12} {'首字等待中位数ms':>16} {'完整回复中位数ms':>16}")
+    for mode in ("chat", "chat_stream"):
+        result = run_mode(mode, args.turns, reply, args.base_latency, args.per_output_token)
+        print(f"{mode:<12} {result['first_token_ms']:>16.0f} {result['total_ms']:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -81,6 +81,15 @@ class PromptManager:
         config = self.prompts_config.get(prompt_name, self.prompts_config["little_prince_v1"])
         return config.get("examples", [])
     
+    def get_example_messages(self, prompt_name: Optional[str] = None) -> list:
+        """将示例对话转换为消息列表（静态内容，用于缓存友好的提示词布局）"""
+        messages = []
+        for example in self.get_examples(prompt_name):
+            if example.get("user") and example.get("assistant"):
+                messages.append({"role": "user", "content": example["user"]})
+                messages.append({"role": "assistant", "content": example["assistant"]})
+        return messages
+    
     def set_current_prompt(self, prompt_name: str):
         """设置当前Prompt"""
         if prompt_name in self.prompts_config:
@@ -149,6 +158,96 @@ class PromptManager:
         3. 确保返回的是有效的JSON格式
         4. 不要添加任何额外的解释文字，只返回JSON"""
 
+    def get_section_memory_prompt(self, section: str) -> str:
+        """获取单个记忆部分的提取提示词（并行提取模式下每个部分单独调用）"""
+        section_formats = {
+            'factual': ("事实记忆", """"factual": {{
+                "identity": "用户身份信息（姓名、昵称、偏好称呼）",
+                "preferences": "喜好与厌恶（食物、天气、颜色、动物等）",
+                "interests": "兴趣与习惯（爱好、日常作息、生活方式）",
+                "important_people": "重要人物（家人、朋友、宠物）",
+                "taboos": "禁忌话题（用户不喜欢或避免谈论的内容）"
+            }}"""),
+            'episodic': ("情节记忆", """"episodic": [
+                {{
+                    "type": "用户经历/情感亮点/共享记忆/特殊时刻/怀旧故事",
+                    "content": "具体内容描述",
+                    "timestamp": "时间信息"
+                }}
+            ]"""),
+            'semantic': ("语义记忆", """"semantic": {{
+                "values": "价值观（对幸福、爱情、成长的看法）",
+                "themes": "核心主题（重复的情感模式、人生信念）",
+                "goals": "长期目标与抱负（想成为的人、追求的生活）"
+            }}""")
+        }
+        title, section_format = section_formats[section]
+        return f"""请分析以下对话，提取用户的长期记忆信息。本次只需提取{title}（{section}），请严格按照以下格式返回JSON：
+        对话内容：
+        {{conversations}}
+
+        请提取并返回以下格式的JSON：
+
+        {{{{
+            {section_format}
+        }}}}
+
+        注意：
+        1. 只提取确实在对话中提到的信息
+        2. 如果没有相关信息，返回空字符串或空数组
+        3. 只返回{section}这一个字段，不要包含其它部分
+        4. 不要添加任何额外的解释文字，只返回JSON"""
+    
+    def get_rolling_summary_prompt(self) -> str:
+        """获取滚动对话摘要提示词"""
+        return """请将以下内容整合为一段简洁的"此前对话摘要"，供后续对话参考。
+
+        已有摘要：
+        {existing_summary}
+
+        新滑出窗口的对话：
+        {conversations}
+
+        要求：
+        1. 在已有摘要的基础上增量补充新对话中的要点，不要丢失已有摘要中的重要信息
+        2. 保留用户提到的事实、情绪变化、未完成的话题和双方的约定
+        3. 使用第三人称，控制在200字以内
+        4. 只返回摘要正文，不要添加任何额外的解释文字"""
+    
+    def get_incremental_memory_prompt(self) -> str:
+        """获取增量记忆整合提示词（只发送新对话和当前记忆摘要，返回增删改操作）"""
+        return """请根据新的对话增量更新用户的长期记忆，只返回需要修改的部分。
+
+        当前长期记忆摘要（每行以记忆编号开头，较早的情节记忆可能已省略）：
+        {memory_digest}
+
+        自上次整合以来的新对话：
+        {conversations}
+
+        请返回以下格式的JSON：
+
+        {{
+            "ops": [
+                {{"op": "add", "section": "episodic", "value": {{"type": "用户经历/情感亮点/共享记忆/特殊时刻/怀旧故事", "content": "具体内容描述", "timestamp": "时间信息"}}}},
+                {{"op": "update", "section": "factual", "key": "preferences", "value": "更新后的完整内容"}},
+                {{"op": "delete", "section": "episodic", "key": "E3"}}
+            ]
+        }}
+
+        说明：
+        1. section 为 factual、episodic 或 semantic
+        2. factual 的 key 可选 identity、preferences、interests、important_people、taboos；semantic 的 key 可选 values、themes、goals
+        3. episodic 的 update 和 delete 使用摘要中的编号（如 E3）作为 key，add 不需要 key
+        4. factual 和 semantic 的 update 需要给出合并后的完整内容，而不是只给新增部分
+        5. 只在对话明确推翻原有信息时使用 delete
+        6. 没有需要修改的内容时返回 {{"ops": []}}
+        7. 不要添加任何额外的解释文字，只返回JSON"""
+    
+    def get_json_repair_prompt(self) -> str:
+        """获取结构化输出修复提示词（记忆分析结果不合法时重试一次）"""
+        return """你上一次的输出不是符合要求的JSON：{error}
+        请按原要求的格式重新输出完整的JSON，不要添加任何额外的解释文字，只返回JSON。"""
+    
     def create_chat_template(self) -> ChatPromptTemplate:
         """创建聊天模板"""
         return ChatPromptTemplate.from_messages([
@@ -163,3 +262,22 @@ class PromptManager:
         return ChatPromptTemplate.from_messages([
             ("system", self.get_memory_analysis_prompt())
         ])
+    
+    def create_section_memory_templates(self) -> Dict[str, ChatPromptTemplate]:
+        """创建各记忆部分的提取模板"""
+        return {
+            section: ChatPromptTemplate.from_messages([("system", self.get_section_memory_prompt(section))])
+            for section in ('factual', 'episodic', 'semantic')
+        }
+    
+    def create_incremental_memory_template(self) -> ChatPromptTemplate:
+        """创建增量记忆整合模板"""
+        return ChatPromptTemplate.from_messages([
+            ("system", self.get_incremental_memory_prompt())
+        ])
+    
+    def create_rolling_summary_template(self) -> ChatPromptTemplate:
+        """创建滚动对话摘要模板"""
+        return ChatPromptTemplate.from_messages([
+            ("system", self.get_rolling_summary_prompt())
+        ])
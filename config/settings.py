@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from pydantic_settings import BaseSettings
 from loguru import logger
 
@@ -8,14 +8,87 @@ class Config(BaseSettings):
     """系统配置类"""
     
     # LLM配置
-    LLM_PROVIDER: str = "deepseek"  # openai, deepseek
+    LLM_PROVIDER: str = "deepseek"  # openai, deepseek, fake（本地模拟，用于测试）
     LLM_MODEL: str = "deepseek-chat"  # 根据提供商选择模型
     LLM_API_KEY: Optional[str] = None
     DEEPSEEK_API_KEY: Optional[str] = None  # DeepSeek API密钥
+    FAKE_LLM_LATENCY: float = 0.0  # 本地模拟LLM的固定延迟（秒）
+    LLM_JSON_MODE: bool = True  # 记忆分析使用提供商的JSON输出模式（OpenAI、DeepSeek）
+    # 进程内共享的LLM客户端HTTP连接池（以进程内首个Agent的配置为准）
+    LLM_HTTP_MAX_CONNECTIONS: int = 100
+    LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    LLM_HTTP_KEEPALIVE_EXPIRY: float = 60.0  # 空闲连接保持时间（秒）
+    LLM_BASE_URL: Optional[str] = None  # 兼容OpenAI接口的服务地址（代理或本地服务，为空时使用提供商默认地址）
+    
+    # LLM调用策略（可通过LLM_CALL_POLICIES按提供商覆盖，例如 {"deepseek": {"timeout_seconds": 120}}）
+    LLM_CALL_TIMEOUT_SECONDS: float = 60.0  # 单次请求超时（0表示不限制）
+    LLM_CALL_DEADLINE_SECONDS: float = 90.0  # 截止时间（0表示不限制）：对话从本轮开始计时，其它调用为一次调用（含重试与对冲）
+    LLM_CALL_MAX_RETRIES: int = 2  # 超时、连接错误、429和5xx的最大重试次数
+    LLM_CALL_RETRY_BASE_SECONDS: float = 0.5  # 重试退避基数（指数增长，全抖动）
+    LLM_CALL_RETRY_MAX_SECONDS: float = 8.0  # 单次退避的上限
+    LLM_CALL_HEDGE: bool = False  # 请求超过对冲延迟未返回时再发一个相同请求，先返回者胜出
+    LLM_CALL_HEDGE_DELAY_SECONDS: float = 2.0  # 近期耗时样本不足时的对冲延迟（样本足够时使用p95）
+    LLM_CALL_HEDGE_MIN_SAMPLES: int = 20
+    LLM_CALL_MAX_CONCURRENCY: int = 32  # 每个提供商同时执行的带超时或对冲的同步调用数（线程池大小），超出的排队
+    LLM_CALL_POLICIES: Dict[str, Dict[str, Any]] = {}
+    
+    # 提供商配额限流（令牌桶，同一提供商与API密钥在进程内共享；0表示不限制）
+    LLM_RATE_LIMIT_RPM: int = 0  # 每分钟请求数
+    LLM_RATE_LIMIT_TPM: int = 0  # 每分钟token数（调用前按估算扣除，调用后按实际用量修正）
+    LLM_RATE_LIMIT_OUTPUT_TOKENS: int = 300  # 估算时为每次调用预留的输出token数
+    LLM_RATE_LIMIT_BACKGROUND_RESERVE: float = 0.2  # 后台记忆整合须为对话回复保留的配额比例
+    LLM_RATE_LIMIT_MAX_WAIT_SECONDS: float = 60.0  # 等待配额的最长时间（0表示不限制）
+    LLM_RATE_LIMIT_DB_PATH: Optional[str] = None  # 设置后配额存储在该SQLite文件中，由多个进程共享
     
     # 记忆配置
     SHORT_TERM_MAX_ROUNDS: int = 10
     MEMORY_UPDATE_INTERVAL: int = 10
+    MEMORY_UPDATE_TOKEN_THRESHOLD: int = 0  # 待整合对话累计token数达到该值时触发整合（0表示不启用）
+    MEMORY_UPDATE_CHAR_THRESHOLD: int = 0  # 待整合对话累计字符数达到该值时触发整合（0表示不启用）
+    MEMORY_UPDATE_IDLE_SECONDS: float = 0.0  # 距上一轮对话空闲超过该秒数时整合已累计的对话（0表示不启用）
+    MEMORY_DB_PATH: str = "data/memory.sqlite"  # 多个进程可共享同一个数据库文件
+    MEMORY_UPDATE_BACKGROUND: bool = True  # 在后台线程中执行记忆整合，不阻塞当前回复
+    MEMORY_UPDATE_WORKERS: int = 2  # 后台记忆整合的并发线程数
+    MEMORY_UPDATE_MODE: str = "full"  # full: 每次分析后按规则合并; incremental: 发送记忆摘要，LLM返回增删改操作; parallel: 三个记忆部分并行提取
+    MEMORY_SPECULATIVE_ROUNDS: int = 0  # 距触发整合还差N轮时提前在后台分析（需后台模式，0表示不启用）
+    MEMORY_SECTION_TIMEOUT_SECONDS: float = 60.0  # parallel模式下每个记忆部分的提取超时
+    MEMORY_DIGEST_TOKEN_BUDGET: int = 800  # 增量整合时记忆摘要的token上限
+    MEMORY_JOB_LEASE_SECONDS: float = 300.0  # 任务租约时长，超时未完成的任务会被重新领取
+    MEMORY_ANALYSIS_CACHE: bool = True  # 缓存记忆分析结果，相同的对话不重复调用LLM
+    MEMORY_ANALYSIS_CACHE_TTL_SECONDS: float = 7 * 86400  # 分析结果缓存的有效期
+    MEMORY_ANALYSIS_CACHE_MAX_ENTRIES: int = 1000  # 分析结果缓存的最大条目数（按最近使用淘汰）
+    MEMORY_JOB_MAX_ATTEMPTS: int = 3  # 任务最大尝试次数，超过后进入死信
+    MEMORY_JOB_RETRY_BASE_SECONDS: float = 30.0  # 失败重试的基础退避时间（指数增长）
+    MEMORY_JOB_RETENTION_DAYS: int = 7  # 已完成任务的保留天数
+    MEMORY_JOB_CONCURRENCY: int = 1  # 执行记忆任务的并发数（大于1时同一用户的整合与摘要任务可能同时执行）
+    
+    # LLM回复精确匹配缓存（默认不启用；只有逐字节相同的请求才会命中，命中时照常写入记忆）
+    RESPONSE_CACHE: bool = False
+    RESPONSE_CACHE_PROMPTS: List[str] = []  # 启用缓存的Prompt名称（为空表示所有Prompt）
+    RESPONSE_CACHE_TTL_SECONDS: float = 3600.0  # 缓存回复的有效期
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1000  # 数据库中缓存的最大条目数（按最近使用淘汰）
+    RESPONSE_CACHE_MEMORY_ENTRIES: int = 256  # 进程内LRU的最大条目数
+    # LLM回复语义缓存（默认不启用；上下文相同、最后一条用户输入措辞相近时复用回复，仅进程内）
+    SEMANTIC_CACHE: bool = False
+    SEMANTIC_CACHE_THRESHOLD: float = 0.9  # 字符n-gram向量的余弦相似度阈值
+    SEMANTIC_CACHE_PER_USER: bool = False  # 按用户隔离（长期记忆非空的用户始终隔离）
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 1000  # 最大条目数（按最近使用淘汰）
+    
+    # 上下文token预算（输入部分，不含回复）
+    CONTEXT_TOKEN_BUDGETS: Dict[str, int] = {
+        "deepseek-chat": 12000,
+        "deepseek-coder": 12000,
+        "gpt-4o": 16000,
+        "gpt-4o-mini": 16000,
+        "gpt-4-turbo": 16000,
+        "gpt-4": 6000,
+        "gpt-3.5-turbo": 3000
+    }
+    DEFAULT_CONTEXT_TOKEN_BUDGET: int = 6000
+    # tiktoken词表缓存目录（对应TIKTOKEN_CACHE_DIR）；离线部署时预先放入cl100k_base词表文件，避免启动后联网下载
+    TOKENIZER_CACHE_DIR: Optional[str] = None
+    # 提示词布局：legacy（记忆统计写入首条系统消息）或 cache_friendly（静态内容在前，便于命中提供商前缀缓存）
+    PROMPT_LAYOUT: str = "legacy"
     # 系统配置
     LOG_LEVEL: str = "INFO"
     TEMPERATURE: float = 0.7
@@ -38,9 +111,31 @@ class Config(BaseSettings):
             "temperature": self.TEMPERATURE
         }
     
+    def get_context_token_budget(self, model: Optional[str] = None) -> int:
+        """获取指定模型的上下文token预算"""
+        model = model or self.LLM_MODEL
+        return self.CONTEXT_TOKEN_BUDGETS.get(model, self.DEFAULT_CONTEXT_TOKEN_BUDGET)
+    
+    def get_call_policy(self, provider: Optional[str] = None) -> Dict[str, Any]:
+        """获取指定提供商的LLM调用策略参数（默认值叠加LLM_CALL_POLICIES中的覆盖项）"""
+        provider = (provider or self.LLM_PROVIDER).lower()
+        policy = {
+            "timeout_seconds": self.LLM_CALL_TIMEOUT_SECONDS,
+            "deadline_seconds": self.LLM_CALL_DEADLINE_SECONDS,
+            "max_retries": self.LLM_CALL_MAX_RETRIES,
+            "retry_base_seconds": self.LLM_CALL_RETRY_BASE_SECONDS,
+            "retry_max_seconds": self.LLM_CALL_RETRY_MAX_SECONDS,
+            "hedge": self.LLM_CALL_HEDGE,
+            "hedge_delay_seconds": self.LLM_CALL_HEDGE_DELAY_SECONDS,
+            "hedge_min_samples": self.LLM_CALL_HEDGE_MIN_SAMPLES,
+            "max_concurrency": self.LLM_CALL_MAX_CONCURRENCY
+        }
+        policy.update(self.LLM_CALL_POLICIES.get(provider, {}))
+        return policy
+    
     def validate_model_config(self):
         """验证模型配置"""
-        valid_providers = ["openai", "deepseek"]
+        valid_providers = ["openai", "deepseek", "fake"]
         if self.LLM_PROVIDER.lower() not in valid_providers:
             raise ValueError(f"不支持的LLM提供商: {self.LLM_PROVIDER}. 支持的提供商: {valid_providers}")
         
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+离线批量记忆整合 - 对所有有待整合内容的用户重新运行记忆分析
+
+适用于修改记忆分析提示词后在夜间批量重跑。示例：
+    python consolidate_all.py --concurrency 8 --rpm 600
+    python consolidate_all.py --resume                 # 从检查点继续
+    python consolidate_all.py --provider fake          # 使用本地模拟LLM演练
+"""
+
+import argparse
+import os
+import sys
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from config import Config
+from core.llm import LLMInterface
+from core.memory import BatchConsolidator
+from core.user_manager import UserManager
+from utils.logger import setup_logger
+
+
+def main() -> int:
+    """主函数，有用户整合失败时返回1"""
+    parser = argparse.ArgumentParser(description="离线批量记忆整合")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发的LLM调用数")
+    parser.add_argument("--rpm", type=float, default=0, help="每分钟最多请求数（0表示不限制）")
+    parser.add_argument("--batch-size", type=int, default=50, help="每批写入数据库的用户数")
+    parser.add_argument("--checkpoint", default="data/consolidation_checkpoint.json", help="检查点文件路径")
+    parser.add_argument("--resume", action="store_true", help="跳过检查点中已完成的用户")
+    parser.add_argument("--users", nargs="*", help="只整合指定的用户ID")
+    parser.add_argument("--include-registered", action="store_true", help="同时包含UserManager中的所有注册用户")
+    parser.add_argument("--provider", help="覆盖LLM提供商（例如 fake）")
+    parser.add_argument("--fake-latency", type=float, default=0.0, help="模拟LLM每次调用的延迟（秒）")
+    parser.add_argument("--progress-every", type=int, default=100, help="每完成N个用户输出一次进度")
+    args = parser.parse_args()
+    
+    load_dotenv()
+    setup_logger("INFO")
+    
+    overrides = {}
+    if args.provider:
+        overrides['LLM_PROVIDER'] = args.provider
+        if args.provider == "fake":
+            os.environ.setdefault("LLM_API_KEY", "fake")
+            overrides['FAKE_LLM_LATENCY'] = args.fake_latency
+    config = Config(**overrides)
+    
+    consolidator = BatchConsolidator(
+        config,
+        llm_factory=lambda: LLMInterface(config),
+        concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        batch_size=args.batch_size,
+        checkpoint_path=args.checkpoint
+    )
+    
+    if args.users:
+        user_ids = args.users
+    else:
+        user_manager = UserManager() if args.include_registered else None
+        user_ids = consolidator.list_users(user_manager)
+    
+    report = consolidator.run(user_ids, resume=args.resume, progress_every=args.progress_every)
+    
+    print("\n📊 批量整合报告")
+    print("-" * 40)
+    print(f"用户总数: {report['total']}（检查点中已完成 {report['resumed_from_checkpoint']}）")
+    print(f"成功: {report['completed']}  跳过: {report['skipped']}  失败: {report['failed']}")
+    print(f"耗时: {report['elapsed_seconds']:.1f}s")
+    print(f"吞吐: {report['users_per_minute']:.1f} 用户/分钟，{report['tokens_per_minute']:.0f} tokens/分钟")
+    for user_id, error in list(report['failures'].items())[:20]:
+        print(f"  ❌ {user_id}: {error}")
+    if report['failed']:
+        logger.warning(f"{report['failed']} 个用户整合失败，可使用 --resume 重新尝试")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,21 @@
-from typing import List, Dict, Any
+import asyncio
+import itertools
+import threading
+import time
+from datetime import date
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator
 from loguru import logger
 
 from .llm import LLMInterface
-from .memory import MemoryRoom, MemoryInteraction, MemoryUpdateMechanism
+from .context_assembler import ContextAssembler
+from .prompt_diagnostics import PromptPrefixTracker
+from .response_cache import ResponseCache
+from .semantic_cache import get_semantic_cache
+from .memory import (MemoryRoom, MemoryInteraction, MemoryUpdateMechanism, MemoryJobQueue, MemoryJobRunner,
+                     MemoryAnalysisCache, get_consolidation_worker)
+from .memory.memory_hash import format_diff_summary
 from config import PromptManager
+from utils.token_counter import preload_encoding
 
 
 class LittlePrinceAgent:
@@ -13,6 +25,9 @@ class LittlePrinceAgent:
         self.config = config
         self.user_id = user_id
         
+        # 后台加载tokenizer词表，首轮对话不等待下载
+        preload_encoding(config.TOKENIZER_CACHE_DIR)
+        
         # 初始化LLM接口
         self.llm = LLMInterface(config)
         
@@ -22,15 +37,61 @@ class LittlePrinceAgent:
         # 初始化记忆交互模块
         self.memory_interaction = MemoryInteraction(config)
         
+        # 初始化上下文组装器（按模型token预算组装消息）
+        self.context_assembler = ContextAssembler(config)
+        
+        # 每轮提示词前缀稳定性诊断
+        self.prefix_tracker = PromptPrefixTracker()
+        self.last_turn_diagnostics: Dict[str, Any] = {}
+        
         # 初始化记忆更新机制
         self.memory_update_mechanism = MemoryUpdateMechanism(config, self.llm, self.memory_room)
+        if config.MEMORY_ANALYSIS_CACHE:
+            self.memory_update_mechanism.set_analysis_cache(MemoryAnalysisCache(
+                self.memory_room.database,
+                ttl_seconds=config.MEMORY_ANALYSIS_CACHE_TTL_SECONDS,
+                max_entries=config.MEMORY_ANALYSIS_CACHE_MAX_ENTRIES
+            ))
+        
+        # LLM回复精确匹配缓存（默认不启用）
+        if config.RESPONSE_CACHE:
+            self.llm.set_response_cache(ResponseCache(
+                self.memory_room.database,
+                ttl_seconds=config.RESPONSE_CACHE_TTL_SECONDS,
+                max_entries=config.RESPONSE_CACHE_MAX_ENTRIES,
+                memory_entries=config.RESPONSE_CACHE_MEMORY_ENTRIES
+            ))
+        
+        # LLM回复语义缓存（进程内共享，默认不启用）
+        if config.SEMANTIC_CACHE:
+            self.llm.set_semantic_cache(get_semantic_cache(config.SEMANTIC_CACHE_THRESHOLD,
+                                                           config.SEMANTIC_CACHE_MAX_ENTRIES))
+        
+        # 后台记忆整合工作器（进程内共享）
+        self.consolidation_worker = get_consolidation_worker(config.MEMORY_UPDATE_WORKERS)
         
-        # 同步轮数计数器与实际的短期记忆数量
+        # 持久化的记忆任务队列（整合与维护任务）
+        self.job_queue = MemoryJobQueue(
+            self.memory_room.database,
+            lease_seconds=config.MEMORY_JOB_LEASE_SECONDS,
+            max_attempts=config.MEMORY_JOB_MAX_ATTEMPTS,
+            retry_base_seconds=config.MEMORY_JOB_RETRY_BASE_SECONDS
+        )
+        # 退避中的任务到期时由定时器重新执行，用户不再对话时失败的整合也会按时重试或进入死信
+        self._job_retry_timer: Optional[threading.Timer] = None
+        self._job_retry_lock = threading.Lock()
+        
+        # 推测整合：批次将满时提前在后台分析，触发时直接提交暂存的结果
+        self._speculation: Optional[Dict[str, Any]] = None
+        self._speculation_lock = threading.Lock()
+        self._speculation_ids = itertools.count(1)
+        # 推测分析失败的批次（首条对话ID）；批次整合完成前不再对它推测，避免每轮重复调用失败的分析
+        self._speculation_failed_batch: Optional[int] = None
+        
+        # 从数据库同步持久化的整合状态（轮数计数器与累计量）
         if user_id:
-            stats = self.memory_room.get_memory_stats()
-            current_short_term_count = stats['short_term_count']
-            self.memory_update_mechanism.current_round = current_short_term_count
-            logger.info(f"同步轮数计数器: {current_short_term_count} 轮")
+            self.memory_update_mechanism.sync_state(self.memory_room.get_consolidation_state())
+            logger.info(f"同步轮数计数器: {self.memory_update_mechanism.current_round} 轮")
         
         # 初始化Prompt管理器
         self.prompt_manager = PromptManager()
@@ -41,51 +102,248 @@ class LittlePrinceAgent:
         # TODO: self.tools = ToolsManager()
         # TODO: self.knowledge = KnowledgeBase()
         
+        # 继续执行上次进程退出时未完成的记忆任务
+        if user_id and self.job_queue.has_runnable_jobs(user_id):
+            logger.info(f"发现用户 {user_id} 未完成的记忆任务，继续执行")
+            self.dispatch_memory_jobs()
+        
         logger.info("小王子AI Agent初始化完成")
     
     def set_user_id(self, user_id: str):
         """设置用户ID"""
         self.user_id = user_id
         self.memory_room.set_user_id(user_id)
+        with self._speculation_lock:
+            self._speculation = None
+            self._speculation_failed_batch = None
         logger.info(f"Agent用户ID已设置: {user_id}")
     
     def chat(self, user_input: str) -> str:
         """与用户对话"""
+        turn_start = time.monotonic()
         try:
-            # 1. 获取当前上下文
-            context = self.memory_interaction.get_context(self.memory_room)
+            # 1-3. 获取上下文并构建提示词
+            messages = self.prepare_turn_messages(user_input)
             
-            # 2. 获取增强的系统提示词（包含记忆上下文）
-            memory_context = self.memory_interaction.get_context_summary(self.memory_room)
-            enhanced_system_prompt = self.prompt_manager.get_enhanced_system_prompt(memory_context)
+            # 4. 调用LLM生成回复（复用上一轮已转换的消息对象，长期记忆变化时失效）
+            ai_response = self.llm.generate(messages, self.user_id, self._message_cache_version(),
+                                            self.use_response_cache(), self.semantic_cache_scope(),
+                                            self.turn_deadline_seconds(turn_start))
+            self.record_turn_diagnostics(messages)
             
-            # 3. 构建完整提示词
-            messages = self.build_chat_messages(user_input, context, enhanced_system_prompt)
-            
-            # 4. 调用LLM生成回复
-            ai_response = self.llm.generate(messages)
+            # 5-7. 更新记忆并检查是否需要整合
+            self.finish_turn(user_input, ai_response)
+            return ai_response
             
-            # 5. 更新记忆
-            self.memory_room.add_conversation(user_input, ai_response)
-            self.memory_update_mechanism.increment_round()
+        except Exception as e:
+            logger.error(f"对话处理失败: {e}")
+            return "抱歉，我遇到了一些问题，请稍后再试。"
+    
+    def chat_stream(self, user_input: str) -> Iterator[str]:
+        """与用户对话（流式），逐块返回回复文本
+
+        回复全部输出后才写入短期记忆并检查是否需要整合；调用方提前停止迭代时本轮对话不写入记忆。
+        首token时间记录在 get_last_turn_diagnostics() 的 first_token_ms 中。
+        """
+        turn_start = time.monotonic()
+        try:
+            messages = self.prepare_turn_messages(user_input)
+        except Exception as e:
+            logger.error(f"对话处理失败: {e}")
+            yield "抱歉，我遇到了一些问题，请稍后再试。"
+            return
+        
+        chunks = []
+        for chunk in self.llm.stream(messages, self.user_id, self._message_cache_version(),
+                                     self.use_response_cache(), self.semantic_cache_scope(),
+                                     self.turn_deadline_seconds(turn_start)):
+            chunks.append(chunk)
+            yield chunk
+        
+        try:
+            self.record_turn_diagnostics(messages)
+            self.finish_turn(user_input, "".join(chunks))
+        except Exception as e:
+            logger.error(f"对话处理失败: {e}")
+    
+    async def achat(self, user_input: str) -> str:
+        """与用户对话（异步）
+
+        LLM调用使用底层模型的ainvoke，记忆读写（SQLite）与整合调度在线程中执行，不阻塞事件循环，
+        单个事件循环即可同时驱动大量会话。
+        """
+        turn_start = time.monotonic()
+        try:
+            messages, cache_version, semantic_scope = await asyncio.to_thread(self._prepare_turn, user_input)
             
-            # 6. 检查是否需要更新长期记忆（优先于短期记忆清理）
-            if self.memory_update_mechanism.should_trigger_update():
-                self.execute_memory_update()
-            else:
-                # 只有在不需要更新长期记忆时才清理短期记忆
-                # 这样可以避免在记忆更新前清空短期记忆
-                self.memory_room.cleanup_short_term_memory_if_needed()
+            ai_response = await self.llm.agenerate(messages, self.user_id, cache_version,
+                                                   self.use_response_cache(), semantic_scope,
+                                                   self.turn_deadline_seconds(turn_start))
+            # 在下一次await之前读取本次调用的用量，不会被同一事件循环中的其它会话覆盖
+            self.record_turn_diagnostics(messages)
             
-            logger.debug(f"对话完成，当前轮数: {self.memory_update_mechanism.current_round}, 当前Prompt: {self.prompt_manager.get_prompt_name()}")
+            await asyncio.to_thread(self.finish_turn, user_input, ai_response)
             return ai_response
             
         except Exception as e:
             logger.error(f"对话处理失败: {e}")
             return "抱歉，我遇到了一些问题，请稍后再试。"
     
+    async def achat_stream(self, user_input: str) -> AsyncIterator[str]:
+        """与用户对话（异步流式），行为与chat_stream相同"""
+        turn_start = time.monotonic()
+        try:
+            messages, cache_version, semantic_scope = await asyncio.to_thread(self._prepare_turn, user_input)
+        except Exception as e:
+            logger.error(f"对话处理失败: {e}")
+            yield "抱歉，我遇到了一些问题，请稍后再试。"
+            return
+        
+        chunks = []
+        async for chunk in self.llm.astream(messages, self.user_id, cache_version,
+                                            self.use_response_cache(), semantic_scope,
+                                            self.turn_deadline_seconds(turn_start)):
+            chunks.append(chunk)
+            yield chunk
+        
+        try:
+            self.record_turn_diagnostics(messages)
+            await asyncio.to_thread(self.finish_turn, user_input, "".join(chunks))
+        except Exception as e:
+            logger.error(f"对话处理失败: {e}")
+    
+    def _prepare_turn(self, user_input: str):
+        """构建本轮提示词，并返回已转换消息缓存的版本和语义缓存作用域（均需读取数据库）"""
+        return self.prepare_turn_messages(user_input), self._message_cache_version(), self.semantic_cache_scope()
+    
+    def prepare_turn_messages(self, user_input: str) -> List[Dict[str, str]]:
+        """获取当前上下文并在模型token预算内构建本轮提示词"""
+        # 1. 获取当前上下文
+        long_term_context = self.memory_interaction.get_long_term_context(
+            self.memory_room, self.prompt_manager.current_prompt_name
+        )
+        short_term_memory = self.memory_room.get_short_term_memory()
+        summary_context = self.memory_interaction.format_summary_context(
+            self.memory_room.get_conversation_summary()
+        )
+        
+        # 2. 获取系统提示词（按配置的提示词布局）
+        system_prompt, static_messages = self.build_system_layout()
+        
+        # 3. 在模型token预算内构建完整提示词
+        return self.context_assembler.assemble(
+            system_prompt, long_term_context, short_term_memory, user_input, self.llm.model,
+            static_messages, summary_context
+        )
+    
+    def finish_turn(self, user_input: str, ai_response: str):
+        """回复生成后写入短期记忆，并检查是否需要整合长期记忆"""
+        # 5. 更新记忆（距上一轮空闲较久时先整合此前累计的对话）
+        self.consolidate_if_idle()
+        self.memory_room.add_conversation(user_input, ai_response)
+        if self.user_id:
+            # 轮数计数器在数据库中随对话原子递增
+            self.memory_update_mechanism.sync_state(self.memory_room.get_consolidation_state())
+        else:
+            self.memory_update_mechanism.increment_round()
+        
+        # 6. 检查是否需要更新长期记忆（优先于短期记忆清理）
+        trigger_reason = self.memory_update_mechanism.get_trigger_reason()
+        if trigger_reason:
+            logger.info(f"触发记忆整合: {trigger_reason}")
+            self.schedule_memory_update()
+        else:
+            # 只有在不需要更新长期记忆时才清理短期记忆
+            # 这样可以避免在记忆更新前清空短期记忆
+            # 滑出窗口的对话由后台任务并入滚动摘要后再清理，回复不等待摘要调用
+            self.schedule_summary_update()
+            
+            # 7. 批次将满时提前在后台分析，不增加触发那一轮的延迟
+            self.start_speculative_consolidation()
+        
+        logger.debug(f"对话完成，当前轮数: {self.memory_update_mechanism.current_round}, 当前Prompt: {self.prompt_manager.get_prompt_name()}")
+    
+    def build_system_layout(self):
+        """按提示词布局返回 (系统提示词, 静态消息)
+
+        legacy: 记忆统计写入首条系统消息，每轮都会变化；
+        cache_friendly: 人设与示例对话在前且完全静态，长期记忆与对话紧随其后，记忆统计不进入提示词。
+        """
+        if self.config.PROMPT_LAYOUT == "cache_friendly":
+            return self.prompt_manager.get_system_prompt(), self.prompt_manager.get_example_messages()
+        
+        memory_context = self.memory_interaction.get_context_summary(self.memory_room)
+        return self.prompt_manager.get_enhanced_system_prompt(memory_context), []
+    
+    def use_response_cache(self) -> bool:
+        """当前Prompt是否使用LLM回复缓存（RESPONSE_CACHE_PROMPTS为空时所有Prompt均使用）"""
+        if self.llm.response_cache is None:
+            return False
+        enabled_prompts = self.config.RESPONSE_CACHE_PROMPTS
+        return not enabled_prompts or self.prompt_manager.current_prompt_name in enabled_prompts
+    
+    def semantic_cache_scope(self) -> Optional[str]:
+        """语义缓存作用域（未启用时为None）：当前Prompt名称；按用户隔离或长期记忆非空时加上用户ID
+
+        长期记忆会进入提示词，含长期记忆的回复不跨用户复用。
+        """
+        if self.llm.semantic_cache is None:
+            return None
+        scope = self.prompt_manager.current_prompt_name
+        if self.config.SEMANTIC_CACHE_PER_USER or self._has_long_term_memory():
+            scope = f"{scope}:{self.user_id or f'anonymous-{id(self)}'}"
+        return scope
+    
+    def _has_long_term_memory(self) -> bool:
+        """当前用户的长期记忆是否有内容"""
+        memory = self.memory_room.get_long_term_memory()
+        return (any(memory.get('factual', {}).values()) or bool(memory.get('episodic'))
+                or any(memory.get('semantic', {}).values()))
+    
+    def get_response_cache_stats(self) -> Dict[str, Any]:
+        """获取LLM回复缓存的命中率与节省量统计（未启用时返回空字典；启用语义缓存时其统计在semantic中）"""
+        stats = self.llm.response_cache.get_stats() if self.llm.response_cache is not None else {}
+        if self.llm.semantic_cache is not None:
+            stats['semantic'] = self.llm.semantic_cache.get_stats()
+        return stats
+    
+    def turn_deadline_seconds(self, turn_start: float) -> Optional[float]:
+        """本轮对话剩余的截止时间（秒）：调用策略的截止时间从本轮开始计时，构建上下文的耗时同样计入；未设置截止时间时返回None"""
+        deadline_seconds = self.llm.call_policy.deadline_seconds
+        if not deadline_seconds:
+            return None
+        # 0表示不限制，已用完时仍传入一个极小的正数，使调用立即超时
+        return max(0.001, deadline_seconds - (time.monotonic() - turn_start))
+    
+    def _message_cache_version(self):
+        """已转换消息缓存的版本：长期记忆版本与当前Prompt"""
+        if not self.user_id:
+            return None
+        version = self.memory_room.version_tracker.get_version(self.user_id)
+        return (version['long_term_version'], self.prompt_manager.current_prompt_name)
+    
+    def record_turn_diagnostics(self, messages: List[Dict[str, str]]):
+        """记录本轮提示词前缀稳定性和提供商缓存命中情况"""
+        self.last_turn_diagnostics = self.prefix_tracker.record(self.user_id or "", messages)
+        self.last_turn_diagnostics['cache_hit_tokens'] = self.llm.last_usage.get('cache_hit_tokens', 0)
+        self.last_turn_diagnostics['input_tokens'] = self.llm.last_usage.get('input_tokens', 0)
+        # 流式调用时记录首token时间（毫秒）
+        self.last_turn_diagnostics['first_token_ms'] = self.llm.last_usage.get('first_token_ms')
+        self.last_turn_diagnostics['response_cache_hit'] = self.llm.last_usage.get('response_cache_hit', False)
+        self.last_turn_diagnostics['semantic_cache_hit'] = self.llm.last_usage.get('semantic_cache_hit', False)
+        
+        logger.debug(
+            f"提示词前缀: 稳定 {self.last_turn_diagnostics['stable_prefix_bytes']}/"
+            f"{self.last_turn_diagnostics['prompt_bytes']} 字节, "
+            f"缓存命中 {self.last_turn_diagnostics['cache_hit_tokens']} tokens"
+        )
+    
+    def get_last_turn_diagnostics(self) -> Dict[str, Any]:
+        """获取最近一轮对话的提示词诊断信息"""
+        return dict(self.last_turn_diagnostics)
+    
     def build_chat_messages(self, user_input: str, context: List[Dict[str, str]], system_prompt: str) -> List[Dict[str, str]]:
-        """构建聊天消息"""
+        """构建聊天消息（不做token预算限制）"""
         messages = []
         
         # 添加系统提示词
@@ -99,95 +357,253 @@ class LittlePrinceAgent:
         
         return messages
     
+    def consolidate_if_idle(self) -> bool:
+        """距最近一轮对话空闲超过MEMORY_UPDATE_IDLE_SECONDS时，整合已累计的对话"""
+        if not self.user_id or not self.config.MEMORY_UPDATE_IDLE_SECONDS:
+            return False
+        
+        self.memory_update_mechanism.sync_state(self.memory_room.get_consolidation_state())
+        idle_reason = self.memory_update_mechanism.get_idle_reason()
+        if not idle_reason:
+            return False
+        
+        logger.info(f"触发记忆整合: {idle_reason}")
+        self.schedule_memory_update()
+        return True
+    
+    def schedule_memory_update(self):
+        """安排记忆更新：写入持久化任务队列，默认由后台工作器执行，回复立即返回"""
+        if not self.user_id:
+            self.execute_memory_update()
+            return
+        
+        if self.job_queue.has_running_jobs(self.user_id, ['consolidate']):
+            logger.info("记忆整合正在后台进行，本轮不再重复提交")
+            return
+        
+        if self.job_queue.has_runnable_jobs(self.user_id, ['consolidate']):
+            # 已有待执行的整合任务（可能在失败退避中），执行时会一并分析新增的对话，不再重复入队
+            self.dispatch_memory_jobs()
+            return
+        
+        # 幂等键由短期记忆ID范围决定，同一批对话只会整合一次
+        id_range = self.memory_room.database.get_short_term_id_range(self.user_id)
+        if not id_range['count']:
+            return
+        self.job_queue.enqueue(
+            'consolidate', self.user_id,
+            {'first_id': id_range['first_id'], 'last_id': id_range['last_id']},
+            idempotency_key=f"consolidate:{self.user_id}:{id_range['first_id']}-{id_range['last_id']}"
+        )
+        # 顺带安排每日一次的任务表清理
+        self.job_queue.enqueue('purge_jobs', idempotency_key=f"purge_jobs:{date.today().isoformat()}")
+        
+        self.dispatch_memory_jobs()
+    
+    def schedule_summary_update(self):
+        """短期记忆超出轮数限制时安排滚动摘要任务：由后台工作器把滑出窗口的对话并入摘要后再清理
+
+        摘要生成期间的对话仍沿用已有摘要；同一用户的摘要与整合任务串行执行，不会清理尚未分析的对话。
+        """
+        if not self.user_id:
+            return
+        
+        id_range = self.memory_room.database.get_short_term_id_range(self.user_id)
+        if id_range['count'] <= self.memory_room.max_short_term_rounds:
+            return
+        
+        if not self.job_queue.has_runnable_jobs(self.user_id, ['summarize']):
+            # 执行时按当时的短期记忆计算滑出的对话，一个待执行的任务即可覆盖之后新增的溢出
+            self.job_queue.enqueue('summarize', self.user_id, {'last_id': id_range['last_id']},
+                                   idempotency_key=f"summarize:{self.user_id}:{id_range['last_id']}")
+        self.dispatch_memory_jobs()
+    
+    def start_speculative_consolidation(self) -> bool:
+        """距触发整合还差MEMORY_SPECULATIVE_ROUNDS轮以内时，在后台提前分析当前对话并暂存结果
+
+        触发整合时若这批对话和长期记忆都没有变化，直接提交暂存的结果，长期记忆在触发那一轮之后立即更新；
+        触发那一轮的对话留到下一批。推测期间记忆有变化时结果作废，按常规重新分析。
+        分析失败时记住这一批，批次变化（整合完成）之前不再推测。
+        """
+        lead_rounds = self.config.MEMORY_SPECULATIVE_ROUNDS
+        if not lead_rounds or not self.user_id or not self.config.MEMORY_UPDATE_BACKGROUND:
+            return False
+        if self.memory_update_mechanism.current_round < self.config.MEMORY_UPDATE_INTERVAL - lead_rounds:
+            return False
+        if self.consolidation_worker.is_busy(self.user_id):
+            return False
+        
+        with self._speculation_lock:
+            if self._speculation is not None:
+                return False
+            speculation_id = next(self._speculation_ids)
+            self._speculation = {'state': 'running', 'id': speculation_id}
+        
+        logger.info(f"批次将满（{self.memory_update_mechanism.current_round} 轮），开始推测整合")
+        self.consolidation_worker.submit(self.user_id, lambda: self._run_speculative_analysis(speculation_id))
+        return True
+    
+    def _run_speculative_analysis(self, speculation_id: int) -> Dict[str, Any]:
+        """在后台分析当前对话，结果只暂存不提交（暂存位已被取走或作废时丢弃结果）"""
+        speculation = None
+        try:
+            short_term = self.memory_room.get_unconsolidated_memory()
+            existing_long_term = self.memory_room.get_long_term_memory()
+            conversation_summary = self.memory_room.get_conversation_summary()
+            long_term_version = self.memory_room.version_tracker.get_version(self.user_id)['long_term_version']
+            batch_start = short_term[0].get('id') if short_term else None
+            if batch_start is not None and batch_start == self._speculation_failed_batch:
+                logger.debug(f"这批对话的推测分析已失败过（起始ID {batch_start}），不再推测")
+                speculation = {'state': 'failed', 'id': speculation_id}
+                return {'speculative_rounds': 0}
+            
+            new_long_term = self.memory_update_mechanism.update_memory(short_term, existing_long_term, conversation_summary)
+            if self.memory_update_mechanism.last_error:
+                logger.warning(f"推测整合分析失败，触发时按常规整合: {self.memory_update_mechanism.last_error}")
+                # 失败状态留在暂存位，触发整合前不再推测；整合失败后同一批也不再推测
+                self._speculation_failed_batch = batch_start
+                speculation = {'state': 'failed', 'id': speculation_id}
+            else:
+                speculation = {
+                    'state': 'ready',
+                    'id': speculation_id,
+                    'ids': [conv['id'] for conv in short_term if conv.get('id') is not None],
+                    'long_term_version': long_term_version,
+                    'summary': conversation_summary,
+                    'memory': new_long_term
+                }
+            return {'speculative_rounds': len(speculation['ids']) if speculation['state'] == 'ready' else 0}
+        finally:
+            with self._speculation_lock:
+                # 分析期间整合已取走暂存位或切换了用户时，结果已过期，不再写回
+                current = self._speculation
+                if current is not None and current['id'] == speculation_id:
+                    self._speculation = speculation
+                else:
+                    logger.info("推测整合结果已过期，丢弃")
+    
+    def _take_speculation(self, short_term: List[Dict[str, Any]], conversation_summary: str) -> Optional[Dict[str, Any]]:
+        """取出暂存的推测结果；分析过的对话已不在、长期记忆或摘要已变化时作废"""
+        with self._speculation_lock:
+            speculation, self._speculation = self._speculation, None
+        if not speculation or speculation['state'] != 'ready':
+            return None
+        
+        current_ids = {conv.get('id') for conv in short_term}
+        long_term_version = self.memory_room.version_tracker.get_version(self.user_id)['long_term_version']
+        if (not speculation['ids'] or not set(speculation['ids']) <= current_ids
+                or speculation['long_term_version'] != long_term_version
+                or speculation['summary'] != conversation_summary):
+            logger.info("推测整合期间记忆已变化，重新分析")
+            return None
+        return speculation
+    
+    def dispatch_memory_jobs(self):
+        """执行当前用户的记忆任务：后台模式提交到工作器，否则同步执行"""
+        if self.config.MEMORY_UPDATE_BACKGROUND:
+            self.consolidation_worker.submit(self.user_id, self.process_memory_jobs)
+        else:
+            self.process_memory_jobs()
+    
+    def process_memory_jobs(self) -> Dict[str, int]:
+        """从任务队列中领取并执行当前用户的记忆任务，直到队列为空"""
+        runner = MemoryJobRunner(self.job_queue, {
+            'consolidate': self._handle_consolidation_job,
+            'summarize': self._handle_summary_job,
+            'purge_jobs': lambda job: self.job_queue.purge_finished(self.config.MEMORY_JOB_RETENTION_DAYS)
+        }, concurrency=self.config.MEMORY_JOB_CONCURRENCY)
+        counts = runner.drain(self.user_id)
+        # 本次没有领取到任何任务时（例如其它进程正持有该用户的租约）至少间隔1秒再查
+        self._schedule_job_retry(list(runner.handlers), min_delay=0.0 if any(counts.values()) else 1.0)
+        return counts
+    
+    def _schedule_job_retry(self, job_types: List[str], min_delay: float = 0.0):
+        """队列中还有未到期的任务（失败退避或其它进程持有租约）时，到期后再次执行（只看有处理函数的任务类型）"""
+        if not self.user_id:
+            return
+        delay = self.job_queue.get_next_due_delay(self.user_id, job_types)
+        if delay is None:
+            return
+        delay = max(delay, min_delay)
+        
+        with self._job_retry_lock:
+            if self._job_retry_timer is not None:
+                self._job_retry_timer.cancel()
+            # 稍晚于到期时间，避免因时钟精度领取不到
+            self._job_retry_timer = threading.Timer(delay + 0.05, self.dispatch_memory_jobs)
+            self._job_retry_timer.daemon = True
+            self._job_retry_timer.start()
+        logger.debug(f"用户 {self.user_id} 的记忆任务将在 {delay:.1f} 秒后重试")
+    
+    def _handle_consolidation_job(self, job: Dict[str, Any]):
+        """整合任务处理：对应的对话已被整合（或清空）时直接完成，整合失败时抛出异常以便重试"""
+        payload = job['payload']
+        remaining = self.memory_room.database.count_short_term_in_range(
+            job['user_id'], payload['first_id'], payload['last_id']
+        )
+        if not remaining:
+            logger.info(f"任务 #{job['id']} 对应的短期记忆已不存在，跳过整合")
+            return
+        
+        if not self.execute_memory_update():
+            raise RuntimeError("长期记忆更新失败")
+    
+    def _handle_summary_job(self, job: Dict[str, Any]):
+        """滚动摘要任务处理：滑出窗口的对话并入摘要后从短期记忆中清理（已被整合时无事可做）"""
+        overflow_turns = self.memory_room.get_short_term_overflow()
+        if not overflow_turns:
+            return
+        self.memory_update_mechanism.update_rolling_summary(overflow_turns)
+        # 只清理并入摘要的对话，摘要生成期间新滑出窗口的对话留给下一个任务
+        self.memory_room.cleanup_short_term_memory_if_needed(up_to_id=overflow_turns[-1]['id'])
+    
+    def get_memory_update_status(self) -> Dict[str, Any]:
+        """获取后台记忆整合状态，供界面轮询"""
+        if not self.user_id:
+            return {'state': 'idle', 'runs': 0, 'pending': False, 'error': None}
+        return self.consolidation_worker.get_status(self.user_id)
+    
     def execute_memory_update(self):
         """执行记忆更新"""
         try:
-            short_term = self.memory_room.get_short_term_memory()
+            short_term = self.memory_room.get_unconsolidated_memory()
             existing_long_term = self.memory_room.get_long_term_memory()
+            conversation_summary = self.memory_room.get_conversation_summary()
             
             logger.info(f"开始记忆更新，短期记忆轮数: {len(short_term)}")
             
-            # 更新长期记忆
-            new_long_term = self.memory_update_mechanism.update_memory(short_term, existing_long_term)
-            
-            # 检查长期记忆是否成功更新
-            # 检查是否有实际的内容变化
-            has_changes = False
-            logger.info(f"开始检查记忆变化...")
-            logger.info(f"现有长期记忆: {existing_long_term}")
-            logger.info(f"新的长期记忆: {new_long_term}")
+            speculation = self._take_speculation(short_term, conversation_summary) if self.user_id else None
+            if speculation:
+                # 直接提交推测结果，推测之后新增的对话留到下一批
+                new_long_term = speculation['memory']
+                consumed_ids = speculation['ids']
+                logger.info(f"使用推测整合结果，{len(short_term) - len(consumed_ids)} 轮新对话留到下一批")
+            else:
+                # 更新长期记忆（滚动摘要覆盖的较早对话一并参与分析）
+                new_long_term = self.memory_update_mechanism.update_memory(short_term, existing_long_term, conversation_summary)
+                if self.memory_update_mechanism.last_error:
+                    logger.error(f"记忆分析失败，保留短期记忆: {self.memory_update_mechanism.last_error}")
+                    return False
+                consumed_ids = [conv['id'] for conv in short_term if conv.get('id') is not None]
             
-            if new_long_term:
-                # 检查事实记忆是否有变化
-                if 'factual' in new_long_term:
-                    logger.info(f"检查事实记忆: {new_long_term['factual']}")
-                    for key, value in new_long_term['factual'].items():
-                        if value:
-                            existing_value = existing_long_term.get('factual', {}).get(key, "")
-                            logger.info(f"  比较 {key}: '{value}' vs '{existing_value}'")
-                            # 改进比较逻辑：检查是否有新的或更新的内容
-                            if (key not in existing_long_term.get('factual', {}) or 
-                                existing_long_term['factual'][key] != value):
-                                logger.info(f"    ✅ 检测到变化")
-                                has_changes = True
-                                break
-                            else:
-                                logger.info(f"    ❌ 没有变化")
-                
-                # 检查情节记忆是否有变化 - 改进逻辑
-                if 'episodic' in new_long_term and new_long_term['episodic']:
-                    logger.info(f"检查情节记忆: {len(new_long_term['episodic'])} 项")
-                    existing_episodic = existing_long_term.get('episodic', [])
-                    
-                    # 如果新的情节记忆数量更多，或者内容不同，则认为有变化
-                    if (len(new_long_term['episodic']) > len(existing_episodic) or
-                        new_long_term['episodic'] != existing_episodic):
-                        logger.info(f"    ✅ 检测到变化 (新: {len(new_long_term['episodic'])}, 旧: {len(existing_episodic)})")
-                        has_changes = True
-                    else:
-                        logger.info(f"    ❌ 情节记忆没有变化")
-                
-                # 检查语义记忆是否有变化
-                if 'semantic' in new_long_term:
-                    logger.info(f"检查语义记忆: {new_long_term['semantic']}")
-                    for key, value in new_long_term['semantic'].items():
-                        if value:
-                            existing_value = existing_long_term.get('semantic', {}).get(key, "")
-                            logger.info(f"  比较 {key}: '{value}' vs '{existing_value}'")
-                            if (key not in existing_long_term.get('semantic', {}) or 
-                                existing_long_term['semantic'][key] != value):
-                                logger.info(f"    ✅ 检测到变化")
-                                has_changes = True
-                                break
-                            else:
-                                logger.info(f"    ❌ 没有变化")
-                
-                # 如果没有任何变化，但LLM确实生成了新的记忆内容，强制更新
-                if not has_changes and new_long_term:
-                    logger.info("虽然检测到没有变化，但LLM生成了新的记忆内容，强制更新")
-                    has_changes = True
+            # 在一个事务中写入长期记忆变化（按内容哈希比较）、删除本次分析过的短期记忆并更新轮计数
+            result = self.memory_room.commit_consolidation(new_long_term, consumed_ids)
+            if result is None:
+                logger.error("提交记忆整合失败，保留短期记忆")
+                return False
+            if result['diff']:
+                self.memory_interaction.invalidate_long_term_cache(self.user_id)
             
-            logger.info(f"最终比较结果: has_changes = {has_changes}")
+            # 数据库中的计数已扣除本批对话，分析期间新增的对话继续累计
+            self.memory_update_mechanism.sync_state(self.memory_room.get_consolidation_state())
+            logger.info(f"记忆整合完成: 消耗 {result['consumed']} 轮，{format_diff_summary(result['diff'])}")
             
-            if has_changes:
-                self.memory_room.update_long_term_memory(new_long_term)
-                logger.info(f"长期记忆更新成功，检测到变化")
-                
-                # 只有在长期记忆更新成功后才清空短期记忆
-                self.memory_room.clear_short_term_memory()
-                logger.info(f"短期记忆已清空")
-                
-                # 成功更新后重置对话轮计数，确保严格的批次语义（例如1-5总结后，从0重新计数）
-                self.memory_update_mechanism.current_round = 0
-                logger.info("对话轮计数已重置为0")
-
-                logger.info(f"第{self.memory_update_mechanism.current_round}轮：记忆更新完成")
-            else:
-                logger.warning(f"长期记忆更新失败或没有变化，保留短期记忆")
+            return True
             
         except Exception as e:
             logger.error(f"记忆更新失败: {e}")
             # 出错时不清空短期记忆，避免数据丢失
+            return False
     
     def get_memory_stats(self) -> Dict[str, Any]:
         """获取记忆统计信息"""
@@ -0,0 +1,113 @@
+from typing import List, Dict, Any, Optional
+from loguru import logger
+
+from utils.token_counter import count_message_tokens, count_conversation_tokens, MESSAGE_TOKEN_OVERHEAD, count_tokens
+
+
+class ContextAssembler:
+    """上下文组装器：在模型的token预算内按优先级组装聊天消息
+
+    优先级：系统提示词与当前用户输入（必须保留） > 长期记忆 > 最近的对话轮次（从新到旧）
+    """
+    
+    def __init__(self, config):
+        self.config = config
+        self.last_report: Dict[str, Any] = {}
+    
+    def assemble(self, system_prompt: str, long_term_context: List[Dict[str, str]],
+                 short_term_memory: List[Dict[str, Any]], user_input: str,
+                 model: Optional[str] = None,
+                 static_messages: Optional[List[Dict[str, str]]] = None,
+                 summary_context: Optional[List[Dict[str, str]]] = None) -> List[Dict[str, str]]:
+        """在token预算内组装消息列表
+
+        static_messages为紧跟系统提示词的静态消息（如示例对话），与系统提示词一样必须保留；
+        summary_context为已滑出窗口对话的滚动摘要，优先级排在长期记忆之后、最近对话之前。
+        """
+        budget = self.config.get_context_token_budget(model)
+        static_messages = static_messages or []
+        
+        system_message = {"role": "system", "content": system_prompt}
+        user_message = {"role": "user", "content": user_input}
+        
+        # 1. 系统提示词、静态消息和用户输入必须保留
+        used = count_message_tokens(system_message) + count_message_tokens(user_message)
+        used += sum(count_message_tokens(message) for message in static_messages)
+        
+        # 2. 长期记忆：放不下时按行截断，保留靠前（更重要）的部分
+        long_term_messages = []
+        long_term_trimmed = False
+        for message in long_term_context:
+            tokens = count_message_tokens(message)
+            if used + tokens <= budget:
+                long_term_messages.append(message)
+                used += tokens
+                continue
+            
+            trimmed = self._trim_message(message, budget - used)
+            if trimmed:
+                long_term_messages.append(trimmed)
+                used += count_message_tokens(trimmed)
+            long_term_trimmed = True
+            break
+        
+        # 3. 滚动对话摘要
+        summary_messages = []
+        for message in summary_context or []:
+            tokens = count_message_tokens(message)
+            if used + tokens <= budget:
+                summary_messages.append(message)
+                used += tokens
+        
+        # 4. 最近的对话：从最新一轮开始向前填充，使用随行保存的token数
+        recent_rounds = []
+        for conv in reversed(short_term_memory):
+            tokens = conv.get('token_count') or count_conversation_tokens(conv['user'], conv['ai'])
+            if used + tokens > budget:
+                break
+            recent_rounds.append(conv)
+            used += tokens
+        recent_rounds.reverse()
+        
+        messages = [system_message]
+        messages.extend(static_messages)
+        messages.extend(long_term_messages)
+        messages.extend(summary_messages)
+        for conv in recent_rounds:
+            messages.append({"role": "user", "content": conv['user']})
+            messages.append({"role": "assistant", "content": conv['ai']})
+        messages.append(user_message)
+        
+        self.last_report = {
+            'budget': budget,
+            'used_tokens': used,
+            'long_term_trimmed': long_term_trimmed,
+            'summary_included': bool(summary_messages),
+            'rounds_included': len(recent_rounds),
+            'rounds_dropped': len(short_term_memory) - len(recent_rounds)
+        }
+        
+        if used > budget:
+            logger.warning(f"系统提示词和用户输入已超出token预算: {used} > {budget}")
+        elif self.last_report['rounds_dropped'] or long_term_trimmed:
+            logger.debug(f"上下文受token预算限制: {self.last_report}")
+        
+        return messages
+    
+    def _trim_message(self, message: Dict[str, str], available_tokens: int) -> Optional[Dict[str, str]]:
+        """按行截断消息内容以适应剩余预算，连一行都放不下时返回None"""
+        available_tokens -= MESSAGE_TOKEN_OVERHEAD
+        kept_lines = []
+        used = 0
+        
+        for line in message['content'].split("\n"):
+            tokens = count_tokens(line) + 1
+            if used + tokens > available_tokens:
+                break
+            kept_lines.append(line)
+            used += tokens
+        
+        if not any(line.strip() for line in kept_lines):
+            return None
+        
+        return {"role": message['role'], "content": "\n".join(kept_lines).rstrip()}
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import re
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from utils.token_counter import count_tokens
+
+
+class FakeChatModel(BaseChatModel):
+    """本地模拟LLM，用于离线测试、基准测试和批量任务演练
+
+    根据系统提示词识别请求类型：记忆分析返回合法的JSON（按部分提取时只返回该部分），增量整合返回增删改操作，滚动摘要返回摘要文本，
+    其余请求循环返回预设回复。
+    延迟 = latency + 输入token数 * latency_per_input_token + 输出token数 * latency_per_output_token。
+    """
+    
+    responses: List[str] = ["你好呀，朋友！今天过得怎么样？✨"]
+    latency: float = 0.0
+    latency_per_input_token: float = 0.0
+    latency_per_output_token: float = 0.0
+    call_count: int = 0
+    stream_chunk_size: int = 8
+    
+    @property
+    def _llm_type(self) -> str:
+        return "fake-little-prince"
+    
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        content, input_tokens, output_tokens = self._respond(messages)
+        time.sleep(self._latency(input_tokens, output_tokens))
+        return self._build_result(content, input_tokens, output_tokens)
+    
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        content, input_tokens, output_tokens = self._respond(messages)
+        await asyncio.sleep(self._latency(input_tokens, output_tokens))
+        return self._build_result(content, input_tokens, output_tokens)
+    
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        content, input_tokens, output_tokens = self._respond(messages)
+        # 首个块之前只有固定延迟和输入延迟，输出延迟按块分摊，用于模拟首token时间
+        time.sleep(self._latency(input_tokens, 0))
+        for start in range(0, len(content), self.stream_chunk_size):
+            piece = content[start:start + self.stream_chunk_size]
+            if self.latency_per_output_token:
+                time.sleep(count_tokens(piece) * self.latency_per_output_token)
+            if run_manager:
+                run_manager.on_llm_new_token(piece)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+        # 最后一个块携带token用量
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata={
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'total_tokens': input_tokens + output_tokens
+        }))
+    
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        content, input_tokens, output_tokens = self._respond(messages)
+        await asyncio.sleep(self._latency(input_tokens, 0))
+        for start in range(0, len(content), self.stream_chunk_size):
+            piece = content[start:start + self.stream_chunk_size]
+            if self.latency_per_output_token:
+                await asyncio.sleep(count_tokens(piece) * self.latency_per_output_token)
+            if run_manager:
+                await run_manager.on_llm_new_token(piece)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata={
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'total_tokens': input_tokens + output_tokens
+        }))
+    
+    def _latency(self, input_tokens: int, output_tokens: int) -> float:
+        """计算模拟延迟"""
+        return (self.latency
+                + input_tokens * self.latency_per_input_token
+                + output_tokens * self.latency_per_output_token)
+    
+    def _build_result(self, content: str, input_tokens: int, output_tokens: int) -> ChatResult:
+        """构建带token用量的结果"""
+        message = AIMessage(content=content, usage_metadata={
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'total_tokens': input_tokens + output_tokens
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
+    
+    def _respond(self, messages: List[BaseMessage]):
+        """根据请求类型生成回复内容，返回 (内容, 输入token数, 输出token数)"""
+        self.call_count += 1
+        prompt_text = "\n".join(str(message.content) for message in messages)
+        system_text = str(messages[0].content) if messages else ""
+        
+        if "增量更新用户的长期记忆" in system_text:
+            content = self._incremental_response(prompt_text)
+        elif "提取用户的长期记忆信息" in system_text:
+            content = self._analysis_response(prompt_text)
+            section_match = re.search(r'本次只需提取[^（]*（(factual|episodic|semantic)）', system_text)
+            if section_match:
+                # 并行提取模式：只返回请求的部分
+                section = section_match.group(1)
+                content = json.dumps({section: json.loads(content)[section]}, ensure_ascii=False)
+        elif "此前对话摘要" in system_text and "新滑出窗口的对话" in system_text:
+            content = self._summary_response(prompt_text)
+        else:
+            content = self.responses[(self.call_count - 1) % len(self.responses)]
+        
+        return content, count_tokens(prompt_text), count_tokens(content)
+    
+    def _analysis_response(self, prompt_text: str) -> str:
+        """模拟记忆分析：从对话中提取简单的事实"""
+        name_match = re.search(r'用户: [^\n]*?我叫([^\s，。！,.!]+)', prompt_text)
+        like_match = re.search(r'用户: [^\n]*?我喜欢([^\s，。！,.!]+)', prompt_text)
+        rounds = len(re.findall(r'^\s*用户: ', prompt_text, re.MULTILINE))
+        
+        result = {
+            "factual": {
+                "identity": name_match.group(1) if name_match else "",
+                "preferences": like_match.group(1) if like_match else "",
+                "interests": "",
+                "important_people": "",
+                "taboos": ""
+            },
+            "episodic": [
+                {"type": "用户经历", "content": f"与小王子进行了{rounds}轮对话", "timestamp": ""}
+            ] if rounds else [],
+            "semantic": {"values": "", "themes": "", "goals": ""}
+        }
+        return json.dumps(result, ensure_ascii=False)
+    
+    def _incremental_response(self, prompt_text: str) -> str:
+        """模拟增量整合：为提到的事实生成update操作，并为本批对话添加一条情节记忆"""
+        conversations = prompt_text.split("自上次整合以来的新对话", 1)[-1]
+        ops = []
+        for key, pattern in (('identity', r'用户: [^\n]*?我叫([^\s，。！,.!]+)'),
+                             ('preferences', r'用户: [^\n]*?我喜欢([^\s，。！,.!]+)')):
+            match = re.search(pattern, conversations)
+            if match:
+                ops.append({"op": "update", "section": "factual", "key": key, "value": match.group(1)})
+        
+        rounds = len(re.findall(r'^\s*用户: ', conversations, re.MULTILINE))
+        if rounds:
+            ops.append({"op": "add", "section": "episodic",
+                        "value": {"type": "用户经历", "content": f"与小王子进行了{rounds}轮对话", "timestamp": ""}})
+        return json.dumps({"ops": ops}, ensure_ascii=False)
+    
+    def _summary_response(self, prompt_text: str) -> str:
+        """模拟滚动摘要：在已有摘要后追加每轮用户发言的开头"""
+        existing_match = re.search(r'用户此前聊到：(.*)', prompt_text)
+        points = existing_match.group(1).split("；") if existing_match else []
+        points.extend(line[:12] for line in re.findall(r'^\s*用户: (.*)$', prompt_text, re.MULTILINE))
+        return f"用户此前聊到：{'；'.join(points[-10:])}"
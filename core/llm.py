@@ -1,9 +1,15 @@
-from typing import List, Dict, Any, Optional
+import asyncio
+import threading
+import time
+from typing import List, Dict, Any, Optional, Hashable, Iterator, AsyncIterator
 from loguru import logger
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage, BaseMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_openai import ChatOpenAI
-from langchain_deepseek import ChatDeepSeek
+
+from .llm_policy import LLMCallPolicy
+from .llm_registry import LLMClientRegistry, get_llm_client_registry
+from .rate_limiter import BACKGROUND, INTERACTIVE, get_rate_limiter
+from utils.token_counter import count_tokens, MESSAGE_TOKEN_OVERHEAD
 
 
 class LLMInterface:
@@ -15,42 +21,341 @@ class LLMInterface:
         self.temperature = config.TEMPERATURE
         self.provider = config.LLM_PROVIDER.lower()
         
+        # 最近一次调用的token用量（含提供商返回的前缀缓存命中数），按线程分别记录，
+        # 后台整合或并行提取与对话共用同一接口时互不覆盖
+        self._usage_local = threading.local()
+        self.last_usage: Dict[str, int] = {}
+        
+        # 已转换的LangChain消息缓存：cache_key -> (版本, [(role, content, message)])
+        self._message_cache: Dict[str, Any] = {}
+        self._conversion_stats = {'converted': 0, 'reused': 0}
+        
+        # LLM回复精确匹配缓存与语义缓存（由调用方按需设置，默认不缓存）
+        self.response_cache = None
+        self.semantic_cache = None
+        
+        # 调用策略：超时、截止时间、重试与对冲（按提供商配置）
+        self.call_policy = LLMCallPolicy.from_config(config, self.provider)
+        
+        # 提供商配额限流（每分钟请求数与token数），同一提供商与API密钥的所有接口共享，未配置限额时为None
+        self.rate_limiter = self._get_rate_limiter()
+        
         # 根据提供商初始化不同的LLM
         self.llm = self._initialize_llm()
         
         logger.info(f"LLM初始化完成: {self.provider} - {self.model}")
     
-    def _initialize_llm(self):
-        """根据配置初始化LLM"""
-        if self.provider == "openai":
-            return ChatOpenAI(
-                model=self.model,
-                temperature=self.temperature,
-                openai_api_key=self.config.LLM_API_KEY
-            )
-        elif self.provider == "deepseek":
-            return ChatDeepSeek(
-                model=self.model,
-                temperature=self.temperature,
-                deepseek_api_key=self.config.LLM_API_KEY
-            )
-        else:
-            raise ValueError(f"不支持的LLM提供商: {self.provider}")
+    @property
+    def last_usage(self) -> Dict[str, int]:
+        """当前线程最近一次调用的token用量"""
+        return getattr(self._usage_local, 'usage', {})
+    
+    @last_usage.setter
+    def last_usage(self, usage: Dict[str, int]):
+        self._usage_local.usage = usage
+    
+    def _initialize_llm(self, provider: Optional[str] = None, model: Optional[str] = None,
+                        api_key: Optional[str] = None):
+        """根据配置获取LLM客户端：真实提供商从进程内共享的客户端注册表取得（连接池复用）"""
+        provider = provider or self.provider
+        if provider == "fake":
+            # 本地模拟LLM，用于离线测试和基准测试（带有调用计数等状态，每个接口单独创建）
+            from .fake_llm import FakeChatModel
+            return FakeChatModel(latency=getattr(self.config, 'FAKE_LLM_LATENCY', 0.0))
+        
+        registry = get_llm_client_registry(
+            max_connections=self.config.LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=self.config.LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=self.config.LLM_HTTP_KEEPALIVE_EXPIRY
+        )
+        # HTTP客户端超时与单次请求超时一致（未设置时用截止时间），被放弃的请求在线程池中最多再占用这么久
+        policy = self.config.get_call_policy(provider)
+        return registry.get_client(provider, model or self.model, self.temperature,
+                                   api_key or self.config.LLM_API_KEY, self.config.LLM_BASE_URL,
+                                   policy['timeout_seconds'] or policy['deadline_seconds'])
+    
+    def _get_rate_limiter(self, provider: Optional[str] = None, api_key: Optional[str] = None):
+        """取得按提供商与API密钥指纹共享的限流器"""
+        provider = provider or self.provider
+        fingerprint = LLMClientRegistry.fingerprint(api_key or self.config.LLM_API_KEY)
+        return get_rate_limiter(
+            f"{provider}:{fingerprint}",
+            requests_per_minute=self.config.LLM_RATE_LIMIT_RPM,
+            tokens_per_minute=self.config.LLM_RATE_LIMIT_TPM,
+            background_reserve=self.config.LLM_RATE_LIMIT_BACKGROUND_RESERVE,
+            db_path=self.config.LLM_RATE_LIMIT_DB_PATH
+        )
+    
+    def _estimate_request_tokens(self, messages) -> int:
+        """估算一次调用的token数：输入消息（字典或LangChain消息）加上预估的输出token数"""
+        input_tokens = 0
+        for message in messages:
+            content = message.get("content", "") if isinstance(message, dict) else message.content
+            input_tokens += count_tokens(content if isinstance(content, str) else str(content)) + MESSAGE_TOKEN_OVERHEAD
+        return input_tokens + self.config.LLM_RATE_LIMIT_OUTPUT_TOKENS
+    
+    def _attempt_quota(self, messages, priority: str = INTERACTIVE):
+        """调用策略的on_attempt回调：每次发出请求（首次、重试与对冲）前取得一份配额
+
+        返回 (回调, 每次预扣的token数)，未限流时为 (None, 0)。首次与重试的请求等待配额，
+        超过LLM_RATE_LIMIT_MAX_WAIT_SECONDS时抛出RateLimitTimeout；对冲请求只在配额立即可用时发出。
+        调用完成后只有成功的请求按实际用量修正，失败或落败的请求保持预扣。
+        """
+        if self.rate_limiter is None:
+            return None, 0
+        estimated_tokens = self._estimate_request_tokens(messages)
+        max_wait = self.config.LLM_RATE_LIMIT_MAX_WAIT_SECONDS or None
+        
+        def on_attempt(hedge: bool) -> bool:
+            if hedge:
+                return self.rate_limiter.try_acquire(estimated_tokens, priority)
+            self.rate_limiter.acquire(estimated_tokens, priority, max_wait)
+            return True
+        
+        return on_attempt, estimated_tokens
+    
+    def _aattempt_quota(self, messages, priority: str = INTERACTIVE):
+        """_attempt_quota的异步版本（SQLite存储的配额在线程中扣除，不阻塞事件循环）"""
+        if self.rate_limiter is None:
+            return None, 0
+        estimated_tokens = self._estimate_request_tokens(messages)
+        max_wait = self.config.LLM_RATE_LIMIT_MAX_WAIT_SECONDS or None
+        
+        async def on_attempt(hedge: bool) -> bool:
+            if hedge:
+                return await asyncio.to_thread(self.rate_limiter.try_acquire, estimated_tokens, priority)
+            await self.rate_limiter.aacquire(estimated_tokens, priority, max_wait)
+            return True
+        
+        return on_attempt, estimated_tokens
+    
+    def _settle_quota(self, estimated_tokens: int):
+        """调用完成后按last_usage中的实际用量修正预扣的token数（提供商未返回用量时保持预扣）"""
+        if self.rate_limiter is None or not estimated_tokens:
+            return
+        actual_tokens = self.last_usage.get('input_tokens', 0) + self.last_usage.get('output_tokens', 0)
+        if actual_tokens:
+            self.rate_limiter.record_usage(estimated_tokens, actual_tokens)
+    
+    def set_response_cache(self, response_cache):
+        """设置LLM回复精确匹配缓存（None表示不缓存）"""
+        self.response_cache = response_cache
+    
+    def set_semantic_cache(self, semantic_cache):
+        """设置LLM回复语义缓存（None表示不缓存）"""
+        self.semantic_cache = semantic_cache
     
-    def generate(self, messages: List[Dict[str, str]]) -> str:
-        """生成回复 - 使用LangChain消息格式"""
+    def generate(self, messages: List[Dict[str, str]], cache_key: Optional[str] = None,
+                 cache_version: Optional[Hashable] = None, use_response_cache: bool = False,
+                 semantic_scope: Optional[str] = None, deadline_seconds: Optional[float] = None) -> str:
+        """生成回复 - 使用LangChain消息格式
+
+        指定cache_key（通常为用户ID）时复用上一轮已转换的消息对象，cache_version变化时整体失效。
+        use_response_cache为True且已设置回复缓存时，完全相同的请求直接返回缓存的回复（last_usage中response_cache_hit为True）；
+        指定semantic_scope且已设置语义缓存时，同一作用域内上下文相同、最后一条用户消息措辞相近的请求复用已有回复。
+        deadline_seconds覆盖调用策略的截止时间（对话时为本轮剩余的时间）。
+        """
         try:
+            cache_keys, cached = self._lookup_response(messages, use_response_cache, semantic_scope)
+            if cached is not None:
+                return cached['response']
+            
             # 转换消息格式
-            langchain_messages = self._convert_messages(messages)
+            langchain_messages = self._convert_messages(messages, cache_key, cache_version)
             
-            # 调用LLM
-            response = self.llm.invoke(langchain_messages)
+            # 调用LLM（超时、重试与对冲由调用策略处理，每次发出请求前各取得一份配额）
+            on_attempt, estimated_tokens = self._attempt_quota(messages)
+            start_time = time.perf_counter()
+            response = self.call_policy.call(lambda: self.llm.invoke(langchain_messages), deadline_seconds, on_attempt)
+            self.last_usage = self._extract_usage(response)
+            self._settle_quota(estimated_tokens)
+            self._store_response(cache_keys, response.content, (time.perf_counter() - start_time) * 1000)
             return response.content
             
         except Exception as e:
             logger.error(f"LLM调用失败: {e}")
             return "抱歉，我现在无法回应，请稍后再试。"
     
+    def stream(self, messages: List[Dict[str, str]], cache_key: Optional[str] = None,
+               cache_version: Optional[Hashable] = None, use_response_cache: bool = False,
+               semantic_scope: Optional[str] = None, deadline_seconds: Optional[float] = None) -> Iterator[str]:
+        """流式生成回复，逐块返回文本
+
+        参数与generate相同。流结束后last_usage除token用量外还记录首token时间first_token_ms和总耗时total_ms；
+        调用失败且尚未输出任何内容时返回与generate相同的兜底回复，已输出部分内容时直接结束。
+        命中回复缓存时整段回复作为一个块返回；完整输出的回复才会写入缓存。
+        """
+        start_time = time.perf_counter()
+        first_token_ms = None
+        aggregated = None
+        estimated_tokens = 0
+        try:
+            cache_keys, cached = self._lookup_response(messages, use_response_cache, semantic_scope)
+            if cached is not None:
+                yield cached['response']
+                return
+            
+            langchain_messages = self._convert_messages(messages, cache_key, cache_version)
+            on_attempt, estimated_tokens = self._attempt_quota(messages)
+            
+            for chunk in self._stream_chunks(self.llm, langchain_messages, on_attempt, deadline_seconds):
+                aggregated = chunk if aggregated is None else aggregated + chunk
+                if not chunk.content:
+                    continue
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - start_time) * 1000
+                yield chunk.content
+                
+        except Exception as e:
+            logger.error(f"LLM流式调用失败: {e}")
+            if first_token_ms is None:
+                yield "抱歉，我现在无法回应，请稍后再试。"
+            cache_keys = None
+        
+        self.last_usage = self._stream_usage(aggregated, first_token_ms, start_time)
+        self._settle_quota(estimated_tokens)
+        if aggregated is not None:
+            self._store_response(cache_keys, aggregated.content, self.last_usage['total_ms'])
+    
+    async def agenerate(self, messages: List[Dict[str, str]], cache_key: Optional[str] = None,
+                        cache_version: Optional[Hashable] = None, use_response_cache: bool = False,
+                        semantic_scope: Optional[str] = None, deadline_seconds: Optional[float] = None) -> str:
+        """异步生成回复（使用底层模型的ainvoke），参数与generate相同
+
+        last_usage按线程记录，同一事件循环中的并发调用共用一份：需要用量时应在await返回后、下一次await之前读取。
+        """
+        try:
+            cache_keys, cached = self._lookup_response(messages, use_response_cache, semantic_scope)
+            if cached is not None:
+                return cached['response']
+            
+            langchain_messages = self._convert_messages(messages, cache_key, cache_version)
+            
+            on_attempt, estimated_tokens = self._aattempt_quota(messages)
+            start_time = time.perf_counter()
+            response = await self.call_policy.acall(lambda: self.llm.ainvoke(langchain_messages), deadline_seconds,
+                                                    on_attempt)
+            self.last_usage = self._extract_usage(response)
+            self._settle_quota(estimated_tokens)
+            self._store_response(cache_keys, response.content, (time.perf_counter() - start_time) * 1000)
+            return response.content
+            
+        except Exception as e:
+            logger.error(f"LLM异步调用失败: {e}")
+            return "抱歉，我现在无法回应，请稍后再试。"
+    
+    async def astream(self, messages: List[Dict[str, str]], cache_key: Optional[str] = None,
+                      cache_version: Optional[Hashable] = None, use_response_cache: bool = False,
+                      semantic_scope: Optional[str] = None,
+                      deadline_seconds: Optional[float] = None) -> AsyncIterator[str]:
+        """异步流式生成回复（使用底层模型的astream），行为与stream相同"""
+        start_time = time.perf_counter()
+        first_token_ms = None
+        aggregated = None
+        estimated_tokens = 0
+        try:
+            cache_keys, cached = self._lookup_response(messages, use_response_cache, semantic_scope)
+            if cached is not None:
+                yield cached['response']
+                return
+            
+            langchain_messages = self._convert_messages(messages, cache_key, cache_version)
+            on_attempt, estimated_tokens = self._aattempt_quota(messages)
+            
+            async for chunk in self._astream_chunks(self.llm, langchain_messages, on_attempt, deadline_seconds):
+                aggregated = chunk if aggregated is None else aggregated + chunk
+                if not chunk.content:
+                    continue
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - start_time) * 1000
+                yield chunk.content
+                
+        except Exception as e:
+            logger.error(f"LLM异步流式调用失败: {e}")
+            if first_token_ms is None:
+                yield "抱歉，我现在无法回应，请稍后再试。"
+            cache_keys = None
+        
+        self.last_usage = self._stream_usage(aggregated, first_token_ms, start_time)
+        self._settle_quota(estimated_tokens)
+        if aggregated is not None:
+            self._store_response(cache_keys, aggregated.content, self.last_usage['total_ms'])
+    
+    def _stream_chunks(self, model, messages, on_attempt=None, deadline_seconds: Optional[float] = None) -> Iterator[Any]:
+        """按调用策略打开流：取得第一个块之前可超时、重试和对冲，之后的块直接读取（已输出的内容无法重试）"""
+        def open_stream():
+            chunks = iter(model.stream(messages))
+            return next(chunks, None), chunks
+        
+        first, chunks = self.call_policy.call(open_stream, deadline_seconds, on_attempt)
+        if first is not None:
+            yield first
+            yield from chunks
+    
+    async def _astream_chunks(self, model, messages, on_attempt=None,
+                              deadline_seconds: Optional[float] = None) -> AsyncIterator[Any]:
+        """_stream_chunks的异步版本"""
+        async def open_stream():
+            chunks = model.astream(messages).__aiter__()
+            try:
+                return await chunks.__anext__(), chunks
+            except StopAsyncIteration:
+                return None, chunks
+        
+        first, chunks = await self.call_policy.acall(open_stream, deadline_seconds, on_attempt)
+        if first is not None:
+            yield first
+            async for chunk in chunks:
+                yield chunk
+    
+    def _stream_usage(self, aggregated, first_token_ms: Optional[float], start_time: float) -> Dict[str, Any]:
+        """流式调用的token用量，附带首token时间和总耗时"""
+        usage = self._extract_usage(aggregated) if aggregated is not None else {}
+        usage['first_token_ms'] = first_token_ms
+        usage['total_ms'] = (time.perf_counter() - start_time) * 1000
+        return usage
+    
+    def _lookup_response(self, messages: List[Dict[str, str]], use_response_cache: bool,
+                         semantic_scope: Optional[str] = None):
+        """依次查询精确匹配缓存和语义缓存，返回 (写入缓存所需的键, 命中的条目)；均未启用时键为None
+
+        命中时last_usage记为零用量并标记response_cache_hit或semantic_cache_hit。
+        """
+        cache_keys = {}
+        if use_response_cache and self.response_cache is not None:
+            cache_keys['response_key'] = self.response_cache.make_key(
+                self.provider, self.model, self.temperature, messages
+            )
+            cached = self.response_cache.get(cache_keys['response_key'])
+            if cached is not None:
+                self.last_usage = {'input_tokens': 0, 'output_tokens': 0, 'cache_hit_tokens': 0,
+                                   'response_cache_hit': True, 'first_token_ms': 0.0, 'total_ms': 0.0}
+                return cache_keys, cached
+        
+        if (semantic_scope is not None and self.semantic_cache is not None
+                and messages and messages[-1]["role"] == "user"):
+            context_digest = self.semantic_cache.make_context_digest(
+                self.provider, self.model, self.temperature, messages
+            )
+            cache_keys['semantic'] = (semantic_scope, context_digest, messages[-1]["content"])
+            cached = self.semantic_cache.lookup(*cache_keys['semantic'])
+            if cached is not None:
+                self.last_usage = {'input_tokens': 0, 'output_tokens': 0, 'cache_hit_tokens': 0,
+                                   'semantic_cache_hit': True, 'semantic_similarity': cached['similarity'],
+                                   'first_token_ms': 0.0, 'total_ms': 0.0}
+                return cache_keys, cached
+        
+        return cache_keys or None, None
+    
+    def _store_response(self, cache_keys: Optional[Dict[str, Any]], response: str, latency_ms: float):
+        """将成功生成的回复写入已启用的回复缓存"""
+        if not cache_keys or not response:
+            return
+        if 'response_key' in cache_keys:
+            self.response_cache.put(cache_keys['response_key'], response, self.last_usage, latency_ms, self.model)
+        if 'semantic' in cache_keys:
+            self.semantic_cache.add(*cache_keys['semantic'], response, self.last_usage, latency_ms)
+    
     def generate_from_prompt(self, prompt: str) -> str:
         """从提示词生成回复"""
         try:
@@ -60,32 +365,95 @@ class LLMInterface:
             ])
             
             # 生成回复
-            response = self.llm.invoke(prompt_template.format_messages())
+            prompt_messages = prompt_template.format_messages()
+            on_attempt, estimated_tokens = self._attempt_quota(prompt_messages)
+            response = self.call_policy.call(lambda: self.llm.invoke(prompt_messages), on_attempt=on_attempt)
+            self.last_usage = self._extract_usage(response)
+            self._settle_quota(estimated_tokens)
             return response.content
             
         except Exception as e:
             logger.error(f"提示词生成失败: {e}")
             return "抱歉，我现在无法回应，请稍后再试。"
     
-    def _convert_messages(self, messages: List[Dict[str, str]]) -> List[BaseMessage]:
+    def _extract_usage(self, response) -> Dict[str, int]:
+        """从响应中提取token用量，兼容DeepSeek和OpenAI的缓存命中字段"""
+        usage = getattr(response, 'usage_metadata', None) or {}
+        token_usage = (getattr(response, 'response_metadata', None) or {}).get('token_usage') or {}
+        
+        # LangChain标准字段 -> DeepSeek原始字段 -> OpenAI原始字段
+        cache_hit_tokens = (usage.get('input_token_details') or {}).get('cache_read')
+        if cache_hit_tokens is None:
+            cache_hit_tokens = token_usage.get('prompt_cache_hit_tokens')
+        if cache_hit_tokens is None:
+            cache_hit_tokens = (token_usage.get('prompt_tokens_details') or {}).get('cached_tokens')
+        
+        return {
+            'input_tokens': usage.get('input_tokens', token_usage.get('prompt_tokens', 0)) or 0,
+            'output_tokens': usage.get('output_tokens', token_usage.get('completion_tokens', 0)) or 0,
+            'cache_hit_tokens': cache_hit_tokens or 0
+        }
+    
+    def _convert_messages(self, messages: List[Dict[str, str]], cache_key: Optional[str] = None,
+                          cache_version: Optional[Hashable] = None) -> List[BaseMessage]:
         """转换消息格式为LangChain格式"""
-        langchain_messages = []
+        if cache_key is None:
+            return [self._convert_message(msg["role"], msg["content"]) for msg in messages]
+        
+        cached = self._message_cache.get(cache_key)
+        previous = cached[1] if cached and cached[0] == cache_version else []
         
-        for msg in messages:
+        converted = []
+        lookup = None
+        for index, msg in enumerate(messages):
             role = msg["role"]
             content = msg["content"]
             
-            if role == "system":
-                langchain_messages.append(SystemMessage(content=content))
-            elif role == "user":
-                langchain_messages.append(HumanMessage(content=content))
-            elif role == "assistant":
-                langchain_messages.append(AIMessage(content=content))
+            # 稳定状态下前缀逐位命中；窗口滑动导致错位时按内容查找
+            if index < len(previous) and previous[index][0] == role and previous[index][1] == content:
+                converted.append(previous[index])
+                self._conversion_stats['reused'] += 1
+                continue
+            
+            if lookup is None:
+                lookup = {(item[0], item[1]): item for item in previous}
+            item = lookup.get((role, content))
+            if item is None:
+                item = (role, content, self._convert_message(role, content))
+                self._conversion_stats['converted'] += 1
             else:
-                logger.warning(f"未知的消息角色: {role}")
-                langchain_messages.append(HumanMessage(content=content))
+                self._conversion_stats['reused'] += 1
+            converted.append(item)
         
-        return langchain_messages
+        self._message_cache[cache_key] = (cache_version, converted)
+        return [item[2] for item in converted]
+    
+    def _convert_message(self, role: str, content: str) -> BaseMessage:
+        """转换单条消息"""
+        if role == "system":
+            return SystemMessage(content=content)
+        elif role == "user":
+            return HumanMessage(content=content)
+        elif role == "assistant":
+            return AIMessage(content=content)
+        else:
+            logger.warning(f"未知的消息角色: {role}")
+            return HumanMessage(content=content)
+    
+    def clear_message_cache(self, cache_key: Optional[str] = None):
+        """清除已转换的消息缓存"""
+        if cache_key is None:
+            self._message_cache.clear()
+        else:
+            self._message_cache.pop(cache_key, None)
+    
+    def get_call_stats(self) -> Dict[str, Any]:
+        """获取调用策略统计（重试、超时、对冲次数与近期耗时）"""
+        return self.call_policy.get_stats()
+    
+    def get_conversion_stats(self) -> Dict[str, int]:
+        """获取消息转换统计（新建与复用的消息对象数）"""
+        return dict(self._conversion_stats)
     
     def create_prompt_template(self, template: str) -> ChatPromptTemplate:
         """创建提示模板"""
@@ -96,25 +464,53 @@ class LLMInterface:
         ])
     
     def switch_model(self, provider: str, model: str, api_key: Optional[str] = None):
-        """动态切换模型"""
+        """动态切换模型：从共享的客户端注册表取得对应客户端，取得失败时保持当前模型不变"""
         try:
-            self.provider = provider.lower()
+            provider = provider.lower()
+            self.llm = self._initialize_llm(provider, model, api_key)
+            if provider != self.provider:
+                self.call_policy = LLMCallPolicy.from_config(self.config, provider)
+            self.rate_limiter = self._get_rate_limiter(provider, api_key)
+            self.provider = provider
             self.model = model
             if api_key:
                 self.config.LLM_API_KEY = api_key
-            
-            # 重新初始化LLM
-            self.llm = self._initialize_llm()
             logger.info(f"模型切换成功: {self.provider} - {self.model}")
             
         except Exception as e:
             logger.error(f"模型切换失败: {e}")
             raise
+    
+    def invoke_json(self, messages, validator) -> Any:
+        """以JSON模式流式调用LLM，每个输出块到达时交给validator校验
 
+        validator需提供 feed(chunk) 和 close()；输出损坏时feed抛出异常，流立即中止（不再等待剩余输出）。
+        取得第一个块之前的网络错误按调用策略重试，之后的调用错误直接抛出，由调用方决定是否重试。
+        """
+        model = self.llm
+        if self.provider in ("openai", "deepseek") and getattr(self.config, 'LLM_JSON_MODE', True):
+            # OpenAI与DeepSeek均支持json_object输出格式
+            model = self.llm.bind(response_format={"type": "json_object"})
+        
+        # 后台整合使用低优先级通道，为对话回复让路
+        on_attempt, estimated_tokens = self._attempt_quota(messages, BACKGROUND)
+        aggregated = None
+        try:
+            for chunk in self._stream_chunks(model, messages, on_attempt):
+                aggregated = chunk if aggregated is None else aggregated + chunk
+                validator.feed(chunk.content)
+        finally:
+            self.last_usage = self._extract_usage(aggregated) if aggregated is not None else {}
+            self._settle_quota(estimated_tokens)
+        return validator.close()
+    
     def invoke_direct(self, messages) -> str:
         """直接调用LLM，供记忆更新机制使用"""
         try:
-            response = self.llm.invoke(messages)
+            on_attempt, estimated_tokens = self._attempt_quota(messages, BACKGROUND)
+            response = self.call_policy.call(lambda: self.llm.invoke(messages), on_attempt=on_attempt)
+            self.last_usage = self._extract_usage(response)
+            self._settle_quota(estimated_tokens)
             return response.content
         except Exception as e:
             logger.error(f"直接LLM调用失败: {e}")
@@ -0,0 +1,372 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from loguru import logger
+
+
+# 可重试的HTTP状态码：请求超时、冲突、限流与服务端错误
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CallPool:
+    """执行带超时或对冲的同步调用的线程池，同一提供商的所有调用策略共享
+
+    超时的请求无法取消，在后台自然结束（最长为HTTP客户端的超时时间，即单次请求超时），期间继续占用线程；
+    还在排队的请求可以取消。
+    """
+    
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"llm-call-{name}")
+        self._pending = 0  # 已提交未完成的任务数（含被放弃仍在运行的请求）
+        self._lock = threading.Lock()
+    
+    def submit(self, fn: Callable, *args) -> Any:
+        """提交任务并记录未完成的任务数"""
+        with self._lock:
+            self._pending += 1
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._task_done)
+        return future
+    
+    def _task_done(self, _future):
+        with self._lock:
+            self._pending -= 1
+    
+    def saturated(self) -> bool:
+        """是否已没有空闲线程（新任务需要排队）"""
+        with self._lock:
+            return self._pending >= self.max_workers
+
+
+_pools: Dict[Tuple[str, int], CallPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_call_pool(name: str, max_workers: int) -> CallPool:
+    """获取进程内按名称（通常为提供商）与大小共享的线程池"""
+    key = (name, max(1, max_workers))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = CallPool(*key)
+            _pools[key] = pool
+        return pool
+
+
+class LLMCallTimeout(TimeoutError):
+    """单次请求超时或整次调用超出截止时间"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """判断错误是否值得重试：超时、连接错误、限流和服务端错误"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status_code = getattr(error, 'status_code', None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES or status_code >= 500
+    # openai.APIConnectionError / APITimeoutError 与 httpx传输错误
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError") or \
+        type(error).__module__.startswith("httpx")
+
+
+def is_timeout(error: BaseException) -> bool:
+    """判断错误是否为超时（本策略的超时或HTTP客户端的超时）"""
+    return isinstance(error, TimeoutError) or \
+        type(error).__name__ in ("APITimeoutError", "ReadTimeout", "ConnectTimeout", "WriteTimeout", "PoolTimeout")
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """读取响应中的Retry-After（秒），没有时返回None"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMCallPolicy:
+    """LLM调用策略：单次请求超时、整次调用截止时间、带抖动的指数退避重试和可选的对冲请求
+
+    对冲：请求在hedge_delay（近期成功请求耗时的p95，样本不足时用hedge_delay_seconds）内未返回时
+    再发出一个相同的请求，先成功返回的结果被采用；线程池已满时不对冲。只对可重试的错误重试，且不会超出截止时间。
+    同步调用在按提供商共享的线程池（max_concurrency个线程）中执行，排队时间计入单次请求超时，
+    排队到超时仍未执行的请求不再发出，单独计入queue_timeouts；异步调用（acall）在事件循环中执行，超时的请求被取消。
+    """
+    
+    def __init__(self, timeout_seconds: float = 60.0, deadline_seconds: float = 90.0, max_retries: int = 2,
+                 retry_base_seconds: float = 0.5, retry_max_seconds: float = 8.0, hedge: bool = False,
+                 hedge_delay_seconds: float = 2.0, hedge_min_samples: int = 20, max_concurrency: int = 32,
+                 pool_name: str = "default"):
+        self.timeout_seconds = timeout_seconds
+        self.deadline_seconds = deadline_seconds
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.hedge = hedge
+        self.hedge_delay_seconds = hedge_delay_seconds
+        self.hedge_min_samples = hedge_min_samples
+        self.pool = get_call_pool(pool_name, max_concurrency)
+        
+        # 近期成功请求的耗时（秒），用于计算对冲延迟
+        self._latencies = deque(maxlen=200)
+        self._lock = threading.Lock()
+        self._stats = {
+            'calls': 0, 'attempts': 0, 'retries': 0, 'timeouts': 0, 'queued': 0, 'queue_timeouts': 0,
+            'hedges': 0, 'hedge_wins': 0, 'hedges_skipped': 0, 'failures': 0, 'deadline_exceeded': 0
+        }
+    
+    @classmethod
+    def from_config(cls, config, provider: str) -> "LLMCallPolicy":
+        """按提供商读取配置中的调用策略"""
+        return cls(pool_name=provider, **config.get_call_policy(provider))
+    
+    def call(self, request: Callable[[], Any], deadline_seconds: Optional[float] = None,
+             on_attempt: Optional[Callable[[bool], bool]] = None) -> Any:
+        """按策略执行请求（无参函数），返回首个成功的结果；重试耗尽或超出截止时间时抛出最后的错误
+
+        deadline_seconds覆盖配置的截止时间（对话时为本轮剩余的时间，见LittlePrinceAgent），0表示不限制。
+        on_attempt在每次发出请求（首次、重试与对冲）之前调用，参数表示是否为对冲请求（例如按次取得配额）：
+        对冲请求时返回False则不发出；首次与重试时抛出的异常直接抛给调用方，不再重试。
+        """
+        deadline = self._deadline(deadline_seconds)
+        self._count('calls')
+        
+        attempt = 0
+        while True:
+            if on_attempt is not None:
+                on_attempt(False)
+            try:
+                return self._attempt(request, deadline, on_attempt)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+    
+    async def acall(self, request: Callable[[], Awaitable[Any]], deadline_seconds: Optional[float] = None,
+                    on_attempt: Optional[Callable[[bool], Awaitable[bool]]] = None) -> Any:
+        """call的异步版本，request与on_attempt均为返回可等待对象的函数"""
+        deadline = self._deadline(deadline_seconds)
+        self._count('calls')
+        
+        attempt = 0
+        while True:
+            if on_attempt is not None:
+                await on_attempt(False)
+            try:
+                return await self._aattempt(request, deadline, on_attempt)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+    
+    def _deadline(self, deadline_seconds: Optional[float]) -> float:
+        deadline_seconds = self.deadline_seconds if deadline_seconds is None else deadline_seconds
+        return time.monotonic() + deadline_seconds if deadline_seconds else float('inf')
+    
+    def _retry_delay(self, error: Exception, attempt: int, deadline: float) -> Optional[float]:
+        """第attempt次尝试失败后的重试等待秒数，不应重试时返回None"""
+        remaining = deadline - time.monotonic()
+        if attempt >= self.max_retries or not is_retryable(error):
+            self._count('failures')
+            return None
+        
+        # 全抖动指数退避，服务端给出Retry-After时至少等待该时长
+        delay = random.uniform(0, min(self.retry_max_seconds, self.retry_base_seconds * (2 ** attempt)))
+        delay = max(delay, retry_after_seconds(error) or 0.0)
+        if delay >= remaining:
+            self._count('failures')
+            self._count('deadline_exceeded')
+            return None
+        
+        self._count('retries')
+        logger.warning(f"LLM调用失败，{delay:.2f}秒后第{attempt + 1}次重试: {error}")
+        return delay
+    
+    def _attempt_timeout(self, deadline: float) -> float:
+        """本次请求可用的秒数（不限制时为inf），已超出截止时间时抛出LLMCallTimeout"""
+        self._count('attempts')
+        timeout = min(self.timeout_seconds or float('inf'), deadline - time.monotonic())
+        if timeout <= 0:
+            self._count('deadline_exceeded')
+            raise LLMCallTimeout("LLM调用超出截止时间")
+        return timeout
+    
+    def _should_hedge(self, on_attempt: Optional[Callable[[bool], bool]]) -> bool:
+        """发出对冲请求前检查线程池（已满时对冲请求只会排队）和on_attempt（例如配额不足）"""
+        if self.pool.saturated():
+            self._count('hedges_skipped')
+            logger.debug("LLM调用线程池已满，跳过对冲请求")
+            return False
+        if on_attempt is not None and not on_attempt(True):
+            self._count('hedges_skipped')
+            logger.debug("对冲请求未取得配额，跳过")
+            return False
+        return True
+    
+    def _attempt(self, request: Callable[[], Any], deadline: float,
+                 on_attempt: Optional[Callable[[bool], bool]] = None) -> Any:
+        """执行一次请求（可能带一个对冲请求），超时抛出LLMCallTimeout"""
+        timeout = self._attempt_timeout(deadline)
+        if timeout == float('inf'):
+            if not self.hedge:
+                # 没有任何时间限制且不对冲时在当前线程直接执行
+                return self._timed(request)
+            timeout = None
+        
+        # 从提交开始计时：在线程池中排队的时间同样计入超时，排队到超时的请求不再发出
+        start_time = time.monotonic()
+        expires_at = None if timeout is None else start_time + timeout
+        primary = self._submit(request, expires_at)
+        futures = {primary}
+        hedge_future = None
+        
+        if self.hedge:
+            hedge_delay = self.get_hedge_delay() if timeout is None else min(self.get_hedge_delay(), timeout)
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done and self._should_hedge(on_attempt):
+                hedge_future = self._submit(request, expires_at)
+                futures.add(hedge_future)
+                self._count('hedges')
+                logger.debug(f"LLM请求 {hedge_delay:.2f}秒未返回，发出对冲请求")
+        
+        error = None
+        while futures:
+            wait_timeout = None if timeout is None else max(0.0, timeout - (time.monotonic() - start_time))
+            done, futures = wait(futures, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    if is_timeout(e):
+                        # HTTP客户端的超时与单次请求超时相同，可能先于本策略的计时触发
+                        self._count('timeouts')
+                    continue
+                if future is hedge_future:
+                    self._count('hedge_wins')
+                return result
+        
+        if error is not None and not futures:
+            raise error
+        # 还在排队的请求直接取消；所有请求都没有开始执行时，超时是线程池已满造成的，未到达提供商
+        cancelled = [future for future in futures if future.cancel()]
+        if futures and len(cancelled) == len(futures):
+            self._count('queue_timeouts')
+            logger.warning(f"LLM调用线程池 {self.pool.name} 已满（{self.pool.max_workers}个线程），"
+                           f"请求排队 {timeout:.1f} 秒未执行")
+            raise LLMCallTimeout(f"LLM请求在线程池中排队超过 {timeout:.1f} 秒未执行")
+        self._count('timeouts')
+        raise LLMCallTimeout(f"LLM请求超过 {timeout:.1f} 秒未返回")
+    
+    def _submit(self, request: Callable[[], Any], expires_at: Optional[float]) -> Any:
+        """提交到线程池，没有空闲线程需要排队时计入queued"""
+        if self.pool.saturated():
+            self._count('queued')
+            logger.debug(f"LLM调用线程池 {self.pool.name} 已满，请求排队等待")
+        return self.pool.submit(self._timed, request, expires_at)
+    
+    async def _aattempt(self, request: Callable[[], Awaitable[Any]], deadline: float,
+                        on_attempt: Optional[Callable[[bool], Awaitable[bool]]] = None) -> Any:
+        """_attempt的异步版本，超时或落败的请求被取消"""
+        timeout = self._attempt_timeout(deadline)
+        if timeout == float('inf'):
+            timeout = None
+        
+        start_time = time.monotonic()
+        primary = asyncio.ensure_future(self._atimed(request))
+        tasks = {primary}
+        hedge_task = None
+        try:
+            if self.hedge:
+                hedge_delay = self.get_hedge_delay() if timeout is None else min(self.get_hedge_delay(), timeout)
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done and on_attempt is not None and not await on_attempt(True):
+                    self._count('hedges_skipped')
+                    logger.debug("对冲请求未取得配额，跳过")
+                elif not done:
+                    hedge_task = asyncio.ensure_future(self._atimed(request))
+                    tasks.add(hedge_task)
+                    self._count('hedges')
+                    logger.debug(f"LLM请求 {hedge_delay:.2f}秒未返回，发出对冲请求")
+            
+            error = None
+            while tasks:
+                wait_timeout = None if timeout is None else max(0.0, timeout - (time.monotonic() - start_time))
+                done, tasks = await asyncio.wait(tasks, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        error = e
+                        if is_timeout(e):
+                            self._count('timeouts')
+                        continue
+                    if task is hedge_task:
+                        self._count('hedge_wins')
+                    return result
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        if error is not None and not tasks:
+            raise error
+        self._count('timeouts')
+        raise LLMCallTimeout(f"LLM请求超过 {timeout:.1f} 秒未返回")
+    
+    def _timed(self, request: Callable[[], Any], expires_at: Optional[float] = None) -> Any:
+        """执行请求并记录成功请求的耗时；在线程池中排队到expires_at之后才开始时不再发出请求"""
+        start_time = time.monotonic()
+        if expires_at is not None and start_time >= expires_at:
+            raise LLMCallTimeout("LLM请求在线程池中排队超时，未发出")
+        result = request()
+        self._record_latency(time.monotonic() - start_time)
+        return result
+    
+    async def _atimed(self, request: Callable[[], Awaitable[Any]]) -> Any:
+        start_time = time.monotonic()
+        result = await request()
+        self._record_latency(time.monotonic() - start_time)
+        return result
+    
+    def _record_latency(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+    
+    def get_hedge_delay(self) -> float:
+        """对冲延迟：近期成功请求耗时的p95，样本不足时使用配置的固定值"""
+        with self._lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return self.hedge_delay_seconds
+            latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调用统计：调用、尝试、重试、超时（线程池排队超时单独计数）、对冲（含因线程池已满或配额不足跳过的）次数，以及近期请求耗时的p50/p95（毫秒）"""
+        with self._lock:
+            stats = dict(self._stats)
+            latencies = sorted(self._latencies)
+        if latencies:
+            stats['p50_ms'] = latencies[len(latencies) // 2] * 1000
+            stats['p95_ms'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+        return stats
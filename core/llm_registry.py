@@ -0,0 +1,164 @@
+import asyncio
+import hashlib
+import threading
+import weakref
+from typing import Any, Dict, Optional, Tuple
+import httpx
+from loguru import logger
+from langchain_openai import ChatOpenAI
+from langchain_deepseek import ChatDeepSeek
+
+
+class LoopLocalAsyncTransport(httpx.AsyncBaseTransport):
+    """按事件循环分别维护连接池的异步传输层
+
+    httpx的异步连接绑定在创建它的事件循环上，而进程内可能先后或同时存在多个事件循环
+    （多次asyncio.run、各线程各自的循环）。同一个事件循环中的所有客户端共用一个连接池，
+    事件循环被回收后其连接池随之释放。
+    """
+    
+    def __init__(self, limits: httpx.Limits):
+        self.limits = limits
+        self._transports = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+    
+    def _get_transport(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = httpx.AsyncHTTPTransport(limits=self.limits)
+                self._transports[loop] = transport
+            return transport
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._get_transport().handle_async_request(request)
+    
+    async def aclose(self):
+        """关闭当前事件循环的连接池"""
+        with self._lock:
+            transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+
+class LLMClientRegistry:
+    """进程内共享的LLM客户端注册表
+
+    按 (提供商, 模型, 温度, API密钥指纹, 服务地址) 复用已创建的ChatOpenAI/ChatDeepSeek客户端（线程安全），
+    所有客户端共用一个带keep-alive连接池的同步HTTP客户端和一个异步HTTP客户端（每个事件循环一个连接池）：
+    每次登录或切换配置新建Agent时不再重新构造客户端，也不再重新建立TLS连接。API密钥只以哈希指纹出现在键中。
+    重试由LLMCallPolicy负责，客户端自身不再重试；request_timeout作为HTTP层的兜底超时。
+    """
+    
+    def __init__(self, max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 60.0):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        
+        self._clients: Dict[Tuple[str, str, float, str, Optional[str]], Any] = {}
+        self._http_client = None
+        self._http_async_client = None
+        self._lock = threading.Lock()
+        self._stats = {'created': 0, 'reused': 0}
+    
+    @staticmethod
+    def fingerprint(api_key: Optional[str]) -> str:
+        """API密钥的指纹（不可逆），用于区分不同密钥的客户端"""
+        if not api_key:
+            return ""
+        return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+    
+    def get_client(self, provider: str, model: str, temperature: float, api_key: Optional[str],
+                   base_url: Optional[str] = None, request_timeout: Optional[float] = None):
+        """获取共享客户端，不存在时创建（request_timeout只在创建时生效）"""
+        provider = provider.lower()
+        key = (provider, model, temperature, self.fingerprint(api_key), base_url)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._stats['reused'] += 1
+                return client
+            
+            client = self._create_client(provider, model, temperature, api_key, base_url, request_timeout)
+            self._clients[key] = client
+            self._stats['created'] += 1
+            logger.info(f"创建共享LLM客户端: {provider} - {model} (temperature={temperature}, key={key[3]})")
+            return client
+    
+    def _create_client(self, provider: str, model: str, temperature: float, api_key: Optional[str],
+                       base_url: Optional[str] = None, request_timeout: Optional[float] = None):
+        """根据提供商创建客户端"""
+        options = {'timeout': request_timeout or None, 'max_retries': 0, 'http_client': self._get_http_client(),
+                   'http_async_client': self._get_http_async_client()}
+        if provider == "openai":
+            if base_url:
+                options['base_url'] = base_url
+            else:
+                # 传入自定义HTTP客户端后LangChain不再默认开启流式用量统计，官方接口保持开启
+                options['stream_usage'] = True
+            return ChatOpenAI(
+                model=model,
+                temperature=temperature,
+                openai_api_key=api_key,
+                **options
+            )
+        elif provider == "deepseek":
+            if base_url:
+                options['api_base'] = base_url
+            return ChatDeepSeek(
+                model=model,
+                temperature=temperature,
+                api_key=api_key,
+                **options
+            )
+        else:
+            raise ValueError(f"不支持的LLM提供商: {provider}")
+    
+    def _get_http_client(self):
+        """所有客户端共用的同步HTTP客户端（keep-alive连接池）"""
+        if self._http_client is None:
+            self._http_client = httpx.Client(limits=self._get_limits())
+        return self._http_client
+    
+    def _get_limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry
+        )
+    
+    def _get_http_async_client(self):
+        """所有客户端共用的异步HTTP客户端（agenerate/astream使用），连接池按事件循环区分"""
+        if self._http_async_client is None:
+            self._http_async_client = httpx.AsyncClient(transport=LoopLocalAsyncTransport(self._get_limits()))
+        return self._http_async_client
+    
+    def clear(self):
+        """清空注册表并关闭共享的同步HTTP客户端（已取得的客户端不应再使用；异步连接池随事件循环释放）"""
+        with self._lock:
+            self._clients.clear()
+            if self._http_client is not None:
+                self._http_client.close()
+                self._http_client = None
+            self._http_async_client = None
+    
+    def get_stats(self) -> Dict[str, int]:
+        """获取注册表统计：客户端数、新建与复用次数"""
+        with self._lock:
+            return {'clients': len(self._clients), **self._stats}
+
+
+_registry: Optional[LLMClientRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_llm_client_registry(max_connections: int = 100, max_keepalive_connections: int = 20,
+                            keepalive_expiry: float = 60.0) -> LLMClientRegistry:
+    """获取进程内共享的LLM客户端注册表（连接池参数以首次调用为准）"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = LLMClientRegistry(max_connections, max_keepalive_connections, keepalive_expiry)
+        return _registry
@@ -1,5 +1,12 @@
 from .memory_room import MemoryRoom
 from .memory_interaction import MemoryInteraction
 from .memory_update_mechanism import MemoryUpdateMechanism
+from .memory_version import MemoryVersionTracker
+from .consolidation_worker import ConsolidationWorker, get_consolidation_worker
+from .job_queue import MemoryJobQueue, MemoryJobRunner
+from .batch_consolidation import BatchConsolidator
+from .analysis_cache import MemoryAnalysisCache
 
-__all__ = ['MemoryRoom', 'MemoryInteraction', 'MemoryUpdateMechanism']
+__all__ = ['MemoryRoom', 'MemoryInteraction', 'MemoryUpdateMechanism', 'MemoryVersionTracker',
+           'ConsolidationWorker', 'get_consolidation_worker', 'MemoryJobQueue', 'MemoryJobRunner',
+           'BatchConsolidator', 'MemoryAnalysisCache']
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import time
+from typing import Any, Dict, Optional
+from loguru import logger
+
+
+# 结果格式或校验规则变化时递增，使旧的缓存结果失效
+ANALYSIS_CACHE_VERSION = 1
+
+
+class MemoryAnalysisCache:
+    """记忆分析结果的持久化缓存（存储在记忆数据库的 memory_analysis_cache 表中）
+
+    键为 (缓存版本, 提供商, 模型, 完整提示词消息) 的哈希：提示词模板改动后键随之变化，
+    重试、重新运行批量整合或重复发送相同对话时直接复用已校验的分析结果。
+    超过有效期的条目不再命中，条目数超过上限时按最近使用时间淘汰。
+    """
+    
+    def __init__(self, database, ttl_seconds: float = 7 * 86400, max_entries: int = 1000):
+        self.database = database
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+    
+    def make_key(self, provider: str, model: str, prompt_messages: list) -> str:
+        """计算提示词消息的缓存键"""
+        messages = [[getattr(message, 'type', ''), getattr(message, 'content', str(message))]
+                    for message in prompt_messages]
+        canonical = json.dumps([ANALYSIS_CACHE_VERSION, provider, model, messages],
+                               ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+    
+    def get(self, cache_key: str) -> Optional[Any]:
+        """读取未过期的缓存结果，未命中时返回None"""
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                now = time.time()
+                cursor.execute('''
+                    SELECT result FROM memory_analysis_cache
+                    WHERE cache_key = ? AND created_at > ?
+                ''', (cache_key, now - self.ttl_seconds))
+                row = cursor.fetchone()
+                
+                if row is None:
+                    self.misses += 1
+                    return None
+                
+                cursor.execute('''
+                    UPDATE memory_analysis_cache SET last_used_at = ?, hit_count = hit_count + 1
+                    WHERE cache_key = ?
+                ''', (now, cache_key))
+                conn.commit()
+                self.hits += 1
+                logger.info(f"记忆分析命中缓存: {cache_key[:12]}")
+                return json.loads(row[0])
+        
+        except Exception as e:
+            logger.error(f"读取记忆分析缓存失败: {e}")
+            return None
+    
+    def put(self, cache_key: str, result: Any, model: str = "") -> bool:
+        """写入分析结果，并淘汰过期和超出数量上限的条目"""
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                now = time.time()
+                cursor.execute('''
+                    INSERT OR REPLACE INTO memory_analysis_cache
+                        (cache_key, result, model, created_at, last_used_at, hit_count)
+                    VALUES (?, ?, ?, ?, ?, 0)
+                ''', (cache_key, json.dumps(result, ensure_ascii=False), model, now, now))
+                evicted = self._evict(cursor, now)
+                conn.commit()
+                
+                if evicted:
+                    logger.debug(f"淘汰 {evicted} 条记忆分析缓存")
+                return True
+        
+        except Exception as e:
+            logger.error(f"写入记忆分析缓存失败: {e}")
+            return False
+    
+    def _evict(self, cursor, now: float) -> int:
+        """删除过期条目，再按最近使用时间删除超出上限的条目"""
+        cursor.execute('DELETE FROM memory_analysis_cache WHERE created_at <= ?', (now - self.ttl_seconds,))
+        evicted = cursor.rowcount
+        cursor.execute('''
+            DELETE FROM memory_analysis_cache WHERE cache_key IN (
+                SELECT cache_key FROM memory_analysis_cache
+                ORDER BY last_used_at DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_entries,))
+        return evicted + cursor.rowcount
+    
+    def clear(self) -> int:
+        """清空缓存，返回删除的条目数"""
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM memory_analysis_cache')
+                conn.commit()
+                return cursor.rowcount
+        
+        except Exception as e:
+            logger.error(f"清空记忆分析缓存失败: {e}")
+            return 0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计：条目数、累计命中次数及本实例的命中/未命中次数"""
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT COUNT(*), COALESCE(SUM(hit_count), 0) FROM memory_analysis_cache')
+                entries, total_hits = cursor.fetchone()
+        except Exception as e:
+            logger.error(f"获取记忆分析缓存统计失败: {e}")
+            entries, total_hits = 0, 0
+        
+        return {'entries': entries, 'total_hits': total_hits, 'hits': self.hits, 'misses': self.misses}
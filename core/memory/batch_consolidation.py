@@ -0,0 +1,217 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+from loguru import logger
+
+from .analysis_cache import MemoryAnalysisCache
+from .memory_database import MemoryDatabase
+from .memory_update_mechanism import MemoryUpdateMechanism
+
+
+class _RequestRateLimiter:
+    """简单的请求速率限制：相邻两次请求至少间隔 60/requests_per_minute 秒"""
+    
+    def __init__(self, requests_per_minute: float = 0):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+    
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class BatchConsolidator:
+    """离线批量记忆整合：对所有有待整合内容的用户重新运行记忆分析
+
+    以有限的并发和请求速率调用LLM，结果攒够一批后在一个事务中写入，
+    并将已完成的用户记录到检查点文件，中断后可从检查点继续。
+    """
+    
+    def __init__(self, config, llm_factory, concurrency: int = 4, requests_per_minute: float = 0,
+                 batch_size: int = 50, checkpoint_path: Optional[str] = None, database: Optional[MemoryDatabase] = None):
+        self.config = config
+        self.llm_factory = llm_factory
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.checkpoint_path = checkpoint_path
+        self.database = database or MemoryDatabase(getattr(config, 'MEMORY_DB_PATH', "data/memory.sqlite"))
+        self.rate_limiter = _RequestRateLimiter(requests_per_minute)
+        
+        # 每个工作线程使用独立的LLM和记忆更新机制，token用量互不干扰
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending_results: List[Dict[str, Any]] = []
+        self._write_failures: List[str] = []  # 已整合但批量写入失败的用户
+        self._checkpoint = {'completed': [], 'failed': {}}
+    
+    def list_users(self, user_manager=None) -> List[str]:
+        """列出需要整合的用户：数据库中有短期记忆或滚动摘要的用户（可用UserManager补充已注册用户）"""
+        user_ids = set(self.database.get_users_with_pending_memory())
+        if user_manager is not None:
+            user_ids.update(user['user_id'] for user in user_manager.get_all_users())
+        return sorted(user_ids)
+    
+    def run(self, user_ids: Iterable[str], resume: bool = False, progress_every: int = 100) -> Dict[str, Any]:
+        """对给定用户执行整合，返回统计报告"""
+        self._load_checkpoint(resume)
+        self._write_failures = []
+        completed_before = set(self._checkpoint['completed'])
+        user_ids = [user_id for user_id in user_ids if user_id not in completed_before]
+        
+        report = {'total': len(user_ids), 'completed': 0, 'skipped': 0, 'failed': 0,
+                  'tokens': 0, 'failures': {}, 'resumed_from_checkpoint': len(completed_before)}
+        start_time = time.perf_counter()
+        logger.info(f"开始批量整合 {len(user_ids)} 个用户（并发 {self.concurrency}，已跳过检查点中的 {len(completed_before)} 个）")
+        
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch-consolidation") as executor:
+            futures = {executor.submit(self._consolidate_user, user_id): user_id for user_id in user_ids}
+            for finished, future in enumerate(as_completed(futures), 1):
+                user_id = futures[future]
+                outcome, tokens, error = future.result()
+                report[outcome] += 1
+                report['tokens'] += tokens
+                if error:
+                    report['failures'][user_id] = error
+                
+                if finished % progress_every == 0:
+                    self._log_progress(report, finished, start_time)
+        
+        self._flush_results()
+        
+        # 整合成功但批量写入失败的用户改记为失败
+        for user_id in self._write_failures:
+            report['completed'] -= 1
+            report['failed'] += 1
+            report['failures'][user_id] = "批量写入失败"
+        
+        elapsed = time.perf_counter() - start_time
+        minutes = elapsed / 60 if elapsed else 0
+        report['elapsed_seconds'] = elapsed
+        report['users_per_minute'] = (report['completed'] + report['skipped']) / minutes if minutes else 0.0
+        report['tokens_per_minute'] = report['tokens'] / minutes if minutes else 0.0
+        logger.info(f"批量整合完成: 成功 {report['completed']}，跳过 {report['skipped']}，失败 {report['failed']}，"
+                    f"{report['users_per_minute']:.1f} 用户/分钟，{report['tokens_per_minute']:.0f} tokens/分钟")
+        return report
+    
+    def _consolidate_user(self, user_id: str):
+        """整合单个用户，返回 (结果, token数, 错误信息)"""
+        try:
+            short_term = self.database.get_short_term_memory(user_id)
+            summary = self.database.get_conversation_summary(user_id)['summary']
+            if not short_term and not summary:
+                self._record_result(user_id, None)
+                return 'skipped', 0, None
+            
+            mechanism = self._get_mechanism()
+            existing = self.database.get_long_term_memory(user_id)
+            
+            self.rate_limiter.acquire()
+            new_memory = mechanism.update_memory(short_term, existing, summary)
+            tokens = mechanism.last_usage.get('input_tokens', 0) + mechanism.last_usage.get('output_tokens', 0)
+            
+            if mechanism.last_error:
+                self._record_failure(user_id, mechanism.last_error)
+                return 'failed', tokens, mechanism.last_error
+            
+            self._record_result(user_id, {
+                'user_id': user_id,
+                'memory': new_memory,
+                'consumed_short_term_ids': [row['id'] for row in short_term]
+            })
+            return 'completed', tokens, None
+        
+        except Exception as e:
+            logger.error(f"用户 {user_id} 整合失败: {e}")
+            self._record_failure(user_id, str(e))
+            return 'failed', 0, str(e)
+    
+    def _get_mechanism(self) -> MemoryUpdateMechanism:
+        """获取当前线程的记忆更新机制"""
+        mechanism = getattr(self._local, 'mechanism', None)
+        if mechanism is None:
+            mechanism = MemoryUpdateMechanism(self.config, self.llm_factory())
+            if getattr(self.config, 'MEMORY_ANALYSIS_CACHE', False):
+                # 重新运行批量整合时，已分析过的对话直接复用缓存结果
+                mechanism.set_analysis_cache(MemoryAnalysisCache(
+                    self.database,
+                    ttl_seconds=self.config.MEMORY_ANALYSIS_CACHE_TTL_SECONDS,
+                    max_entries=self.config.MEMORY_ANALYSIS_CACHE_MAX_ENTRIES
+                ))
+            self._local.mechanism = mechanism
+        return mechanism
+    
+    def _record_result(self, user_id: str, result: Optional[Dict[str, Any]]):
+        """暂存整合结果，攒够一批后批量写入（result为None表示无需写入的用户）"""
+        with self._lock:
+            if result is not None:
+                self._pending_results.append(result)
+            else:
+                self._checkpoint['completed'].append(user_id)
+            should_flush = len(self._pending_results) >= self.batch_size
+        if should_flush:
+            self._flush_results()
+    
+    def _record_failure(self, user_id: str, error: str):
+        with self._lock:
+            self._checkpoint['failed'][user_id] = error
+    
+    def _flush_results(self) -> List[str]:
+        """批量写入暂存的结果，成功后更新检查点，返回写入失败的用户"""
+        with self._lock:
+            results, self._pending_results = self._pending_results, []
+            failed_user_ids = []
+            if results and not self.database.bulk_commit_consolidations(results):
+                failed_user_ids = [result['user_id'] for result in results]
+                for user_id in failed_user_ids:
+                    self._checkpoint['failed'][user_id] = "批量写入失败"
+                self._write_failures.extend(failed_user_ids)
+            else:
+                self._checkpoint['completed'].extend(result['user_id'] for result in results)
+            self._save_checkpoint()
+            return failed_user_ids
+    
+    def _log_progress(self, report: Dict[str, Any], finished: int, start_time: float):
+        minutes = (time.perf_counter() - start_time) / 60
+        logger.info(f"进度 {finished}/{report['total']}: 失败 {report['failed']}，"
+                    f"{finished / minutes if minutes else 0:.1f} 用户/分钟，"
+                    f"{report['tokens'] / minutes if minutes else 0:.0f} tokens/分钟")
+    
+    def _load_checkpoint(self, resume: bool):
+        """读取检查点（resume=False时重新开始）"""
+        self._checkpoint = {'completed': [], 'failed': {}}
+        if resume and self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            try:
+                with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                    self._checkpoint = json.load(f)
+                # 上次失败的用户本次重新尝试
+                self._checkpoint['failed'] = {}
+                logger.info(f"从检查点继续: 已完成 {len(self._checkpoint['completed'])} 个用户")
+            except Exception as e:
+                logger.error(f"读取检查点失败，重新开始: {e}")
+    
+    def _save_checkpoint(self):
+        """原子地写入检查点文件（调用方持有锁）"""
+        if not self.checkpoint_path:
+            return
+        try:
+            checkpoint_dir = os.path.dirname(self.checkpoint_path)
+            if checkpoint_dir:
+                os.makedirs(checkpoint_dir, exist_ok=True)
+            self._checkpoint['updated_at'] = datetime.now().isoformat()
+            temp_path = f"{self.checkpoint_path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._checkpoint, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.checkpoint_path)
+        except Exception as e:
+            logger.error(f"保存检查点失败: {e}")
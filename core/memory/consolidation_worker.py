@@ -0,0 +1,106 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Any, Optional
+from loguru import logger
+
+
+class ConsolidationWorker:
+    """后台记忆整合工作器：在线程池中执行记忆整合，同一用户的整合严格串行
+
+    对话回复不再等待记忆分析调用。同一用户在整合进行中再次提交时只保留最新的一个待执行任务。
+    """
+    
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="memory-consolidation")
+        self._lock = threading.Lock()
+        self._status: Dict[str, Dict[str, Any]] = {}
+        self._running: set = set()
+        self._pending: Dict[str, Callable[[], Any]] = {}
+    
+    def submit(self, user_id: str, task: Callable[[], Any]) -> Dict[str, Any]:
+        """提交一个用户的整合任务，立即返回当前状态"""
+        with self._lock:
+            status = self._status.setdefault(user_id, {'runs': 0, 'error': None})
+            status['submitted_at'] = datetime.now().isoformat()
+            
+            if user_id in self._running:
+                # 整合进行中：合并为一个待执行任务，当前任务结束后再执行
+                self._pending[user_id] = task
+                status['pending'] = True
+                logger.info(f"用户 {user_id} 的记忆整合正在进行，新的整合已排队")
+                return dict(status)
+            
+            self._running.add(user_id)
+            status['state'] = 'queued'
+            status['pending'] = False
+        
+        self._executor.submit(self._run, user_id, task)
+        logger.info(f"用户 {user_id} 的记忆整合已提交到后台")
+        return self.get_status(user_id)
+    
+    def _run(self, user_id: str, task: Callable[[], Any]):
+        """执行整合任务，完成后继续执行该用户排队的任务"""
+        while task is not None:
+            with self._lock:
+                status = self._status[user_id]
+                status['state'] = 'running'
+                status['started_at'] = datetime.now().isoformat()
+            
+            try:
+                result = task()
+                state, error = 'completed', None
+            except Exception as e:
+                logger.error(f"用户 {user_id} 的后台记忆整合失败: {e}")
+                result, state, error = None, 'failed', str(e)
+            
+            with self._lock:
+                status['state'] = state
+                status['error'] = error
+                status['result'] = result
+                status['finished_at'] = datetime.now().isoformat()
+                status['runs'] += 1
+                
+                task = self._pending.pop(user_id, None)
+                status['pending'] = False
+                if task is None:
+                    self._running.discard(user_id)
+    
+    def get_status(self, user_id: str) -> Dict[str, Any]:
+        """获取用户的整合状态：idle / queued / running / completed / failed"""
+        with self._lock:
+            status = self._status.get(user_id)
+            if not status:
+                return {'state': 'idle', 'runs': 0, 'pending': False, 'error': None}
+            return dict(status)
+    
+    def is_busy(self, user_id: str) -> bool:
+        """用户是否有排队或进行中的整合"""
+        with self._lock:
+            return user_id in self._running
+    
+    def wait_idle(self, user_id: Optional[str] = None, timeout: float = 60.0) -> bool:
+        """等待整合完成（用于测试、命令行退出前等场景）"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                busy = user_id in self._running if user_id else bool(self._running)
+            if not busy:
+                return True
+            time.sleep(0.01)
+        return False
+
+
+_worker: Optional[ConsolidationWorker] = None
+_worker_lock = threading.Lock()
+
+
+def get_consolidation_worker(max_workers: int = 2) -> ConsolidationWorker:
+    """获取进程内共享的整合工作器，保证同一用户在多个Agent之间也串行整合"""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = ConsolidationWorker(max_workers)
+        return _worker
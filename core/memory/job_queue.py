@@ -0,0 +1,360 @@
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from loguru import logger
+
+
+class MemoryJobQueue:
+    """持久化的记忆任务队列（存储在记忆数据库的 memory_jobs 表中）
+
+    任务被领取时获得一个租约，租约到期仍未完成（进程崩溃、线程卡住）的任务会被重新领取；
+    失败的任务按指数退避重试，超过最大尝试次数后进入死信状态。
+    相同幂等键的任务只会入队一次。
+    """
+    
+    def __init__(self, database, lease_seconds: float = 300.0, max_attempts: int = 3,
+                 retry_base_seconds: float = 30.0, retry_max_seconds: float = 3600.0):
+        self.database = database
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+    
+    def enqueue(self, job_type: str, user_id: Optional[str] = None, payload: Optional[Dict[str, Any]] = None,
+                idempotency_key: Optional[str] = None, max_attempts: Optional[int] = None,
+                delay_seconds: float = 0.0) -> Optional[int]:
+        """入队一个任务，返回任务ID；幂等键已存在时返回已有任务的ID"""
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                now = datetime.now().isoformat()
+                cursor.execute('''
+                    INSERT OR IGNORE INTO memory_jobs
+                        (job_type, user_id, payload, idempotency_key, status, attempts, max_attempts,
+                         available_at, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, 'pending', 0, ?, ?, ?, ?)
+                ''', (job_type, user_id, json.dumps(payload or {}, ensure_ascii=False), idempotency_key,
+                      max_attempts or self.max_attempts, time.time() + delay_seconds, now, now))
+                
+                if cursor.rowcount:
+                    job_id = cursor.lastrowid
+                    logger.info(f"任务已入队: {job_type} #{job_id} (用户: {user_id})")
+                else:
+                    cursor.execute('SELECT id FROM memory_jobs WHERE idempotency_key = ?', (idempotency_key,))
+                    job_id = cursor.fetchone()[0]
+                    logger.debug(f"任务已存在，跳过入队: {idempotency_key} -> #{job_id}")
+                
+                conn.commit()
+                return job_id
+        
+        except Exception as e:
+            logger.error(f"任务入队失败: {e}")
+            return None
+    
+    def lease(self, user_id: Optional[str] = None, job_types: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """领取一个可执行的任务（待执行或租约已过期），同一用户同时只有一个任务被领取
+
+        user_id 不为空时只领取该用户及不属于任何用户的（维护）任务。
+        """
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                now = time.time()
+                
+                # 租约过期且已用完尝试次数的任务直接进入死信
+                cursor.execute('''
+                    UPDATE memory_jobs
+                    SET status = 'dead', last_error = COALESCE(last_error, '租约超时'), lease_token = NULL, updated_at = ?
+                    WHERE status = 'running' AND lease_expires_at <= ? AND attempts >= max_attempts
+                ''', (datetime.now().isoformat(), now))
+                
+                conditions = [
+                    "((status = 'pending' AND available_at <= :now) OR (status = 'running' AND lease_expires_at <= :now))",
+                    '''(user_id IS NULL OR user_id NOT IN (
+                        SELECT user_id FROM memory_jobs
+                        WHERE status = 'running' AND lease_expires_at > :now AND user_id IS NOT NULL
+                    ))'''
+                ]
+                params: Dict[str, Any] = {'now': now}
+                if user_id is not None:
+                    conditions.append('(user_id = :user_id OR user_id IS NULL)')
+                    params['user_id'] = user_id
+                if job_types:
+                    placeholders = ', '.join(f':type_{i}' for i in range(len(job_types)))
+                    conditions.append(f'job_type IN ({placeholders})')
+                    params.update({f'type_{i}': job_type for i, job_type in enumerate(job_types)})
+                
+                # 单条UPDATE语句完成选择与加锁，多个进程同时领取也不会拿到同一任务
+                params.update({
+                    'token': uuid.uuid4().hex,
+                    'expires': now + self.lease_seconds,
+                    'updated_at': datetime.now().isoformat()
+                })
+                cursor.execute(f'''
+                    UPDATE memory_jobs
+                    SET status = 'running', lease_token = :token, lease_expires_at = :expires,
+                        attempts = attempts + 1, updated_at = :updated_at
+                    WHERE id = (
+                        SELECT id FROM memory_jobs
+                        WHERE {' AND '.join(conditions)}
+                        ORDER BY available_at, id
+                        LIMIT 1
+                    )
+                ''', params)
+                conn.commit()
+                
+                if not cursor.rowcount:
+                    return None
+                
+                cursor.execute('SELECT * FROM memory_jobs WHERE lease_token = ?', (params['token'],))
+                return self._row_to_job(cursor, cursor.fetchone())
+        
+        except Exception as e:
+            logger.error(f"领取任务失败: {e}")
+            return None
+    
+    def complete(self, job: Dict[str, Any]) -> bool:
+        """标记任务完成；租约已被其它工作者接管时返回False"""
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE memory_jobs
+                    SET status = 'done', lease_token = NULL, last_error = NULL, updated_at = ?
+                    WHERE id = ? AND lease_token = ?
+                ''', (datetime.now().isoformat(), job['id'], job['lease_token']))
+                conn.commit()
+                return cursor.rowcount > 0
+        
+        except Exception as e:
+            logger.error(f"标记任务完成失败: {e}")
+            return False
+    
+    def fail(self, job: Dict[str, Any], error: str) -> str:
+        """记录任务失败：未超过最大尝试次数时按指数退避重新排队，否则进入死信，返回新状态"""
+        if job['attempts'] >= job['max_attempts']:
+            status, available_at = 'dead', time.time()
+        else:
+            delay = min(self.retry_base_seconds * (2 ** (job['attempts'] - 1)), self.retry_max_seconds)
+            status, available_at = 'pending', time.time() + delay
+        
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE memory_jobs
+                    SET status = ?, available_at = ?, last_error = ?, lease_token = NULL, updated_at = ?
+                    WHERE id = ? AND lease_token = ?
+                ''', (status, available_at, error, datetime.now().isoformat(), job['id'], job['lease_token']))
+                conn.commit()
+            
+            if status == 'dead':
+                logger.error(f"任务 #{job['id']} 已失败 {job['attempts']} 次，进入死信: {error}")
+            else:
+                logger.warning(f"任务 #{job['id']} 第 {job['attempts']} 次执行失败，稍后重试: {error}")
+            return status
+        
+        except Exception as e:
+            logger.error(f"记录任务失败状态失败: {e}")
+            return 'unknown'
+    
+    def retry_dead(self, job_id: int) -> bool:
+        """将死信任务重新放回队列（重置尝试次数）"""
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE memory_jobs
+                    SET status = 'pending', attempts = 0, available_at = ?, updated_at = ?
+                    WHERE id = ? AND status = 'dead'
+                ''', (time.time(), datetime.now().isoformat(), job_id))
+                conn.commit()
+                return cursor.rowcount > 0
+        
+        except Exception as e:
+            logger.error(f"重试死信任务失败: {e}")
+            return False
+    
+    def has_runnable_jobs(self, user_id: Optional[str] = None, job_types: Optional[List[str]] = None) -> bool:
+        """是否存在待执行或租约已过期的任务（job_types不为空时只看这些类型）"""
+        return self._has_jobs("(status = 'pending' OR (status = 'running' AND lease_expires_at <= ?))",
+                              user_id, job_types)
+    
+    def has_running_jobs(self, user_id: Optional[str] = None, job_types: Optional[List[str]] = None) -> bool:
+        """是否存在已被领取且租约未过期的任务（job_types不为空时只看这些类型）"""
+        return self._has_jobs("status = 'running' AND lease_expires_at > ?", user_id, job_types)
+    
+    def _has_jobs(self, condition: str, user_id: Optional[str], job_types: Optional[List[str]]) -> bool:
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                query = f'SELECT 1 FROM memory_jobs WHERE ({condition})'
+                params: List[Any] = [time.time()]
+                if user_id is not None:
+                    query += ' AND user_id = ?'
+                    params.append(user_id)
+                if job_types:
+                    query += f" AND job_type IN ({', '.join('?' for _ in job_types)})"
+                    params.extend(job_types)
+                cursor.execute(query + ' LIMIT 1', params)
+                return cursor.fetchone() is not None
+        
+        except Exception as e:
+            logger.error(f"查询任务失败: {e}")
+            return False
+    
+    def get_next_due_delay(self, user_id: Optional[str] = None,
+                           job_types: Optional[List[str]] = None) -> Optional[float]:
+        """距下一个任务可以领取（退避到期或租约过期）还有多少秒，没有未完成的任务时返回None
+
+        user_id 不为空时与lease一致，只看该用户及不属于任何用户的任务；job_types不为空时只看这些类型
+        （没有处理函数的类型永远不会被领取，不应等待）。
+        """
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                query = '''
+                    SELECT MIN(CASE WHEN status = 'pending' THEN available_at ELSE lease_expires_at END)
+                    FROM memory_jobs WHERE status IN ('pending', 'running')
+                '''
+                params: List[Any] = []
+                if user_id is not None:
+                    query += ' AND (user_id = ? OR user_id IS NULL)'
+                    params.append(user_id)
+                if job_types:
+                    query += f" AND job_type IN ({', '.join('?' for _ in job_types)})"
+                    params.extend(job_types)
+                cursor.execute(query, params)
+                due_at = cursor.fetchone()[0]
+                return None if due_at is None else max(0.0, due_at - time.time())
+        
+        except Exception as e:
+            logger.error(f"查询任务到期时间失败: {e}")
+            return None
+    
+    def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """获取单个任务"""
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT * FROM memory_jobs WHERE id = ?', (job_id,))
+                return self._row_to_job(cursor, cursor.fetchone())
+        
+        except Exception as e:
+            logger.error(f"获取任务失败: {e}")
+            return None
+    
+    def get_jobs(self, status: Optional[str] = None, user_id: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """按状态或用户列出任务（最新的在前）"""
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                query, params = 'SELECT * FROM memory_jobs WHERE 1 = 1', []
+                if status:
+                    query += ' AND status = ?'
+                    params.append(status)
+                if user_id:
+                    query += ' AND user_id = ?'
+                    params.append(user_id)
+                cursor.execute(query + ' ORDER BY id DESC LIMIT ?', params + [limit])
+                return [self._row_to_job(cursor, row) for row in cursor.fetchall()]
+        
+        except Exception as e:
+            logger.error(f"列出任务失败: {e}")
+            return []
+    
+    def get_stats(self) -> Dict[str, int]:
+        """各状态的任务数量"""
+        stats = {'pending': 0, 'running': 0, 'done': 0, 'dead': 0}
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT status, COUNT(*) FROM memory_jobs GROUP BY status')
+                stats.update(dict(cursor.fetchall()))
+        except Exception as e:
+            logger.error(f"获取任务统计失败: {e}")
+        return stats
+    
+    def purge_finished(self, retention_days: int = 7) -> int:
+        """删除超过保留期的已完成任务，返回删除数量"""
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+                cursor.execute("DELETE FROM memory_jobs WHERE status = 'done' AND updated_at < ?", (cutoff,))
+                conn.commit()
+                if cursor.rowcount:
+                    logger.info(f"已清理 {cursor.rowcount} 个过期的已完成任务")
+                return cursor.rowcount
+        
+        except Exception as e:
+            logger.error(f"清理已完成任务失败: {e}")
+            return 0
+    
+    def _row_to_job(self, cursor, row) -> Optional[Dict[str, Any]]:
+        """将查询结果转换为任务字典"""
+        if row is None:
+            return None
+        job = dict(zip([column[0] for column in cursor.description], row))
+        job['payload'] = json.loads(job['payload']) if job['payload'] else {}
+        return job
+
+
+class MemoryJobRunner:
+    """记忆任务执行器：按配置的并发数从队列领取任务并交给对应的处理函数"""
+    
+    def __init__(self, queue: MemoryJobQueue, handlers: Dict[str, Callable[[Dict[str, Any]], Any]],
+                 concurrency: int = 2):
+        self.queue = queue
+        self.handlers = handlers
+        self.concurrency = max(1, concurrency)
+    
+    def drain(self, user_id: Optional[str] = None, max_jobs: Optional[int] = None) -> Dict[str, int]:
+        """执行队列中当前可执行的任务直到队列为空（或达到max_jobs），返回执行统计"""
+        counts = {'completed': 0, 'retried': 0, 'dead': 0}
+        lock = threading.Lock()
+        taken = [0]
+        
+        def take_job() -> Optional[Dict[str, Any]]:
+            with lock:
+                if max_jobs is not None and taken[0] >= max_jobs:
+                    return None
+                job = self.queue.lease(user_id, list(self.handlers))
+                if job:
+                    taken[0] += 1
+                return job
+        
+        def work():
+            job = take_job()
+            while job:
+                outcome = self.run_job(job)
+                with lock:
+                    counts[outcome] = counts.get(outcome, 0) + 1
+                job = take_job()
+        
+        if self.concurrency == 1:
+            work()
+        else:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="memory-job") as executor:
+                for future in [executor.submit(work) for _ in range(self.concurrency)]:
+                    future.result()
+        
+        return counts
+    
+    def run_job(self, job: Dict[str, Any]) -> str:
+        """执行单个任务，返回 completed / retried / dead"""
+        handler = self.handlers.get(job['job_type'])
+        try:
+            if handler is None:
+                raise ValueError(f"未注册的任务类型: {job['job_type']}")
+            handler(job)
+            self.queue.complete(job)
+            logger.info(f"任务 #{job['id']} ({job['job_type']}) 执行完成")
+            return 'completed'
+        except Exception as e:
+            status = self.queue.fail(job, str(e))
+            return 'dead' if status == 'dead' else 'retried'
@@ -1,16 +1,22 @@
 import sqlite3
 import json
 import os
+import threading
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 from loguru import logger
 
+from .memory_hash import MEMORY_SECTIONS, compute_memory_hashes, diff_memory, hash_entry, hash_section
+
 
 class MemoryDatabase:
     """记忆数据库管理类 - 使用SQLite存储记忆数据"""
     
     def __init__(self, db_path: str = "data/memory.sqlite"):
         self.db_path = db_path
+        # 用于PRAGMA data_version轮询的长连接（data_version只在连接存活期间有意义）
+        self._watch_connection = None
+        self._watch_lock = threading.Lock()
         self.ensure_db_directory()
         self.init_database()
     
@@ -68,6 +74,101 @@ class MemoryDatabase:
                     )
                 ''')
                 
+                # 创建记忆版本表（每次写入时递增，用于跨进程缓存失效）
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS memory_versions (
+                        user_id TEXT PRIMARY KEY,
+                        short_term_version INTEGER NOT NULL DEFAULT 0,
+                        long_term_version INTEGER NOT NULL DEFAULT 0,
+                        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                
+                # 创建滚动对话摘要表（概括已滑出短期记忆窗口的对话）
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS conversation_summaries (
+                        user_id TEXT PRIMARY KEY,
+                        summary TEXT NOT NULL,
+                        summarized_rounds INTEGER NOT NULL DEFAULT 0,
+                        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                
+                # 创建记忆任务队列表（记忆整合与维护任务，进程重启后可继续执行）
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS memory_jobs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        job_type TEXT NOT NULL,          -- 'consolidate', 'purge_jobs'
+                        user_id TEXT,                    -- 维护任务可以不属于任何用户
+                        payload TEXT,                    -- JSON格式的任务参数
+                        idempotency_key TEXT UNIQUE,     -- 相同键的任务只入队一次
+                        status TEXT NOT NULL,            -- 'pending', 'running', 'done', 'dead'
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        max_attempts INTEGER NOT NULL DEFAULT 3,
+                        available_at REAL NOT NULL,      -- 可被领取的时间（Unix时间戳，用于退避）
+                        lease_token TEXT,
+                        lease_expires_at REAL,
+                        last_error TEXT,
+                        created_at TEXT,
+                        updated_at TEXT
+                    )
+                ''')
+                
+                # 创建长期记忆各部分的内容哈希表（用于整合时跳过未变化的部分）
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS memory_section_hashes (
+                        user_id TEXT NOT NULL,
+                        section TEXT NOT NULL,       -- 'factual', 'episodic', 'semantic'
+                        hash TEXT NOT NULL,
+                        updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (user_id, section)
+                    )
+                ''')
+                
+                # 创建记忆整合状态表（对话轮计数与累计量，随对话写入原子递增，与整合结果在同一事务中扣减）
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS consolidation_state (
+                        user_id TEXT PRIMARY KEY,
+                        round_counter INTEGER NOT NULL DEFAULT 0,
+                        pending_tokens INTEGER NOT NULL DEFAULT 0,   -- 上次整合以来累计的对话token数
+                        pending_chars INTEGER NOT NULL DEFAULT 0,    -- 上次整合以来累计的对话字符数
+                        last_round_at TEXT,                          -- 最近一轮对话的时间
+                        last_consolidated_at TEXT,
+                        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                
+                # 创建记忆分析结果缓存表（按提示词内容哈希复用已校验的分析结果）
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS memory_analysis_cache (
+                        cache_key TEXT PRIMARY KEY,      -- (版本, 提供商, 模型, 提示词消息) 的哈希
+                        result TEXT NOT NULL,            -- JSON格式的分析结果
+                        model TEXT,
+                        created_at REAL NOT NULL,        -- Unix时间戳，用于有效期
+                        last_used_at REAL NOT NULL,      -- Unix时间戳，用于按最近使用淘汰
+                        hit_count INTEGER NOT NULL DEFAULT 0
+                    )
+                ''')
+                
+                # 创建LLM回复精确匹配缓存表（按请求内容哈希复用回复，默认不启用）
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS llm_response_cache (
+                        cache_key TEXT PRIMARY KEY,      -- (版本, 提供商, 模型, 温度, 消息列表) 的哈希
+                        response TEXT NOT NULL,
+                        model TEXT,
+                        input_tokens INTEGER NOT NULL DEFAULT 0,   -- 原始调用的token用量，用于统计节省量
+                        output_tokens INTEGER NOT NULL DEFAULT 0,
+                        latency_ms REAL NOT NULL DEFAULT 0,        -- 原始调用耗时
+                        created_at REAL NOT NULL,
+                        last_used_at REAL NOT NULL,
+                        hit_count INTEGER NOT NULL DEFAULT 0
+                    )
+                ''')
+                
+                # 兼容旧数据库：补充新增的列
+                self._ensure_column(cursor, 'short_term_memory', 'token_count', 'INTEGER')
+                self._ensure_column(cursor, 'long_term_memory', 'content_hash', 'TEXT')
+                
                 # 创建索引
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_short_term_user_id ON short_term_memory(user_id)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_short_term_timestamp ON short_term_memory(timestamp)')
@@ -75,6 +176,9 @@ class MemoryDatabase:
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_long_term_type ON long_term_memory(memory_type)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_long_term_key ON long_term_memory(memory_key)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_memory_updates_user_id ON memory_updates(user_id)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_memory_jobs_status ON memory_jobs(status, available_at)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_analysis_cache_used ON memory_analysis_cache(last_used_at)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_used ON llm_response_cache(last_used_at)')
                 
                 conn.commit()
                 logger.info("数据库表结构初始化完成")
@@ -83,17 +187,88 @@ class MemoryDatabase:
             logger.error(f"初始化数据库失败: {e}")
             raise
     
-    def add_short_term_memory(self, user_id: str, user_input: str, ai_response: str) -> bool:
-        """添加短期记忆"""
+    def _ensure_column(self, cursor, table: str, column: str, definition: str):
+        """如果表中缺少指定列则添加（用于旧数据库升级）"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        columns = [row[1] for row in cursor.fetchall()]
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+            logger.info(f"数据库升级：{table} 表新增列 {column}")
+    
+    def _bump_memory_version(self, cursor, user_id: str, short_term: bool = False, long_term: bool = False):
+        """在当前事务中递增用户的记忆版本号"""
+        cursor.execute('''
+            INSERT INTO memory_versions (user_id, short_term_version, long_term_version, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                short_term_version = short_term_version + excluded.short_term_version,
+                long_term_version = long_term_version + excluded.long_term_version,
+                updated_at = excluded.updated_at
+        ''', (user_id, int(short_term), int(long_term), datetime.now().isoformat()))
+    
+    def get_memory_version(self, user_id: str) -> Dict[str, int]:
+        """获取用户的记忆版本号（主键索引单行读取）"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT short_term_version, long_term_version
+                    FROM memory_versions
+                    WHERE user_id = ?
+                ''', (user_id,))
+                row = cursor.fetchone()
+                
+                if row:
+                    return {'short_term_version': row[0], 'long_term_version': row[1]}
+                return {'short_term_version': 0, 'long_term_version': 0}
+                
+        except Exception as e:
+            logger.error(f"获取记忆版本失败: {e}")
+            # 返回无法匹配任何缓存的版本，迫使调用方回源读取
+            return {'short_term_version': -1, 'long_term_version': -1}
+    
+    def get_data_version(self) -> Optional[int]:
+        """获取PRAGMA data_version，其它连接（包括其它进程）提交写入后该值会变化"""
+        try:
+            with self._watch_lock:
+                if self._watch_connection is None:
+                    self._watch_connection = sqlite3.connect(self.db_path, check_same_thread=False)
+                return self._watch_connection.execute('PRAGMA data_version').fetchone()[0]
+                
+        except Exception as e:
+            logger.error(f"获取data_version失败: {e}")
+            return None
+    
+    def add_short_term_memory(self, user_id: str, user_input: str, ai_response: str,
+                              timestamp: Optional[str] = None, token_count: Optional[int] = None) -> Optional[int]:
+        """添加短期记忆，返回新记录的ID（失败时返回None）
+
+        token_count为该轮对话的token数，随行保存以免每轮重复计数。
+        """
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                timestamp = datetime.now().isoformat()
+                timestamp = timestamp or datetime.now().isoformat()
                 
                 cursor.execute('''
-                    INSERT INTO short_term_memory (user_id, user_input, ai_response, timestamp)
-                    VALUES (?, ?, ?, ?)
-                ''', (user_id, user_input, ai_response, timestamp))
+                    INSERT INTO short_term_memory (user_id, user_input, ai_response, timestamp, token_count)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (user_id, user_input, ai_response, timestamp, token_count))
+                row_id = cursor.lastrowid
+                
+                # 原子地累加整合状态（首次写入时按已有的短期记忆补建）
+                cursor.execute('''
+                    INSERT INTO consolidation_state (user_id, round_counter, pending_tokens, pending_chars, last_round_at, updated_at)
+                    SELECT ?, COUNT(*), COALESCE(SUM(token_count), 0),
+                           COALESCE(SUM(LENGTH(user_input) + LENGTH(ai_response)), 0), ?, ?
+                    FROM short_term_memory WHERE user_id = ?
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        round_counter = round_counter + 1,
+                        pending_tokens = pending_tokens + ?,
+                        pending_chars = pending_chars + ?,
+                        last_round_at = excluded.last_round_at,
+                        updated_at = excluded.updated_at
+                ''', (user_id, timestamp, timestamp, user_id, token_count or 0, len(user_input) + len(ai_response)))
                 
                 # 记录更新
                 cursor.execute('''
@@ -101,13 +276,15 @@ class MemoryDatabase:
                     VALUES (?, ?, ?, ?)
                 ''', (user_id, 'short_term_add', f'添加对话: {user_input[:50]}...', 1))
                 
+                self._bump_memory_version(cursor, user_id, short_term=True)
+                
                 conn.commit()
                 logger.debug(f"短期记忆已添加: {user_input[:30]}...")
-                return True
+                return row_id
                 
         except Exception as e:
             logger.error(f"添加短期记忆失败: {e}")
-            return False
+            return None
     
     def get_short_term_memory(self, user_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
         """获取短期记忆"""
@@ -117,18 +294,18 @@ class MemoryDatabase:
                 
                 if limit:
                     cursor.execute('''
-                        SELECT user_input, ai_response, timestamp
+                        SELECT user_input, ai_response, timestamp, token_count, id
                         FROM short_term_memory
                         WHERE user_id = ?
-                        ORDER BY timestamp DESC
+                        ORDER BY timestamp DESC, id DESC
                         LIMIT ?
                     ''', (user_id, limit))
                 else:
                     cursor.execute('''
-                        SELECT user_input, ai_response, timestamp
+                        SELECT user_input, ai_response, timestamp, token_count, id
                         FROM short_term_memory
                         WHERE user_id = ?
-                        ORDER BY timestamp DESC
+                        ORDER BY timestamp DESC, id DESC
                     ''', (user_id,))
                 
                 results = cursor.fetchall()
@@ -138,7 +315,9 @@ class MemoryDatabase:
                     memories.append({
                         'user': row[0],
                         'ai': row[1],
-                        'timestamp': row[2]
+                        'timestamp': row[2],
+                        'token_count': row[3],
+                        'id': row[4]
                     })
                 
                 # 按时间正序返回（最早的在前）
@@ -149,6 +328,68 @@ class MemoryDatabase:
             logger.error(f"获取短期记忆失败: {e}")
             return []
     
+    def get_short_term_id_range(self, user_id: str) -> Dict[str, Any]:
+        """获取短期记忆的ID范围和条数（用于生成整合任务的幂等键）"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT MIN(id), MAX(id), COUNT(*)
+                    FROM short_term_memory
+                    WHERE user_id = ?
+                ''', (user_id,))
+                first_id, last_id, count = cursor.fetchone()
+                return {'first_id': first_id, 'last_id': last_id, 'count': count}
+                
+        except Exception as e:
+            logger.error(f"获取短期记忆ID范围失败: {e}")
+            return {'first_id': None, 'last_id': None, 'count': 0}
+    
+    def count_short_term_in_range(self, user_id: str, first_id: int, last_id: int) -> int:
+        """统计指定ID范围内仍存在的短期记忆条数"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT COUNT(*) FROM short_term_memory
+                    WHERE user_id = ? AND id BETWEEN ? AND ?
+                ''', (user_id, first_id, last_id))
+                return cursor.fetchone()[0]
+                
+        except Exception as e:
+            logger.error(f"统计短期记忆失败: {e}")
+            return 0
+    
+    def delete_short_term_memory(self, user_id: str, row_ids: List[int]) -> int:
+        """删除指定ID的短期记忆，返回删除条数"""
+        if not row_ids:
+            return 0
+        
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                deleted = self._delete_short_term_rows(cursor, user_id, row_ids)
+                if deleted:
+                    cursor.execute('''
+                        INSERT INTO memory_updates (user_id, update_type, description, data_count)
+                        VALUES (?, ?, ?, ?)
+                    ''', (user_id, 'short_term_cleanup', '清理过期短期记忆', deleted))
+                    self._bump_memory_version(cursor, user_id, short_term=True)
+                conn.commit()
+                return deleted
+                
+        except Exception as e:
+            logger.error(f"删除短期记忆失败: {e}")
+            return 0
+    
+    def _delete_short_term_rows(self, cursor, user_id: str, row_ids: List[int]) -> int:
+        """在当前事务中删除指定ID的短期记忆"""
+        cursor.executemany(
+            'DELETE FROM short_term_memory WHERE user_id = ? AND id = ?',
+            [(user_id, row_id) for row_id in row_ids]
+        )
+        return cursor.rowcount
+    
     def clear_short_term_memory(self, user_id: str) -> bool:
         """清空短期记忆"""
         try:
@@ -160,6 +401,10 @@ class MemoryDatabase:
                 count = cursor.fetchone()[0]
                 
                 cursor.execute('DELETE FROM short_term_memory WHERE user_id = ?', (user_id,))
+                cursor.execute('''
+                    UPDATE consolidation_state SET round_counter = 0, pending_tokens = 0, pending_chars = 0, updated_at = ?
+                    WHERE user_id = ?
+                ''', (datetime.now().isoformat(), user_id))
                 
                 # 记录更新
                 cursor.execute('''
@@ -167,6 +412,8 @@ class MemoryDatabase:
                     VALUES (?, ?, ?, ?)
                 ''', (user_id, 'short_term_clear', f'清空短期记忆', count))
                 
+                self._bump_memory_version(cursor, user_id, short_term=True)
+                
                 conn.commit()
                 logger.info(f"短期记忆已清空，删除了 {count} 条记录")
                 return True
@@ -175,40 +422,79 @@ class MemoryDatabase:
             logger.error(f"清空短期记忆失败: {e}")
             return False
     
+    def get_conversation_summary(self, user_id: str) -> Dict[str, Any]:
+        """获取滚动对话摘要"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT summary, summarized_rounds, updated_at
+                    FROM conversation_summaries
+                    WHERE user_id = ?
+                ''', (user_id,))
+                row = cursor.fetchone()
+                
+                if row:
+                    return {'summary': row[0], 'summarized_rounds': row[1], 'updated_at': row[2]}
+                return {'summary': '', 'summarized_rounds': 0, 'updated_at': None}
+                
+        except Exception as e:
+            logger.error(f"获取对话摘要失败: {e}")
+            return {'summary': '', 'summarized_rounds': 0, 'updated_at': None}
+    
+    def save_conversation_summary(self, user_id: str, summary: str, added_rounds: int) -> bool:
+        """保存滚动对话摘要，added_rounds为本次新概括的对话轮数"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    INSERT INTO conversation_summaries (user_id, summary, summarized_rounds, updated_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        summary = excluded.summary,
+                        summarized_rounds = summarized_rounds + excluded.summarized_rounds,
+                        updated_at = excluded.updated_at
+                ''', (user_id, summary, added_rounds, datetime.now().isoformat()))
+                
+                cursor.execute('''
+                    INSERT INTO memory_updates (user_id, update_type, description, data_count)
+                    VALUES (?, ?, ?, ?)
+                ''', (user_id, 'summary_update', '更新滚动对话摘要', added_rounds))
+                
+                # 摘要属于短期记忆的一部分
+                self._bump_memory_version(cursor, user_id, short_term=True)
+                
+                conn.commit()
+                logger.debug(f"滚动对话摘要已更新，新增概括 {added_rounds} 轮")
+                return True
+                
+        except Exception as e:
+            logger.error(f"保存对话摘要失败: {e}")
+            return False
+    
+    def clear_conversation_summary(self, user_id: str) -> bool:
+        """清空滚动对话摘要"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM conversation_summaries WHERE user_id = ?', (user_id,))
+                if cursor.rowcount:
+                    self._bump_memory_version(cursor, user_id, short_term=True)
+                conn.commit()
+                return True
+                
+        except Exception as e:
+            logger.error(f"清空对话摘要失败: {e}")
+            return False
+    
     def update_long_term_memory(self, user_id: str, memory_data: Dict[str, Any]) -> bool:
         """更新长期记忆"""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
-                # 清空现有长期记忆
-                cursor.execute('DELETE FROM long_term_memory WHERE user_id = ?', (user_id,))
-                
-                # 插入新的长期记忆
-                for memory_type, data in memory_data.items():
-                    if memory_type == 'factual' and isinstance(data, dict):
-                        for key, value in data.items():
-                            if value:  # 只保存非空值
-                                cursor.execute('''
-                                    INSERT INTO long_term_memory (user_id, memory_type, memory_key, memory_value, memory_data)
-                                    VALUES (?, ?, ?, ?, ?)
-                                ''', (user_id, memory_type, key, str(value), json.dumps({key: value})))
-                    
-                    elif memory_type == 'episodic' and isinstance(data, list):
-                        for episode in data:
-                            if episode.get('content'):
-                                cursor.execute('''
-                                    INSERT INTO long_term_memory (user_id, memory_type, memory_key, memory_value, memory_data)
-                                    VALUES (?, ?, ?, ?, ?)
-                                ''', (user_id, memory_type, None, episode.get('content'), json.dumps(episode)))
-                    
-                    elif memory_type == 'semantic' and isinstance(data, dict):
-                        for key, value in data.items():
-                            if value:  # 只保存非空值
-                                cursor.execute('''
-                                    INSERT INTO long_term_memory (user_id, memory_type, memory_key, memory_value, memory_data)
-                                    VALUES (?, ?, ?, ?, ?)
-                                ''', (user_id, memory_type, key, str(value), json.dumps({key: value})))
+                self._write_long_term_memory(cursor, user_id, memory_data)
                 
                 # 记录更新
                 cursor.execute('''
@@ -216,6 +502,8 @@ class MemoryDatabase:
                     VALUES (?, ?, ?, ?)
                 ''', (user_id, 'long_term_update', '更新长期记忆', len(memory_data)))
                 
+                self._bump_memory_version(cursor, user_id, long_term=True)
+                
                 conn.commit()
                 logger.info("长期记忆已更新")
                 return True
@@ -224,6 +512,266 @@ class MemoryDatabase:
             logger.error(f"更新长期记忆失败: {e}")
             return False
     
+    def _write_long_term_memory(self, cursor, user_id: str, memory_data: Dict[str, Any]):
+        """在当前事务中用memory_data替换用户的长期记忆（同时写入内容哈希）"""
+        # 清空现有长期记忆
+        cursor.execute('DELETE FROM long_term_memory WHERE user_id = ?', (user_id,))
+        
+        # 插入新的长期记忆
+        for section, hashes in compute_memory_hashes(memory_data).items():
+            for key, value, entry_hash in hashes['entries']:
+                self._insert_long_term_entry(cursor, user_id, section, key, value, entry_hash)
+            self._save_section_hash(cursor, user_id, section, hashes['hash'])
+    
+    def _insert_long_term_entry(self, cursor, user_id: str, section: str, key: Optional[str], value: Any, entry_hash: str):
+        """插入一条长期记忆"""
+        if section == 'episodic':
+            memory_value, memory_data = value.get('content'), json.dumps(value)
+        else:
+            memory_value, memory_data = value, json.dumps({key: value})
+        cursor.execute('''
+            INSERT INTO long_term_memory (user_id, memory_type, memory_key, memory_value, memory_data, content_hash)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, section, key, memory_value, memory_data, entry_hash))
+    
+    def _save_section_hash(self, cursor, user_id: str, section: str, section_hash: str):
+        """保存长期记忆某一部分的哈希"""
+        cursor.execute('''
+            INSERT INTO memory_section_hashes (user_id, section, hash, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, section) DO UPDATE SET hash = excluded.hash, updated_at = excluded.updated_at
+        ''', (user_id, section, section_hash, datetime.now().isoformat()))
+    
+    def get_memory_hashes(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        """获取长期记忆各部分的哈希和每行的条目哈希；旧数据缺少哈希时在此补算并写回"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                hashes, backfilled = self._read_memory_hashes(cursor, user_id)
+                if backfilled:
+                    conn.commit()
+                    logger.info(f"已为用户 {user_id} 的长期记忆补算内容哈希")
+                return hashes
+                
+        except Exception as e:
+            logger.error(f"获取长期记忆哈希失败: {e}")
+            return {}
+    
+    def _read_memory_hashes(self, cursor, user_id: str):
+        """在当前事务中读取长期记忆哈希，返回 (哈希, 是否补算了旧数据)"""
+        cursor.execute('SELECT section, hash FROM memory_section_hashes WHERE user_id = ?', (user_id,))
+        section_hashes = dict(cursor.fetchall())
+        
+        cursor.execute('''
+            SELECT id, memory_type, memory_key, memory_value, memory_data, content_hash
+            FROM long_term_memory
+            WHERE user_id = ?
+            ORDER BY id
+        ''', (user_id,))
+        
+        hashes = {section: {'hash': section_hashes.get(section), 'entries': []} for section in MEMORY_SECTIONS}
+        backfilled = False
+        for row_id, section, key, value, data, content_hash in cursor.fetchall():
+            if section not in hashes:
+                continue
+            if not content_hash:
+                entry_value = self._decode_episode(value, data) if section == 'episodic' else value
+                content_hash = hash_entry(section, key, entry_value)
+                cursor.execute('UPDATE long_term_memory SET content_hash = ? WHERE id = ?', (content_hash, row_id))
+                backfilled = True
+            hashes[section]['entries'].append((row_id, content_hash))
+        
+        for section, section_data in hashes.items():
+            if section_data['hash'] is None:
+                section_data['hash'] = hash_section(section, [entry_hash for _, entry_hash in section_data['entries']])
+                self._save_section_hash(cursor, user_id, section, section_data['hash'])
+                backfilled = True
+        
+        return hashes, backfilled
+    
+    def apply_long_term_diff(self, user_id: str, diff: Dict[str, Dict[str, Any]]) -> bool:
+        """在一个事务中只写入有变化的部分：删除移除的行、插入新增的条目并更新部分哈希"""
+        if not diff:
+            return True
+        
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                self._apply_long_term_diff(cursor, user_id, diff)
+                conn.commit()
+                return True
+                
+        except Exception as e:
+            logger.error(f"写入长期记忆变化失败: {e}")
+            return False
+    
+    def _apply_long_term_diff(self, cursor, user_id: str, diff: Dict[str, Dict[str, Any]]):
+        """在当前事务中写入长期记忆的变化"""
+        changed_rows = 0
+        for section, changes in diff.items():
+            cursor.executemany(
+                'DELETE FROM long_term_memory WHERE id = ? AND user_id = ?',
+                [(row_id, user_id) for row_id in changes['removed']]
+            )
+            for key, value, entry_hash in changes['added']:
+                self._insert_long_term_entry(cursor, user_id, section, key, value, entry_hash)
+            self._save_section_hash(cursor, user_id, section, changes['hash'])
+            changed_rows += len(changes['removed']) + len(changes['added'])
+        
+        cursor.execute('''
+            INSERT INTO memory_updates (user_id, update_type, description, data_count)
+            VALUES (?, ?, ?, ?)
+        ''', (user_id, 'long_term_update', f"更新长期记忆: {', '.join(diff)}", changed_rows))
+        
+        self._bump_memory_version(cursor, user_id, long_term=True)
+    
+    def commit_consolidation(self, user_id: str, new_memory: Dict[str, Any], consumed_short_term_ids: List[int],
+                             round_counter: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """在一个事务中提交一次记忆整合
+
+        只写入长期记忆中有变化的部分，删除本次分析过的短期记忆（分析期间新增的对话保留）和滚动摘要，
+        并更新对话轮计数：round_counter为None时按剩余（尚未整合）的短期记忆重新计算。
+        返回 {'diff', 'consumed', 'round_counter'}，失败时返回None（事务整体回滚）。
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                result = self._commit_consolidation(cursor, user_id, new_memory, consumed_short_term_ids, round_counter)
+                conn.commit()
+                return result
+                
+        except Exception as e:
+            logger.error(f"提交记忆整合失败: {e}")
+            return None
+    
+    def _commit_consolidation(self, cursor, user_id: str, new_memory: Dict[str, Any], consumed_short_term_ids: List[int],
+                              round_counter: Optional[int]) -> Dict[str, Any]:
+        """在当前事务中提交一个用户的记忆整合"""
+        stored, _ = self._read_memory_hashes(cursor, user_id)
+        diff = diff_memory(stored, new_memory)
+        if diff:
+            self._apply_long_term_diff(cursor, user_id, diff)
+        
+        consumed = self._delete_short_term_rows(cursor, user_id, consumed_short_term_ids)
+        cursor.execute('DELETE FROM conversation_summaries WHERE user_id = ?', (user_id,))
+        
+        # 滑出窗口的对话已随滚动摘要一并整合，剩余的短期记忆就是尚未整合的全部对话：
+        # 累计量按剩余记录重新计算，而不是减去本批条数（清理到摘要中的对话也计入过累计量）
+        now = datetime.now().isoformat()
+        round_expression = 'excluded.round_counter' if round_counter is None else '?'
+        params = [user_id, now, now, user_id] + ([] if round_counter is None else [round_counter])
+        cursor.execute(f'''
+            INSERT INTO consolidation_state
+                (user_id, round_counter, pending_tokens, pending_chars, last_round_at, last_consolidated_at, updated_at)
+            SELECT ?, COUNT(*), COALESCE(SUM(token_count), 0),
+                   COALESCE(SUM(LENGTH(user_input) + LENGTH(ai_response)), 0), MAX(timestamp), ?, ?
+            FROM short_term_memory WHERE user_id = ?
+            ON CONFLICT(user_id) DO UPDATE SET
+                round_counter = {round_expression},
+                pending_tokens = excluded.pending_tokens,
+                pending_chars = excluded.pending_chars,
+                last_consolidated_at = excluded.last_consolidated_at,
+                updated_at = excluded.updated_at
+        ''', params)
+        cursor.execute('SELECT round_counter FROM consolidation_state WHERE user_id = ?', (user_id,))
+        new_counter = cursor.fetchone()[0]
+        
+        cursor.execute('''
+            INSERT INTO memory_updates (user_id, update_type, description, data_count)
+            VALUES (?, ?, ?, ?)
+        ''', (user_id, 'memory_consolidation', f"整合 {consumed} 轮短期记忆", consumed))
+        self._bump_memory_version(cursor, user_id, short_term=True)
+        
+        return {'diff': diff, 'consumed': consumed, 'round_counter': new_counter}
+    
+    def get_consolidation_state(self, user_id: str) -> Dict[str, Any]:
+        """获取用户的整合状态：上次整合以来累计的轮数、token数、字符数和最近一轮对话时间
+
+        尚无状态记录的旧用户按现有短期记忆计算。
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT round_counter, pending_tokens, pending_chars, last_round_at, last_consolidated_at
+                    FROM consolidation_state
+                    WHERE user_id = ?
+                ''', (user_id,))
+                row = cursor.fetchone()
+                
+                if row is None:
+                    cursor.execute('''
+                        SELECT COUNT(*), COALESCE(SUM(token_count), 0),
+                               COALESCE(SUM(LENGTH(user_input) + LENGTH(ai_response)), 0), MAX(timestamp), NULL
+                        FROM short_term_memory WHERE user_id = ?
+                    ''', (user_id,))
+                    row = cursor.fetchone()
+                
+                return {
+                    'round_counter': row[0],
+                    'pending_tokens': row[1],
+                    'pending_chars': row[2],
+                    'last_round_at': row[3],
+                    'last_consolidated_at': row[4]
+                }
+                
+        except Exception as e:
+            logger.error(f"获取整合状态失败: {e}")
+            return {'round_counter': 0, 'pending_tokens': 0, 'pending_chars': 0,
+                    'last_round_at': None, 'last_consolidated_at': None}
+    
+    def _decode_episode(self, memory_value: Optional[str], memory_data: Optional[str]) -> Dict[str, Any]:
+        """解析存储的情节记忆"""
+        if memory_data:
+            try:
+                return json.loads(memory_data)
+            except json.JSONDecodeError:
+                pass
+        return {'content': memory_value}
+    
+    def bulk_commit_consolidations(self, results: List[Dict[str, Any]]) -> bool:
+        """在一个事务中批量提交多个用户的记忆整合
+
+        每项包含 user_id、memory（新的长期记忆）和 consumed_short_term_ids（已分析的短期记忆ID），
+        逐个用户执行与 commit_consolidation 相同的写入。
+        """
+        if not results:
+            return True
+        
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                for result in results:
+                    self._commit_consolidation(
+                        cursor, result['user_id'], result['memory'], result['consumed_short_term_ids'], None
+                    )
+                
+                conn.commit()
+                logger.info(f"批量写入 {len(results)} 个用户的整合结果")
+                return True
+                
+        except Exception as e:
+            logger.error(f"批量写入整合结果失败: {e}")
+            return False
+    
+    def get_users_with_pending_memory(self) -> List[str]:
+        """获取有短期记忆或滚动摘要（即有待整合内容）的用户ID"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT user_id FROM short_term_memory
+                    UNION
+                    SELECT user_id FROM conversation_summaries
+                    ORDER BY user_id
+                ''')
+                return [row[0] for row in cursor.fetchall()]
+                
+        except Exception as e:
+            logger.error(f"获取待整合用户失败: {e}")
+            return []
+    
     def get_long_term_memory(self, user_id: str) -> Dict[str, Any]:
         """获取长期记忆"""
         try:
@@ -234,7 +782,7 @@ class MemoryDatabase:
                     SELECT memory_type, memory_key, memory_value, memory_data
                     FROM long_term_memory
                     WHERE user_id = ?
-                    ORDER BY memory_type, memory_key
+                    ORDER BY memory_type, memory_key, id
                 ''', (user_id,))
                 
                 results = cursor.fetchall()
@@ -255,12 +803,8 @@ class MemoryDatabase:
                     
                     elif memory_type == 'episodic':
                         if memory_data:
-                            try:
-                                episode_data = json.loads(memory_data)
-                                memory['episodic'].append(episode_data)
-                            except json.JSONDecodeError:
-                                # 如果JSON解析失败，使用原始值
-                                memory['episodic'].append({'content': memory_value})
+                            # 如果JSON解析失败，使用原始值
+                            memory['episodic'].append(self._decode_episode(memory_value, memory_data))
                     
                     elif memory_type == 'semantic':
                         if memory_key and memory_value:
@@ -288,6 +832,10 @@ class MemoryDatabase:
                 # 清空所有表
                 cursor.execute('DELETE FROM short_term_memory WHERE user_id = ?', (user_id,))
                 cursor.execute('DELETE FROM long_term_memory WHERE user_id = ?', (user_id,))
+                cursor.execute('DELETE FROM conversation_summaries WHERE user_id = ?', (user_id,))
+                cursor.execute('DELETE FROM memory_section_hashes WHERE user_id = ?', (user_id,))
+                cursor.execute('DELETE FROM consolidation_state WHERE user_id = ?', (user_id,))
+                cursor.execute("DELETE FROM memory_jobs WHERE user_id = ? AND status = 'pending'", (user_id,))
                 
                 # 记录更新
                 cursor.execute('''
@@ -295,6 +843,8 @@ class MemoryDatabase:
                     VALUES (?, ?, ?, ?)
                 ''', (user_id, 'memory_clear_all', f'清空所有记忆', short_term_count + long_term_count))
                 
+                self._bump_memory_version(cursor, user_id, short_term=True, long_term=True)
+                
                 conn.commit()
                 logger.info(f"所有记忆已清空，删除了 {short_term_count} 条短期记忆和 {long_term_count} 条长期记忆")
                 return True
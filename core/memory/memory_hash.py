@@ -0,0 +1,99 @@
+import hashlib
+import json
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+
+MEMORY_SECTIONS = ('factual', 'episodic', 'semantic')
+
+
+def iter_memory_entries(memory: Dict[str, Any], section: str) -> List[Tuple[Optional[str], Any]]:
+    """列出某一部分会被存储的条目 (键, 值)：空值和没有内容的情节记忆不存储"""
+    data = memory.get(section)
+    if section == 'episodic':
+        if not isinstance(data, list):
+            return []
+        return [(None, episode) for episode in data if isinstance(episode, dict) and episode.get('content')]
+    if not isinstance(data, dict):
+        return []
+    return [(key, str(value)) for key, value in data.items() if value]
+
+
+def hash_entry(section: str, key: Optional[str], value: Any) -> str:
+    """计算单个记忆条目的规范化内容哈希"""
+    canonical = json.dumps([section, key, value], ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def hash_section(section: str, entry_hashes: List[str]) -> str:
+    """由条目哈希计算整个部分的哈希：事实和语义记忆与顺序无关，情节记忆保留顺序"""
+    ordered = entry_hashes if section == 'episodic' else sorted(entry_hashes)
+    return hashlib.sha1(f"{section}:{','.join(ordered)}".encode('utf-8')).hexdigest()
+
+
+def compute_memory_hashes(memory: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """计算每个部分的哈希及其条目哈希"""
+    hashes = {}
+    for section in MEMORY_SECTIONS:
+        entries = [(key, value, hash_entry(section, key, value)) for key, value in iter_memory_entries(memory, section)]
+        hashes[section] = {
+            'hash': hash_section(section, [entry[2] for entry in entries]),
+            'entries': entries
+        }
+    return hashes
+
+
+def diff_memory(stored: Dict[str, Dict[str, Any]], new_memory: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """比较已存储的哈希与新记忆，只返回有变化的部分
+
+    stored 的格式为 {section: {'hash': 部分哈希, 'entries': [(行ID, 条目哈希)]}}。
+    每个有变化的部分给出 added（需插入的 (键, 值, 哈希)）、removed（需删除的行ID）和新的部分哈希。
+    """
+    diff = {}
+    new_hashes = compute_memory_hashes(new_memory)
+    
+    for section in MEMORY_SECTIONS:
+        new_section = new_hashes[section]
+        old_section = stored.get(section) or {'hash': None, 'entries': []}
+        if old_section['hash'] == new_section['hash']:
+            continue
+        
+        # 按哈希多重集合匹配，重复的条目各自对应一行
+        remaining = Counter(entry_hash for _, entry_hash in old_section['entries'])
+        added = []
+        for key, value, entry_hash in new_section['entries']:
+            if remaining[entry_hash] > 0:
+                remaining[entry_hash] -= 1
+            else:
+                added.append((key, value, entry_hash))
+        
+        removed = []
+        kept = []
+        for row_id, entry_hash in old_section['entries']:
+            if remaining[entry_hash] > 0:
+                remaining[entry_hash] -= 1
+                removed.append(row_id)
+            else:
+                kept.append(entry_hash)
+        
+        # 情节记忆按行ID排序读取：保留的条目加上追加的条目与新顺序不一致时整体重写
+        if section == 'episodic' and kept + [entry[2] for entry in added] != [entry[2] for entry in new_section['entries']]:
+            added = list(new_section['entries'])
+            removed = [row_id for row_id, _ in old_section['entries']]
+        
+        diff[section] = {'hash': new_section['hash'], 'added': added, 'removed': removed}
+    
+    return diff
+
+
+def format_diff_summary(diff: Dict[str, Dict[str, Any]]) -> str:
+    """将差异概括为一行日志"""
+    if not diff:
+        return "无变化"
+    parts = []
+    for section in MEMORY_SECTIONS:
+        if section in diff:
+            parts.append(f"{section} +{len(diff[section]['added'])} -{len(diff[section]['removed'])}")
+        else:
+            parts.append(f"{section} 未变")
+    return "，".join(parts)
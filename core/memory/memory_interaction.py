@@ -1,65 +1,136 @@
-from typing import List, Dict, Any
+import hashlib
+import json
+import threading
+import time
+from typing import List, Dict, Any, Optional
 from loguru import logger
 
 
 class MemoryInteraction:
     """记忆交互：处理记忆的检索和应用"""
     
+    # 长期记忆各部分的渲染顺序
+    LONG_TERM_SECTIONS = ('factual', 'episodic', 'semantic')
+    
     def __init__(self, config):
         self.config = config
+        
+        # 渲染结果缓存：user_id -> ((长期记忆版本, prompt名称), 上下文消息)
+        self._long_term_cache: Dict[str, Any] = {}
+        # 分段渲染缓存：user_id -> {section: (内容哈希, 渲染文本)}，用于增量重渲染
+        self._section_cache: Dict[str, Dict[str, Any]] = {}
+        self._cache_lock = threading.Lock()
+        self._cache_stats = {
+            'hits': 0,
+            'misses': 0,
+            'render_time': 0.0,
+            'sections_rendered': 0,
+            'sections_reused': 0
+        }
     
-    def get_context(self, memory_room) -> List[Dict[str, str]]:
+    def get_context(self, memory_room, prompt_name: Optional[str] = None) -> List[Dict[str, str]]:
         """获取对话上下文：长期记忆 + 短期记忆"""
-        long_term_context = self.format_long_term_context(memory_room.get_long_term_memory())
-        short_term_context = self.format_short_term_context(memory_room.get_short_term_memory())
+        long_term_context = self.get_long_term_context(memory_room, prompt_name)
+        short_term_context = self.format_short_term_context(
+            memory_room.get_short_term_memory(), memory_room.get_conversation_summary()
+        )
         
         return long_term_context + short_term_context
     
+    def get_long_term_context(self, memory_room, prompt_name: Optional[str] = None) -> List[Dict[str, str]]:
+        """获取长期记忆上下文，按 (用户, 长期记忆版本, prompt名称) 缓存渲染结果"""
+        user_id = memory_room.user_id
+        if not user_id:
+            return self.format_long_term_context(memory_room.get_long_term_memory())
+        
+        version = memory_room.version_tracker.get_version(user_id)['long_term_version']
+        cache_key = (version, prompt_name)
+        
+        with self._cache_lock:
+            cached = self._long_term_cache.get(user_id)
+            if cached and cached[0] == cache_key:
+                self._cache_stats['hits'] += 1
+                return [dict(message) for message in cached[1]]
+        
+        long_term_memory = memory_room.get_long_term_memory()
+        
+        start_time = time.perf_counter()
+        context = self._render_long_term_context(long_term_memory, user_id)
+        render_time = time.perf_counter() - start_time
+        
+        with self._cache_lock:
+            self._cache_stats['misses'] += 1
+            self._cache_stats['render_time'] += render_time
+            # 每个用户只保留最新版本的渲染结果
+            self._long_term_cache[user_id] = (cache_key, [dict(message) for message in context])
+        
+        logger.debug(f"长期记忆上下文已重新渲染，耗时 {render_time * 1000:.2f}ms")
+        return context
+    
+    def invalidate_long_term_cache(self, user_id: Optional[str] = None):
+        """使长期记忆渲染缓存失效（记忆整合后调用）"""
+        with self._cache_lock:
+            if user_id is None:
+                self._long_term_cache.clear()
+                self._section_cache.clear()
+            else:
+                self._long_term_cache.pop(user_id, None)
+                self._section_cache.pop(user_id, None)
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """获取长期记忆渲染缓存的统计信息"""
+        with self._cache_lock:
+            stats = dict(self._cache_stats)
+        
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / total if total else 0.0
+        stats['avg_render_time'] = stats['render_time'] / stats['misses'] if stats['misses'] else 0.0
+        return stats
+    
     def format_long_term_context(self, long_term_memory: Dict[str, Any]) -> List[Dict[str, str]]:
         """格式化长期记忆为上下文"""
+        return self._render_long_term_context(long_term_memory)
+    
+    def _render_long_term_context(self, long_term_memory: Dict[str, Any], user_id: Optional[str] = None) -> List[Dict[str, str]]:
+        """渲染长期记忆上下文；指定用户时只重新渲染内容发生变化的部分"""
         if not long_term_memory or not any(long_term_memory.values()):
             return []
         
+        renderers = {
+            'factual': self._render_factual_section,
+            'episodic': self._render_episodic_section,
+            'semantic': self._render_semantic_section
+        }
+        
+        with self._cache_lock:
+            previous_sections = dict(self._section_cache.get(user_id, {})) if user_id else {}
+        
+        sections = {}
         context_parts = []
+        rendered_count = 0
         
-        # 事实记忆
-        factual = long_term_memory.get('factual', {})
-        if factual:
-            factual_info = []
-            if factual.get('identity'):
-                factual_info.append(f"用户身份：{factual['identity']}")
-            if factual.get('preferences'):
-                factual_info.append(f"喜好：{factual['preferences']}")
-            if factual.get('interests'):
-                factual_info.append(f"兴趣：{factual['interests']}")
-            if factual.get('important_people'):
-                factual_info.append(f"重要人物：{factual['important_people']}")
-            if factual.get('taboos'):
-                factual_info.append(f"禁忌话题：{factual['taboos']}")
+        for section in self.LONG_TERM_SECTIONS:
+            section_data = long_term_memory.get(section)
+            # 情节记忆只渲染最近3条，只对这部分计算哈希
+            hashed_data = section_data[-3:] if section == 'episodic' and section_data else section_data
+            section_hash = self._hash_section(hashed_data)
             
-            if factual_info:
-                context_parts.append("事实记忆：\n" + "\n".join(f"- {info}" for info in factual_info))
-        
-        # 情节记忆
-        episodic = long_term_memory.get('episodic', [])
-        if episodic:
-            recent_episodes = episodic[-3:] if len(episodic) > 3 else episodic
-            episode_info = [f"- {episode.get('content', '')}" for episode in recent_episodes]
-            context_parts.append("最近经历：\n" + "\n".join(episode_info))
-        
-        # 语义记忆
-        semantic = long_term_memory.get('semantic', {})
-        if semantic:
-            semantic_info = []
-            if semantic.get('values'):
-                semantic_info.append(f"价值观：{semantic['values']}")
-            if semantic.get('themes'):
-                semantic_info.append(f"核心主题：{semantic['themes']}")
-            if semantic.get('goals'):
-                semantic_info.append(f"目标抱负：{semantic['goals']}")
+            previous = previous_sections.get(section)
+            if previous and previous[0] == section_hash:
+                rendered = previous[1]
+            else:
+                rendered = renderers[section](section_data)
+                rendered_count += 1
             
-            if semantic_info:
-                context_parts.append("语义记忆：\n" + "\n".join(f"- {info}" for info in semantic_info))
+            sections[section] = (section_hash, rendered)
+            if rendered:
+                context_parts.append(rendered)
+        
+        if user_id:
+            with self._cache_lock:
+                self._section_cache[user_id] = sections
+                self._cache_stats['sections_rendered'] += rendered_count
+                self._cache_stats['sections_reused'] += len(self.LONG_TERM_SECTIONS) - rendered_count
         
         if context_parts:
             context_text = "\n\n".join(context_parts)
@@ -70,9 +141,68 @@ class MemoryInteraction:
         
         return []
     
-    def format_short_term_context(self, short_term_memory: List[Dict[str, Any]]) -> List[Dict[str, str]]:
-        """格式化短期记忆为上下文"""
-        context = []
+    def _hash_section(self, section_data: Any) -> str:
+        """计算记忆分段内容的哈希"""
+        serialized = json.dumps(section_data, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.md5(serialized.encode('utf-8')).hexdigest()
+    
+    def _render_factual_section(self, factual: Optional[Dict[str, Any]]) -> str:
+        """渲染事实记忆"""
+        if not factual:
+            return ""
+        
+        factual_info = []
+        if factual.get('identity'):
+            factual_info.append(f"用户身份：{factual['identity']}")
+        if factual.get('preferences'):
+            factual_info.append(f"喜好：{factual['preferences']}")
+        if factual.get('interests'):
+            factual_info.append(f"兴趣：{factual['interests']}")
+        if factual.get('important_people'):
+            factual_info.append(f"重要人物：{factual['important_people']}")
+        if factual.get('taboos'):
+            factual_info.append(f"禁忌话题：{factual['taboos']}")
+        
+        if factual_info:
+            return "事实记忆：\n" + "\n".join(f"- {info}" for info in factual_info)
+        return ""
+    
+    def _render_episodic_section(self, episodic: Optional[List[Dict[str, Any]]]) -> str:
+        """渲染情节记忆（最近3条）"""
+        if not episodic:
+            return ""
+        
+        recent_episodes = episodic[-3:] if len(episodic) > 3 else episodic
+        episode_info = [f"- {episode.get('content', '')}" for episode in recent_episodes]
+        return "最近经历：\n" + "\n".join(episode_info)
+    
+    def _render_semantic_section(self, semantic: Optional[Dict[str, Any]]) -> str:
+        """渲染语义记忆"""
+        if not semantic:
+            return ""
+        
+        semantic_info = []
+        if semantic.get('values'):
+            semantic_info.append(f"价值观：{semantic['values']}")
+        if semantic.get('themes'):
+            semantic_info.append(f"核心主题：{semantic['themes']}")
+        if semantic.get('goals'):
+            semantic_info.append(f"目标抱负：{semantic['goals']}")
+        
+        if semantic_info:
+            return "语义记忆：\n" + "\n".join(f"- {info}" for info in semantic_info)
+        return ""
+    
+    def format_summary_context(self, conversation_summary: str) -> List[Dict[str, str]]:
+        """格式化滚动对话摘要为上下文"""
+        if not conversation_summary:
+            return []
+        return [{"role": "system", "content": f"此前对话摘要：\n{conversation_summary}"}]
+    
+    def format_short_term_context(self, short_term_memory: List[Dict[str, Any]],
+                                  conversation_summary: str = "") -> List[Dict[str, str]]:
+        """格式化短期记忆为上下文，较早的对话以摘要代替原文"""
+        context = self.format_summary_context(conversation_summary)
         for conv in short_term_memory:
             context.append({"role": "user", "content": conv['user']})
             context.append({"role": "assistant", "content": conv['ai']})
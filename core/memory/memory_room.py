@@ -1,7 +1,13 @@
+import copy
+import threading
+from collections import deque
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from loguru import logger
+from utils.token_counter import count_conversation_tokens
 from .memory_database import MemoryDatabase
+from .memory_hash import diff_memory
+from .memory_version import MemoryVersionTracker
 
 
 class MemoryRoom:
@@ -12,7 +18,16 @@ class MemoryRoom:
         self.user_id = user_id
         
         # 初始化SQLite数据库
-        self.database = MemoryDatabase()
+        self.database = MemoryDatabase(getattr(config, 'MEMORY_DB_PATH', 'data/memory.sqlite'))
+        
+        # 版本跟踪器：其它进程写入后自动使本地缓存失效
+        self.version_tracker = MemoryVersionTracker(self.database)
+        self._cache_lock = threading.RLock()
+        self._long_term_cache: Dict[str, Any] = {}
+        self._stats_cache: Dict[str, Any] = {}
+        # 短期记忆尾部缓存：user_id -> (短期记忆版本, 最近N轮对话的deque)
+        self._short_term_tail: Dict[str, Any] = {}
+        self._summary_cache: Dict[str, Any] = {}
         
         logger.info(f"记忆房间初始化完成，使用SQLite数据库存储，用户ID: {user_id}")
     
@@ -27,41 +42,54 @@ class MemoryRoom:
             logger.error("用户ID未设置，无法添加对话")
             return
         
+        timestamp = datetime.now().isoformat()
+        token_count = count_conversation_tokens(user_input, ai_response)
+        previous_version = self.version_tracker.get_version(self.user_id)['short_term_version']
+        
         # 使用数据库添加短期记忆
-        success = self.database.add_short_term_memory(self.user_id, user_input, ai_response)
+        row_id = self.database.add_short_term_memory(self.user_id, user_input, ai_response, timestamp, token_count)
         
-        if success:
+        if row_id:
+            current_version = self.version_tracker.get_version(self.user_id)['short_term_version']
+            self._append_to_short_term_tail(
+                previous_version, current_version,
+                {'user': user_input, 'ai': ai_response, 'timestamp': timestamp, 'token_count': token_count, 'id': row_id}
+            )
             logger.debug("对话已添加到短期记忆")
         else:
+            self._invalidate_short_term_tail()
             logger.error("添加对话到短期记忆失败")
     
+    def _append_to_short_term_tail(self, previous_version: int, current_version: int, conversation: Dict[str, Any]):
+        """将新对话追加到尾部缓存；若期间有其它写入（版本跳变），则放弃缓存"""
+        with self._cache_lock:
+            cached = self._short_term_tail.get(self.user_id)
+            if cached and cached[0] == previous_version and current_version == previous_version + 1:
+                cached[1].append(conversation)
+                self._short_term_tail[self.user_id] = (current_version, cached[1])
+            else:
+                self._short_term_tail.pop(self.user_id, None)
+    
+    def _reset_short_term_tail(self, conversations: List[Dict[str, Any]], previous_version: int, expected_writes: int):
+        """用给定的对话重建尾部缓存（清理或清空之后调用）；版本跳变说明有并发写入，此时放弃缓存"""
+        current_version = self.version_tracker.get_version(self.user_id)['short_term_version']
+        with self._cache_lock:
+            if current_version == previous_version + expected_writes:
+                self._short_term_tail[self.user_id] = (
+                    current_version,
+                    deque((dict(conv) for conv in conversations), maxlen=self.max_short_term_rounds)
+                )
+            else:
+                self._short_term_tail.pop(self.user_id, None)
+    
+    def _invalidate_short_term_tail(self):
+        """丢弃当前用户的尾部缓存，下次读取时回源数据库"""
+        with self._cache_lock:
+            self._short_term_tail.pop(self.user_id, None)
+    
     def _cleanup_old_short_term_memory(self):
         """清理过期的短期记忆，保持轮数限制"""
-        if not self.user_id:
-            return
-            
-        try:
-            # 获取当前短期记忆数量
-            stats = self.database.get_memory_stats(self.user_id)
-            current_count = stats['short_term_count']
-            
-            if current_count > self.max_short_term_rounds:
-                # 获取所有短期记忆
-                all_memories = self.database.get_short_term_memory(self.user_id)
-                
-                # 保留最新的N轮
-                memories_to_keep = all_memories[-self.max_short_term_rounds:]
-                
-                # 清空并重新添加保留的记忆
-                self.database.clear_short_term_memory(self.user_id)
-                
-                for memory in memories_to_keep:
-                    self.database.add_short_term_memory(self.user_id, memory['user'], memory['ai'])
-                
-                logger.info(f"清理短期记忆，从 {current_count} 轮减少到 {len(memories_to_keep)} 轮")
-                
-        except Exception as e:
-            logger.error(f"清理短期记忆失败: {e}")
+        self.cleanup_short_term_memory_if_needed()
     
     def get_short_term_memory(self) -> List[Dict[str, Any]]:
         """获取短期记忆"""
@@ -69,7 +97,87 @@ class MemoryRoom:
             logger.error("用户ID未设置，无法获取短期记忆")
             return []
         
-        return self.database.get_short_term_memory(self.user_id, limit=self.max_short_term_rounds)
+        version = self.version_tracker.get_version(self.user_id)['short_term_version']
+        
+        with self._cache_lock:
+            cached = self._short_term_tail.get(self.user_id)
+            if cached and cached[0] == version:
+                return [dict(conv) for conv in cached[1]]
+        
+        # 缓存未命中或版本变化，回源数据库并重建缓存
+        memories = self.database.get_short_term_memory(self.user_id, limit=self.max_short_term_rounds)
+        
+        with self._cache_lock:
+            self._short_term_tail[self.user_id] = (
+                version,
+                deque((dict(conv) for conv in memories), maxlen=self.max_short_term_rounds)
+            )
+        
+        return memories
+    
+    def get_unconsolidated_memory(self) -> List[Dict[str, Any]]:
+        """获取所有尚未整合的短期记忆，包括超出窗口、尚未并入滚动摘要的对话"""
+        if not self.user_id:
+            return []
+        return self.database.get_short_term_memory(self.user_id)
+    
+    def get_short_term_overflow(self) -> List[Dict[str, Any]]:
+        """获取超出短期记忆轮数限制、即将被清理的最早对话"""
+        if not self.user_id:
+            return []
+        
+        stats = self.get_memory_stats()
+        if stats['short_term_count'] <= self.max_short_term_rounds:
+            return []
+        
+        all_memories = self.database.get_short_term_memory(self.user_id)
+        return all_memories[:-self.max_short_term_rounds]
+    
+    def get_conversation_summary(self) -> str:
+        """获取滚动对话摘要（已滑出短期记忆窗口的对话概括）"""
+        if not self.user_id:
+            return ""
+        
+        version = self.version_tracker.get_version(self.user_id)['short_term_version']
+        
+        with self._cache_lock:
+            cached = self._summary_cache.get(self.user_id)
+            if cached and cached[0] == version:
+                return cached[1]
+        
+        summary = self.database.get_conversation_summary(self.user_id)['summary']
+        
+        with self._cache_lock:
+            self._summary_cache[self.user_id] = (version, summary)
+        
+        return summary
+    
+    def save_conversation_summary(self, summary: str, added_rounds: int):
+        """保存滚动对话摘要"""
+        if not self.user_id:
+            logger.error("用户ID未设置，无法保存对话摘要")
+            return
+        
+        previous_version = self.version_tracker.get_version(self.user_id)['short_term_version']
+        success = self.database.save_conversation_summary(self.user_id, summary, added_rounds)
+        
+        if success:
+            # 摘要写入只递增一次版本，对话尾部缓存仍然有效
+            with self._cache_lock:
+                cached = self._short_term_tail.get(self.user_id)
+            if cached and cached[0] == previous_version:
+                self._reset_short_term_tail(list(cached[1]), previous_version, 1)
+        else:
+            logger.error("保存对话摘要失败")
+    
+    def clear_conversation_summary(self):
+        """清空滚动对话摘要"""
+        if not self.user_id:
+            return
+        
+        self.database.clear_conversation_summary(self.user_id)
+        with self._cache_lock:
+            self._summary_cache.pop(self.user_id, None)
     
     def get_long_term_memory(self) -> Dict[str, Any]:
         """获取长期记忆"""
@@ -77,7 +185,20 @@ class MemoryRoom:
             logger.error("用户ID未设置，无法获取长期记忆")
             return {'factual': {}, 'episodic': [], 'semantic': {}}
         
-        return self.database.get_long_term_memory(self.user_id)
+        version = self.version_tracker.get_version(self.user_id)
+        
+        with self._cache_lock:
+            cached = self._long_term_cache.get(self.user_id)
+            if cached and cached[0] == version['long_term_version']:
+                # 返回副本，避免调用方修改缓存内容
+                return copy.deepcopy(cached[1])
+        
+        long_term_memory = self.database.get_long_term_memory(self.user_id)
+        
+        with self._cache_lock:
+            self._long_term_cache[self.user_id] = (version['long_term_version'], copy.deepcopy(long_term_memory))
+        
+        return long_term_memory
     
     def update_long_term_memory(self, new_long_term_data: Dict[str, Any]):
         """更新长期记忆"""
@@ -92,21 +213,60 @@ class MemoryRoom:
         else:
             logger.error("更新长期记忆失败")
     
+    def apply_long_term_changes(self, new_long_term_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """按内容哈希与已存储的长期记忆比较，只写入有变化的部分
+
+        返回各部分的差异（空字典表示没有变化），写入失败时返回None。
+        """
+        if not self.user_id:
+            logger.error("用户ID未设置，无法更新长期记忆")
+            return None
+        
+        diff = diff_memory(self.database.get_memory_hashes(self.user_id), new_long_term_data)
+        if diff and not self.database.apply_long_term_diff(self.user_id, diff):
+            return None
+        return diff
+    
+    def commit_consolidation(self, new_long_term_data: Dict[str, Any], consumed_short_term_ids: List[int],
+                             round_counter: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """在一个事务中提交记忆整合：写入长期记忆变化、删除已分析的短期记忆和摘要、更新轮计数"""
+        if not self.user_id:
+            logger.error("用户ID未设置，无法提交记忆整合")
+            return None
+        
+        result = self.database.commit_consolidation(
+            self.user_id, new_long_term_data, consumed_short_term_ids, round_counter
+        )
+        if result is not None:
+            with self._cache_lock:
+                self._short_term_tail.pop(self.user_id, None)
+                self._summary_cache.pop(self.user_id, None)
+        return result
+    
+    def get_consolidation_state(self) -> Dict[str, Any]:
+        """获取持久化的整合状态（上次整合以来累计的轮数、token数、字符数）"""
+        if not self.user_id:
+            return {'round_counter': 0, 'pending_tokens': 0, 'pending_chars': 0,
+                    'last_round_at': None, 'last_consolidated_at': None}
+        return self.database.get_consolidation_state(self.user_id)
+    
     def clear_short_term_memory(self):
         """清空短期记忆"""
         if not self.user_id:
             logger.error("用户ID未设置，无法清空短期记忆")
             return
         
+        previous_version = self.version_tracker.get_version(self.user_id)['short_term_version']
         success = self.database.clear_short_term_memory(self.user_id)
         
         if success:
+            self._reset_short_term_tail([], previous_version, 1)
             logger.info("短期记忆已清空")
         else:
             logger.error("清空短期记忆失败")
     
-    def cleanup_short_term_memory_if_needed(self):
-        """如果需要，清理过期的短期记忆"""
+    def cleanup_short_term_memory_if_needed(self, up_to_id: Optional[int] = None):
+        """如果需要，清理过期的短期记忆（指定up_to_id时只清理ID不超过它的记录，例如已并入摘要的对话）"""
         if not self.user_id:
             return
             
@@ -119,18 +279,21 @@ class MemoryRoom:
                 # 获取所有短期记忆
                 all_memories = self.database.get_short_term_memory(self.user_id)
                 
-                # 保留最新的N轮
-                memories_to_keep = all_memories[-self.max_short_term_rounds:]
-                
-                # 清空并重新添加保留的记忆
-                self.database.clear_short_term_memory(self.user_id)
+                # 保留最新的N轮，按ID删除更早的记录（保留的记录ID不变）
+                expired_ids = [memory['id'] for memory in all_memories[:-self.max_short_term_rounds]
+                               if up_to_id is None or memory['id'] <= up_to_id]
+                if not expired_ids:
+                    return
+                memories_to_keep = all_memories[len(expired_ids):]
                 
-                for memory in memories_to_keep:
-                    self.database.add_short_term_memory(self.user_id, memory['user'], memory['ai'])
+                previous_version = self.version_tracker.get_version(self.user_id)['short_term_version']
+                self.database.delete_short_term_memory(self.user_id, expired_ids)
                 
+                self._reset_short_term_tail(memories_to_keep, previous_version, 1)
                 logger.info(f"清理短期记忆，从 {current_count} 轮减少到 {len(memories_to_keep)} 轮")
                 
         except Exception as e:
+            self._invalidate_short_term_tail()
             logger.error(f"清理短期记忆失败: {e}")
     
     def clear_all_memory(self):
@@ -139,9 +302,11 @@ class MemoryRoom:
             logger.error("用户ID未设置，无法清空所有记忆")
             return
         
+        previous_version = self.version_tracker.get_version(self.user_id)['short_term_version']
         success = self.database.clear_all_memory(self.user_id)
         
         if success:
+            self._reset_short_term_tail([], previous_version, 1)
             logger.info("所有记忆已清空")
         else:
             logger.error("清空所有记忆失败")
@@ -157,7 +322,20 @@ class MemoryRoom:
                 'long_term_semantic_count': 0
             }
         
-        return self.database.get_memory_stats(self.user_id)
+        version = self.version_tracker.get_version(self.user_id)
+        version_key = (version['short_term_version'], version['long_term_version'])
+        
+        with self._cache_lock:
+            cached = self._stats_cache.get(self.user_id)
+            if cached and cached[0] == version_key:
+                return dict(cached[1])
+        
+        stats = self.database.get_memory_stats(self.user_id)
+        
+        with self._cache_lock:
+            self._stats_cache[self.user_id] = (version_key, dict(stats))
+        
+        return stats
     
     def export_memory(self, export_path: str = None) -> str:
         """导出记忆数据"""
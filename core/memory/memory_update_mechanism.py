@@ -1,7 +1,17 @@
-import json
-from typing import List, Dict, Any
+import copy
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
 from loguru import logger
+from langchain_core.messages import AIMessage, HumanMessage
 from config import PromptManager
+from utils.token_counter import count_tokens
+from .memory_hash import MEMORY_SECTIONS
+from .structured_output import (
+    MEMORY_ANALYSIS_SCHEMA, MEMORY_DELTA_SCHEMA, StreamingJSONValidator, StructuredOutputError,
+    validate_memory_analysis, validate_memory_delta
+)
 
 
 class MemoryUpdateMechanism:
@@ -10,12 +20,30 @@ class MemoryUpdateMechanism:
     def __init__(self, config, llm=None, memory_room=None):
         self.config = config
         self.current_round = 0
+        # 上次整合以来累计的token数、字符数和最近一轮对话时间（由数据库中的整合状态同步）
+        self.pending_tokens = 0
+        self.pending_chars = 0
+        self.last_round_at = None
         self.llm = llm
         self.memory_room = memory_room
         
+        # 最近一次记忆分析的错误（None表示成功），供批量整合等调用方区分失败与无变化
+        self.last_error = None
+        
+        # 记忆分析结果缓存（可选），以及最近一次分析是否命中缓存
+        self.analysis_cache = None
+        self.last_cache_hit = False
+        
+        # 最近一次记忆更新的token用量（多次调用合计，命中缓存的调用不计）与并行提取中失败的部分
+        self.last_usage: Dict[str, int] = {}
+        self.last_section_errors: Dict[str, str] = {}
+        
         # 初始化Prompt管理器
         self.prompt_manager = PromptManager()
         self.memory_analysis_template = self.prompt_manager.create_memory_analysis_template()
+        self.incremental_memory_template = self.prompt_manager.create_incremental_memory_template()
+        self.section_memory_templates = self.prompt_manager.create_section_memory_templates()
+        self.rolling_summary_template = self.prompt_manager.create_rolling_summary_template()
     
     def set_llm(self, llm):
         """设置LLM接口"""
@@ -25,25 +53,109 @@ class MemoryUpdateMechanism:
         """设置记忆房间"""
         self.memory_room = memory_room
     
+    def set_analysis_cache(self, analysis_cache):
+        """设置记忆分析结果缓存"""
+        self.analysis_cache = analysis_cache
+    
     def increment_round(self):
         """增加对话轮数"""
         self.current_round += 1
     
+    def sync_state(self, state: Dict[str, Any]):
+        """用数据库中持久化的整合状态更新计数（多个Agent或进程服务同一用户时保持一致）"""
+        self.current_round = state.get('round_counter', 0)
+        self.pending_tokens = state.get('pending_tokens', 0)
+        self.pending_chars = state.get('pending_chars', 0)
+        self.last_round_at = state.get('last_round_at')
+    
     def should_trigger_update(self) -> bool:
         """判断是否应该触发记忆更新"""
-        # 只有当轮数大于0且是MEMORY_UPDATE_INTERVAL的倍数时才触发更新
-        return self.current_round > 0 and self.current_round % self.config.MEMORY_UPDATE_INTERVAL == 0
+        return self.get_trigger_reason() is not None
+    
+    def get_trigger_reason(self, now: Optional[datetime] = None) -> Optional[str]:
+        """按触发策略判断是否需要整合，返回触发原因（不需要时返回None）
+
+        累计轮数达到MEMORY_UPDATE_INTERVAL，或累计token数/字符数达到配置的阈值时触发，
+        使每次整合的输入规模接近模型合适的批量；空闲触发见get_idle_reason。
+        """
+        if self.current_round <= 0:
+            return None
+        
+        if self.current_round >= self.config.MEMORY_UPDATE_INTERVAL:
+            return f"累计 {self.current_round} 轮"
+        
+        token_threshold = getattr(self.config, 'MEMORY_UPDATE_TOKEN_THRESHOLD', 0)
+        if token_threshold and self.pending_tokens >= token_threshold:
+            return f"累计 {self.pending_tokens} tokens"
+        
+        char_threshold = getattr(self.config, 'MEMORY_UPDATE_CHAR_THRESHOLD', 0)
+        if char_threshold and self.pending_chars >= char_threshold:
+            return f"累计 {self.pending_chars} 字符"
+        
+        return self.get_idle_reason(now)
+    
+    def get_idle_reason(self, now: Optional[datetime] = None) -> Optional[str]:
+        """距最近一轮对话空闲超过MEMORY_UPDATE_IDLE_SECONDS且有待整合的对话时，返回触发原因"""
+        idle_seconds = getattr(self.config, 'MEMORY_UPDATE_IDLE_SECONDS', 0)
+        if not idle_seconds or self.current_round <= 0 or not self.last_round_at:
+            return None
+        
+        try:
+            idle = ((now or datetime.now()) - datetime.fromisoformat(self.last_round_at)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+        if idle >= idle_seconds:
+            return f"空闲 {idle:.0f} 秒"
+        return None
+    
+    def update_rolling_summary(self, overflow_turns: List[Dict[str, str]]) -> str:
+        """用滑出短期记忆窗口的对话增量更新滚动摘要，只发送这些对话和已有摘要"""
+        if not overflow_turns or not self.memory_room:
+            return ""
+        
+        existing_summary = self.memory_room.get_conversation_summary()
+        
+        try:
+            prompt_messages = self.rolling_summary_template.format_messages(
+                existing_summary=existing_summary or "（暂无）",
+                conversations=self._format_conversations(overflow_turns)
+            )
+            summary = self.llm.invoke_direct(prompt_messages).strip()
+            
+            if not summary:
+                logger.warning("滚动摘要生成结果为空，保留原有摘要")
+                return existing_summary
+            
+            self.memory_room.save_conversation_summary(summary, len(overflow_turns))
+            logger.info(f"滚动对话摘要已更新，新增概括 {len(overflow_turns)} 轮对话")
+            return summary
+            
+        except Exception as e:
+            logger.error(f"更新滚动对话摘要失败: {e}")
+            return existing_summary
     
-    def update_memory(self, short_term_memory: List[Dict[str, str]], existing_long_term_memory: Dict[str, Any]) -> Dict[str, Any]:
-        """更新长期记忆"""
+    def update_memory(self, short_term_memory: List[Dict[str, str]], existing_long_term_memory: Dict[str, Any],
+                      conversation_summary: str = "") -> Dict[str, Any]:
+        """更新长期记忆（conversation_summary为已滑出窗口对话的摘要，一并参与分析）"""
+        mode = getattr(self.config, 'MEMORY_UPDATE_MODE', 'full')
+        if mode == 'incremental':
+            return self.update_memory_incremental(short_term_memory, existing_long_term_memory, conversation_summary)
+        if mode == 'parallel':
+            return self.update_memory_parallel(short_term_memory, existing_long_term_memory, conversation_summary)
+        
+        self.last_error = None
+        self.last_usage = {}
         try:
             # 构建对话内容字符串
             conversations = self._format_conversations(short_term_memory)
+            if conversation_summary:
+                conversations = f"此前对话摘要:\n{conversation_summary}\n\n{conversations}"
             
-            # 使用LLM分析对话内容
+            # 使用LLM分析对话内容（JSON模式流式校验，不合法时修复重试一次）
             prompt_messages = self.memory_analysis_template.format_messages(conversations=conversations)
-            analysis_result = self.llm.invoke_direct(prompt_messages)
-            new_long_term_memory = self.parse_analysis_result(analysis_result)
+            new_long_term_memory = self._invoke_structured(
+                prompt_messages, MEMORY_ANALYSIS_SCHEMA, validate_memory_analysis, self.last_usage
+            )
             
             # 合并新旧记忆
             merged_memory = self._merge_memories(existing_long_term_memory, new_long_term_memory)
@@ -53,8 +165,253 @@ class MemoryUpdateMechanism:
             
         except Exception as e:
             logger.error(f"记忆更新失败: {e}")
+            self.last_error = str(e)
+            return existing_long_term_memory
+    
+    def update_memory_incremental(self, short_term_memory: List[Dict[str, str]], existing_long_term_memory: Dict[str, Any],
+                                  conversation_summary: str = "") -> Dict[str, Any]:
+        """增量更新长期记忆：只发送新对话和限定token数的记忆摘要，按LLM返回的增删改操作就地修改"""
+        self.last_error = None
+        self.last_usage = {}
+        try:
+            conversations = self._format_conversations(short_term_memory)
+            if conversation_summary:
+                conversations = f"此前对话摘要:\n{conversation_summary}\n\n{conversations}"
+            
+            digest = self.build_memory_digest(
+                existing_long_term_memory, getattr(self.config, 'MEMORY_DIGEST_TOKEN_BUDGET', 800)
+            )
+            prompt_messages = self.incremental_memory_template.format_messages(
+                memory_digest=digest, conversations=conversations
+            )
+            ops = self._invoke_structured(prompt_messages, MEMORY_DELTA_SCHEMA, validate_memory_delta, self.last_usage)['ops']
+            
+            updated_memory, applied = self.apply_memory_delta(existing_long_term_memory, ops)
+            logger.info(f"增量记忆更新完成: 应用 {applied}/{len(ops)} 项操作")
+            return updated_memory
+            
+        except Exception as e:
+            logger.error(f"增量记忆更新失败: {e}")
+            self.last_error = str(e)
+            return existing_long_term_memory
+    
+    def update_memory_parallel(self, short_term_memory: List[Dict[str, str]], existing_long_term_memory: Dict[str, Any],
+                               conversation_summary: str = "") -> Dict[str, Any]:
+        """按事实、情节、语义三个部分并行提取后合并（每次调用的输出更短）
+
+        每个部分有各自的超时（MEMORY_SECTION_TIMEOUT_SECONDS），超时或失败的部分记录在 last_section_errors 中，
+        不影响其它部分的结果；所有部分都失败时才视为整次更新失败。
+        """
+        self.last_error = None
+        self.last_usage = {}
+        self.last_section_errors = {}
+        try:
+            conversations = self._format_conversations(short_term_memory)
+            if conversation_summary:
+                conversations = f"此前对话摘要:\n{conversation_summary}\n\n{conversations}"
+            
+            timeout = getattr(self.config, 'MEMORY_SECTION_TIMEOUT_SECONDS', 60.0)
+            section_usages = {section: {} for section in MEMORY_SECTIONS}
+            executor = ThreadPoolExecutor(max_workers=len(MEMORY_SECTIONS), thread_name_prefix="memory-section")
+            futures = {
+                section: executor.submit(self._extract_section, section, conversations, section_usages[section])
+                for section in MEMORY_SECTIONS
+            }
+            
+            # 各部分同时开始，按各自的超时等待
+            deadline = time.monotonic() + timeout
+            new_long_term_memory = validate_memory_analysis({})
+            for section, future in futures.items():
+                try:
+                    new_long_term_memory[section] = future.result(timeout=max(deadline - time.monotonic(), 0))
+                except FuturesTimeoutError:
+                    self.last_section_errors[section] = f"超时（{timeout}秒）"
+                except Exception as e:
+                    self.last_section_errors[section] = str(e)
+            # 超时的调用无法中止，留在后台结束，结果丢弃
+            executor.shutdown(wait=False)
+            
+            for section in MEMORY_SECTIONS:
+                if section not in self.last_section_errors:
+                    self._add_usage(self.last_usage, section_usages[section])
+            self.last_cache_hit = not self.last_section_errors and not self.last_usage.get('calls')
+            
+            if len(self.last_section_errors) == len(MEMORY_SECTIONS):
+                raise RuntimeError(f"所有记忆部分提取失败: {self.last_section_errors}")
+            if self.last_section_errors:
+                logger.warning(f"部分记忆提取失败，其余部分照常合并: {self.last_section_errors}")
+            
+            merged_memory = self._merge_memories(existing_long_term_memory, new_long_term_memory)
+            logger.info(f"并行记忆提取完成: 成功 {len(MEMORY_SECTIONS) - len(self.last_section_errors)}/{len(MEMORY_SECTIONS)} 个部分")
+            return merged_memory
+            
+        except Exception as e:
+            logger.error(f"并行记忆更新失败: {e}")
+            self.last_error = str(e)
             return existing_long_term_memory
     
+    def _extract_section(self, section: str, conversations: str, usage: Dict[str, int]) -> Any:
+        """提取单个记忆部分（在工作线程中执行）"""
+        prompt_messages = self.section_memory_templates[section].format_messages(conversations=conversations)
+        result = self._invoke_structured(
+            prompt_messages, {section: MEMORY_ANALYSIS_SCHEMA[section]}, validate_memory_analysis, usage
+        )
+        return result[section]
+    
+    def _invoke_structured(self, prompt_messages: list, schema: Dict[str, str], validate,
+                           usage: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """获取并校验结构化输出，相同的提示词优先复用缓存中已校验的结果
+
+        usage 不为空时累加本次LLM调用的token用量和调用次数。
+        """
+        self.last_cache_hit = False
+        if self.analysis_cache is None:
+            return self._invoke_structured_uncached(prompt_messages, schema, validate, usage)
+        
+        cache_key = self.analysis_cache.make_key(self.llm.provider, self.llm.model, prompt_messages)
+        cached = self.analysis_cache.get(cache_key)
+        if cached is not None:
+            try:
+                result = validate(cached)
+                self.last_cache_hit = True
+                return result
+            except StructuredOutputError as e:
+                logger.warning(f"缓存的分析结果不合法，重新分析: {e}")
+        
+        result = self._invoke_structured_uncached(prompt_messages, schema, validate, usage)
+        self.analysis_cache.put(cache_key, result, self.llm.model)
+        return result
+    
+    def _invoke_structured_uncached(self, prompt_messages: list, schema: Dict[str, str], validate,
+                                    usage: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """流式获取并校验结构化输出；输出损坏或不符合格式时带上错误信息重试一次，仍失败则抛出异常"""
+        validator = StreamingJSONValidator(schema)
+        try:
+            return validate(self._invoke_json(prompt_messages, validator, usage))
+        except StructuredOutputError as e:
+            logger.warning(f"结构化输出不合法，尝试修复: {e}")
+            repair_messages = list(prompt_messages) + [
+                AIMessage(content=validator.text or "（空）"),
+                HumanMessage(content=self.prompt_manager.get_json_repair_prompt().format(error=e))
+            ]
+        
+        validator = StreamingJSONValidator(schema)
+        try:
+            return validate(self._invoke_json(repair_messages, validator, usage))
+        except StructuredOutputError as e:
+            raise StructuredOutputError(f"修复重试后结构化输出仍不合法: {e}")
+    
+    def _invoke_json(self, prompt_messages: list, validator: StreamingJSONValidator,
+                     usage: Optional[Dict[str, int]]) -> Any:
+        """调用LLM并累加token用量（流中途校验失败时同样计入已产生的调用）"""
+        self.llm.last_usage = {}
+        try:
+            return self.llm.invoke_json(prompt_messages, validator)
+        finally:
+            if usage is not None:
+                self._add_usage(usage, {**self.llm.last_usage, 'calls': 1})
+    
+    def _add_usage(self, total: Dict[str, int], usage: Dict[str, int]):
+        """累加token用量"""
+        for key in ('input_tokens', 'output_tokens', 'calls'):
+            if usage.get(key):
+                total[key] = total.get(key, 0) + usage[key]
+    
+    def build_memory_digest(self, memory: Dict[str, Any], token_budget: int = 800) -> str:
+        """生成紧凑的长期记忆摘要：事实和语义记忆全部保留，情节记忆从最新往前取到预算用完
+        
+        情节记忆以 E编号（从1开始）标识，供LLM在 update/delete 操作中引用。
+        """
+        lines = []
+        for section, title in (('factual', '[事实记忆]'), ('semantic', '[语义记忆]')):
+            entries = [(key, value) for key, value in memory.get(section, {}).items() if value]
+            if entries:
+                lines.append(title)
+                lines.extend(f"{key}: {value}" for key, value in entries)
+        
+        episodic = memory.get('episodic', [])
+        used = count_tokens("\n".join(lines))
+        episodic_lines = []
+        for index in range(len(episodic), 0, -1):
+            episode = episodic[index - 1]
+            line = f"E{index} [{episode.get('type', '')}] {episode.get('content', '')}"
+            line_tokens = count_tokens(line) + 1
+            if used + line_tokens > token_budget:
+                break
+            episodic_lines.append(line)
+            used += line_tokens
+        
+        if episodic:
+            lines.append(f"[情节记忆]（共{len(episodic)}条，显示最近{len(episodic_lines)}条）")
+            lines.extend(reversed(episodic_lines))
+        
+        return "\n".join(lines) if lines else "（暂无）"
+    
+    def apply_memory_delta(self, memory: Dict[str, Any], ops: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], int]:
+        """将增删改操作应用到长期记忆副本上，返回 (新记忆, 成功应用的操作数)
+        
+        情节记忆的编号以操作前的列表为准，删除在最后统一执行，避免编号错位。
+        """
+        result = copy.deepcopy(memory)
+        for section, default in self._get_empty_memory_structure().items():
+            result.setdefault(section, type(default)())
+        
+        allowed_keys = {section: set(keys) for section, keys in self._get_empty_memory_structure().items()
+                        if isinstance(keys, dict)}
+        episodic = result['episodic']
+        deleted = set()
+        applied = 0
+        
+        for op in ops:
+            if not isinstance(op, dict):
+                continue
+            action, section, key, value = op.get('op'), op.get('section'), op.get('key'), op.get('value')
+            
+            if section in allowed_keys and key in allowed_keys[section]:
+                if action in ('add', 'update') and value:
+                    result[section][key] = str(value)
+                    applied += 1
+                    continue
+                if action == 'delete':
+                    result[section].pop(key, None)
+                    applied += 1
+                    continue
+            
+            elif section == 'episodic':
+                if action == 'add' and isinstance(value, dict) and value.get('content'):
+                    episodic.append({'type': value.get('type', ''), 'content': value['content'],
+                                     'timestamp': value.get('timestamp', '')})
+                    applied += 1
+                    continue
+                
+                index = self._parse_episode_id(key, len(memory.get('episodic', [])))
+                if index is not None and action == 'update' and value:
+                    if isinstance(value, dict):
+                        episodic[index].update({k: v for k, v in value.items() if v})
+                    else:
+                        episodic[index]['content'] = str(value)
+                    applied += 1
+                    continue
+                if index is not None and action == 'delete':
+                    deleted.add(index)
+                    applied += 1
+                    continue
+            
+            logger.warning(f"忽略无效的记忆操作: {op}")
+        
+        if deleted:
+            result['episodic'] = [episode for i, episode in enumerate(episodic) if i not in deleted]
+        
+        return result, applied
+    
+    def _parse_episode_id(self, key: Any, count: int):
+        """将 E3 形式的情节记忆编号转换为列表下标，无效时返回None"""
+        try:
+            index = int(str(key).strip().upper().lstrip('E')) - 1
+        except (TypeError, ValueError):
+            return None
+        return index if 0 <= index < count else None
+    
     def _format_conversations(self, short_term_memory: List[Dict[str, str]]) -> str:
         """格式化对话内容"""
         formatted = []
@@ -67,24 +424,15 @@ class MemoryUpdateMechanism:
         return "\n".join(formatted)
     
     def parse_analysis_result(self, analysis_result: str) -> Dict[str, Any]:
-        """解析LLM分析结果"""
+        """解析并校验完整的记忆分析结果（非流式），不合法时记录错误并返回空结构"""
+        validator = StreamingJSONValidator(MEMORY_ANALYSIS_SCHEMA)
         try:
-            import json
-            # 尝试直接解析JSON
-            return json.loads(analysis_result)
-        except json.JSONDecodeError:
-            try:
-                # 尝试提取JSON部分
-                import re
-                json_match = re.search(r'\{.*\}', analysis_result, re.DOTALL)
-                if json_match:
-                    return json.loads(json_match.group())
-                else:
-                    logger.error("无法从分析结果中提取JSON")
-                    return self._get_empty_memory_structure()
-            except Exception as e:
-                logger.error(f"解析分析结果失败: {e}")
-                return self._get_empty_memory_structure()
+            validator.feed(analysis_result)
+            return validate_memory_analysis(validator.close())
+        except StructuredOutputError as e:
+            logger.error(f"解析分析结果失败: {e}")
+            self.last_error = f"解析分析结果失败: {e}"
+            return self._get_empty_memory_structure()
     
     def _get_empty_memory_structure(self) -> Dict[str, Any]:
         """获取空的记忆结构"""
@@ -0,0 +1,61 @@
+import threading
+from typing import Dict, Optional
+from loguru import logger
+
+
+class MemoryVersionTracker:
+    """记忆版本跟踪器：判断进程内缓存是否因其它进程的写入而过期
+
+    协议分两级：
+    1. PRAGMA data_version 作为全局快速检查，数据库没有任何提交时直接复用已知版本；
+    2. data_version 变化后，按用户读取 memory_versions 表中的版本行（主键索引单行读取）。
+    """
+    
+    def __init__(self, database):
+        self.database = database
+        self._lock = threading.Lock()
+        self._data_version: Optional[int] = None
+        self._versions: Dict[str, Dict[str, int]] = {}
+        # 每次清空已知版本时递增：回源读取期间缓存被清空过，读到的版本可能已过期，不再写回
+        self._generation = 0
+    
+    def has_changed(self) -> bool:
+        """检查数据库自上次检查以来是否有任何提交"""
+        data_version = self.database.get_data_version()
+        
+        with self._lock:
+            if data_version is None or data_version != self._data_version:
+                self._data_version = data_version
+                self._versions.clear()
+                self._generation += 1
+                return True
+            return False
+    
+    def get_version(self, user_id: str) -> Dict[str, int]:
+        """获取用户当前的记忆版本号"""
+        self.has_changed()
+        
+        with self._lock:
+            cached = self._versions.get(user_id)
+            if cached is not None:
+                return dict(cached)
+            generation = self._generation
+        
+        version = self.database.get_memory_version(user_id)
+        
+        with self._lock:
+            # 读取失败时（版本为-1）或读取期间有新的提交（其它线程已清空缓存）时不缓存，下次继续回源
+            if version['short_term_version'] >= 0 and generation == self._generation:
+                self._versions[user_id] = dict(version)
+        
+        return version
+    
+    def invalidate(self, user_id: Optional[str] = None):
+        """使已知版本失效，下次读取时重新查询数据库"""
+        with self._lock:
+            if user_id is None:
+                self._versions.clear()
+            else:
+                self._versions.pop(user_id, None)
+            self._generation += 1
+        logger.debug(f"记忆版本缓存已失效: {user_id or '全部用户'}")
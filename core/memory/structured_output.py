@@ -0,0 +1,198 @@
+import json
+from typing import Any, Dict, List, Optional
+from loguru import logger
+
+
+# 顶层字段 -> 期望的值类型（object / array / string）
+MEMORY_ANALYSIS_SCHEMA = {'factual': 'object', 'episodic': 'array', 'semantic': 'object'}
+MEMORY_DELTA_SCHEMA = {'ops': 'array'}
+
+MEMORY_FIELD_KEYS = {
+    'factual': ('identity', 'preferences', 'interests', 'important_people', 'taboos'),
+    'semantic': ('values', 'themes', 'goals')
+}
+MEMORY_OPS = ('add', 'update', 'delete')
+
+
+class StructuredOutputError(ValueError):
+    """LLM的结构化输出不合法（JSON损坏或不符合记忆格式）"""
+
+
+class StreamingJSONValidator:
+    """流式JSON校验器：随着输出块到达逐字符检查，发现问题立即抛出StructuredOutputError
+
+    检查输出以JSON对象开头（允许```json代码块）、括号配对、顶层字段名及其值类型，
+    以及对象结束后没有多余内容。不需要等完整输出就能中止损坏的流。
+    """
+    
+    _FENCE_PREFIXES = ("```json", "```JSON", "```")
+    
+    def __init__(self, schema: Dict[str, str]):
+        self.schema = schema
+        self.text = ""
+        self._start = None
+        self._end = None
+        self._prefix = ""
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key_chars: Optional[List[str]] = None
+        self._pending_key: Optional[str] = None
+        self._expect_value = False
+    
+    def feed(self, chunk: str):
+        """校验一个输出块"""
+        for char in chunk:
+            self._feed_char(char, len(self.text))
+            self.text += char
+    
+    def close(self) -> Any:
+        """输出结束：检查JSON完整并返回解析结果"""
+        if self._start is None or self._end is None:
+            raise StructuredOutputError("JSON不完整：输出在对象结束前中断")
+        try:
+            return json.loads(self.text[self._start:self._end + 1])
+        except json.JSONDecodeError as e:
+            raise StructuredOutputError(f"JSON解析失败: {e}")
+    
+    def _feed_char(self, char: str, position: int):
+        if self._start is None:
+            self._feed_prefix(char, position)
+            return
+        
+        if self._end is not None:
+            if not char.isspace() and char != '`':
+                raise StructuredOutputError("JSON对象结束后存在多余内容")
+            return
+        
+        if self._in_string:
+            if self._key_chars is not None and not (self._escape or char in '\\"'):
+                self._key_chars.append(char)
+            if self._escape:
+                self._escape = False
+            elif char == '\\':
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._key_chars is not None:
+                    self._finish_key(''.join(self._key_chars))
+            return
+        
+        if char.isspace():
+            return
+        
+        depth = len(self._stack)
+        if depth == 1 and self._expect_value:
+            self._check_value_type(char)
+        
+        if char == '"':
+            self._in_string = True
+            if depth == 1 and self._expect_key:
+                self._key_chars = []
+                self._expect_key = False
+        elif char in '{[':
+            self._stack.append(char)
+        elif char in '}]':
+            expected = '{' if char == '}' else '['
+            if not self._stack or self._stack[-1] != expected:
+                raise StructuredOutputError(f"括号不匹配：位置 {position} 处的 '{char}'")
+            self._stack.pop()
+            if not self._stack:
+                self._end = position
+        elif depth == 1:
+            if char == ':' and self._pending_key is not None:
+                self._expect_value = True
+            elif char == ',':
+                self._expect_key = True
+            elif not self._expect_value and char not in ',:':
+                raise StructuredOutputError(f"JSON对象格式错误：位置 {position} 处的 '{char}'")
+    
+    def _feed_prefix(self, char: str, position: int):
+        """对象开始之前只允许空白和代码块标记"""
+        if char == '{':
+            self._start = position
+            self._stack.append('{')
+            self._expect_key = True
+            return
+        if char.isspace() and (not self._prefix or self._prefix in self._FENCE_PREFIXES):
+            return
+        self._prefix += char
+        if not any(fence.startswith(self._prefix) for fence in self._FENCE_PREFIXES):
+            raise StructuredOutputError("输出不是以JSON对象开头")
+    
+    def _finish_key(self, key: str):
+        """顶层字段名读完：检查是否在格式中"""
+        self._key_chars = None
+        if key not in self.schema:
+            raise StructuredOutputError(f"未知字段: {key}")
+        self._pending_key = key
+    
+    def _check_value_type(self, char: str):
+        """顶层字段值开始：检查值类型"""
+        expected = self.schema[self._pending_key]
+        actual = {'{': 'object', '[': 'array', '"': 'string'}.get(char, 'scalar')
+        self._expect_value = False
+        if actual != expected:
+            raise StructuredOutputError(f"字段 {self._pending_key} 应为 {expected}，实际为 {actual}")
+        self._pending_key = None
+
+
+def validate_memory_analysis(data: Any) -> Dict[str, Any]:
+    """校验并规范化记忆分析结果：缺失的部分补为空，未知子字段丢弃，类型不符时抛出异常"""
+    if not isinstance(data, dict):
+        raise StructuredOutputError("记忆分析结果应为JSON对象")
+    
+    result = {}
+    for section, keys in MEMORY_FIELD_KEYS.items():
+        values = data.get(section) or {}
+        if not isinstance(values, dict):
+            raise StructuredOutputError(f"{section} 应为对象")
+        result[section] = {key: _as_text(values.get(key), f"{section}.{key}") for key in keys}
+        unknown = set(values) - set(keys)
+        if unknown:
+            logger.warning(f"忽略 {section} 中的未知字段: {sorted(unknown)}")
+    
+    episodic = data.get('episodic') or []
+    if not isinstance(episodic, list):
+        raise StructuredOutputError("episodic 应为数组")
+    result['episodic'] = []
+    for index, episode in enumerate(episodic):
+        if not isinstance(episode, dict):
+            raise StructuredOutputError(f"episodic[{index}] 应为对象")
+        result['episodic'].append({
+            'type': _as_text(episode.get('type'), f"episodic[{index}].type"),
+            'content': _as_text(episode.get('content'), f"episodic[{index}].content"),
+            'timestamp': _as_text(episode.get('timestamp'), f"episodic[{index}].timestamp")
+        })
+    
+    return {'factual': result['factual'], 'episodic': result['episodic'], 'semantic': result['semantic']}
+
+
+def validate_memory_delta(data: Any) -> Dict[str, Any]:
+    """校验增量整合结果的ops列表"""
+    if not isinstance(data, dict) or not isinstance(data.get('ops'), list):
+        raise StructuredOutputError("增量整合结果应为包含ops数组的JSON对象")
+    
+    for index, op in enumerate(data['ops']):
+        if not isinstance(op, dict):
+            raise StructuredOutputError(f"ops[{index}] 应为对象")
+        if op.get('op') not in MEMORY_OPS:
+            raise StructuredOutputError(f"ops[{index}].op 无效: {op.get('op')}")
+        if op.get('section') not in MEMORY_ANALYSIS_SCHEMA:
+            raise StructuredOutputError(f"ops[{index}].section 无效: {op.get('section')}")
+    
+    return data
+
+
+def _as_text(value: Any, path: str) -> str:
+    """将字段值转换为字符串，列表用顿号连接"""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, list) and all(isinstance(item, (str, int, float)) for item in value):
+        return "、".join(str(item) for item in value if item != "")
+    raise StructuredOutputError(f"{path} 应为字符串")
@@ -0,0 +1,53 @@
+from typing import List, Dict, Any, Optional
+
+
+class PromptPrefixTracker:
+    """提示词前缀稳定性跟踪：统计每轮与上一轮字节完全相同的前缀长度
+
+    提供商（DeepSeek、OpenAI）对稳定的提示词前缀提供缓存折扣，前缀越长越容易命中。
+    """
+    
+    def __init__(self):
+        self._previous: Dict[str, List[bytes]] = {}
+    
+    def record(self, key: str, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """记录本轮消息并返回与上一轮相比的前缀统计"""
+        serialized = [self._serialize(message) for message in messages]
+        previous = self._previous.get(key)
+        self._previous[key] = serialized
+        
+        total_bytes = sum(len(item) for item in serialized)
+        stable_bytes = self._common_prefix_bytes(previous, serialized) if previous else 0
+        
+        return {
+            'prompt_bytes': total_bytes,
+            'stable_prefix_bytes': stable_bytes,
+            'stable_prefix_ratio': stable_bytes / total_bytes if total_bytes else 0.0
+        }
+    
+    def reset(self, key: Optional[str] = None):
+        """清除记录的上一轮消息"""
+        if key is None:
+            self._previous.clear()
+        else:
+            self._previous.pop(key, None)
+    
+    def _serialize(self, message: Dict[str, str]) -> bytes:
+        """将消息序列化为字节，角色变化也会打断前缀"""
+        return f"{message['role']}\n{message['content']}\n".encode('utf-8')
+    
+    def _common_prefix_bytes(self, previous: List[bytes], current: List[bytes]) -> int:
+        """逐条比较消息，在第一条不同的消息内逐字节比较"""
+        prefix = 0
+        for old, new in zip(previous, current):
+            if old == new:
+                prefix += len(new)
+                continue
+            
+            limit = min(len(old), len(new))
+            index = 0
+            while index < limit and old[index] == new[index]:
+                index += 1
+            return prefix + index
+        
+        return prefix
@@ -0,0 +1,268 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
+
+
+# 优先级通道：对话回复优先于后台记忆整合
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+# (桶名, 本次消耗, 容量, 每秒补充量, 消耗后需保留的余量)
+BucketRequest = Tuple[str, float, float, float, float]
+
+
+class RateLimitTimeout(TimeoutError):
+    """等待配额超时"""
+
+
+class MemoryBucketStore:
+    """进程内的令牌桶状态"""
+    
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # 桶名 -> (剩余令牌, 更新时间)
+        self._lock = threading.Lock()
+    
+    def take(self, requests: List[BucketRequest], now: float) -> float:
+        """所有桶都足够时一并扣除并返回0，否则不扣除并返回还需等待的秒数"""
+        with self._lock:
+            levels = {name: self._level(name, capacity, rate, now) for name, _, capacity, rate, _ in requests}
+            wait_seconds = _wait_seconds(requests, levels)
+            if wait_seconds == 0:
+                for name, amount, _, _, _ in requests:
+                    self._buckets[name] = (levels[name] - amount, now)
+            return wait_seconds
+    
+    def adjust(self, name: str, delta: float, capacity: float, rate: float, now: float):
+        """退还（delta>0）或补扣（delta<0）令牌，补扣后允许为负"""
+        with self._lock:
+            self._buckets[name] = (min(capacity, self._level(name, capacity, rate, now) + delta), now)
+    
+    def _level(self, name: str, capacity: float, rate: float, now: float) -> float:
+        tokens, updated_at = self._buckets.get(name, (capacity, now))
+        return min(capacity, tokens + (now - updated_at) * rate)
+
+
+class SQLiteBucketStore(MemoryBucketStore):
+    """存储在SQLite中的令牌桶状态，同一数据库文件的多个进程共享配额（BEGIN IMMEDIATE保证原子扣除）"""
+    
+    def __init__(self, db_path: str):
+        super().__init__()
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS llm_rate_limits (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL     -- Unix时间戳
+                )
+            ''')
+    
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10.0, isolation_level=None)
+    
+    def take(self, requests: List[BucketRequest], now: float) -> float:
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            levels = {name: self._load(conn, name, capacity, rate, now) for name, _, capacity, rate, _ in requests}
+            wait_seconds = _wait_seconds(requests, levels)
+            if wait_seconds == 0:
+                for name, amount, _, _, _ in requests:
+                    self._save(conn, name, levels[name] - amount, now)
+            conn.execute('COMMIT')
+            return wait_seconds
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+    
+    def adjust(self, name: str, delta: float, capacity: float, rate: float, now: float):
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            self._save(conn, name, min(capacity, self._load(conn, name, capacity, rate, now) + delta), now)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+    
+    def _load(self, conn, name: str, capacity: float, rate: float, now: float) -> float:
+        row = conn.execute('SELECT tokens, updated_at FROM llm_rate_limits WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return capacity
+        return min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+    
+    def _save(self, conn, name: str, tokens: float, now: float):
+        conn.execute('INSERT OR REPLACE INTO llm_rate_limits (name, tokens, updated_at) VALUES (?, ?, ?)',
+                     (name, tokens, now))
+
+
+def _wait_seconds(requests: List[BucketRequest], levels: Dict[str, float]) -> float:
+    """各桶补充到足够令牌所需的最长等待时间（均足够时为0）"""
+    wait_seconds = 0.0
+    for name, amount, _, rate, reserve in requests:
+        missing = amount + reserve - levels[name]
+        if missing > 0:
+            wait_seconds = max(wait_seconds, missing / rate)
+    return wait_seconds
+
+
+class LLMRateLimiter:
+    """每分钟请求数（RPM）与每分钟token数（TPM）的令牌桶限流器
+
+    桶容量为一分钟的配额，按配额/60每秒补充。调用前按估算的token数扣除，调用后按实际用量多退少补。
+    优先级通道：有对话请求在等待时后台请求不取令牌；后台请求还须给对话请求留出background_reserve比例的配额。
+    指定db_path时桶状态存储在SQLite中，由同一文件的多个进程共享（通道优先只在进程内生效，余量跨进程生效）。
+    """
+    
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0, background_reserve: float = 0.2,
+                 db_path: Optional[str] = None, name: str = "default"):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.background_reserve = background_reserve
+        self.name = name
+        self._store = SQLiteBucketStore(db_path) if db_path else MemoryBucketStore()
+        
+        self._condition = threading.Condition()
+        self._interactive_waiting = 0
+        self._stats = {
+            lane: {'acquired': 0, 'waited': 0, 'wait_seconds': 0.0, 'timeouts': 0}
+            for lane in (INTERACTIVE, BACKGROUND)
+        }
+    
+    def _bucket_requests(self, tokens: int, priority: str) -> List[BucketRequest]:
+        """本次调用需要扣除的桶（单次消耗不超过容量，否则永远无法满足）
+
+        保留余量最多到容量减1，后台通道至少能用1个单位：RPM很小时按比例保留会让后台每次只扣不到1个请求。
+        """
+        requests = []
+        for suffix, limit, amount in (("rpm", self.requests_per_minute, 1),
+                                      ("tpm", self.tokens_per_minute, tokens)):
+            if limit:
+                reserve = min(limit * self.background_reserve, max(limit - 1, 0)) if priority == BACKGROUND else 0.0
+                requests.append((f"{self.name}:{suffix}", min(amount, limit - reserve), limit, limit / 60.0, reserve))
+        return requests
+    
+    def _try_acquire(self, tokens: int, priority: str) -> float:
+        """尝试取得配额，成功返回0，否则返回建议的等待秒数"""
+        if priority == BACKGROUND and self._interactive_waiting:
+            return 0.05
+        return self._store.take(self._bucket_requests(tokens, priority), time.time())
+    
+    def acquire(self, tokens: int, priority: str = INTERACTIVE, timeout: Optional[float] = None):
+        """阻塞直到取得一次请求和tokens个token的配额，超时抛出RateLimitTimeout"""
+        start_time = time.monotonic()
+        with self._condition:
+            self._enter(priority)
+            try:
+                while True:
+                    wait_seconds = self._try_acquire(tokens, priority)
+                    if wait_seconds == 0:
+                        self._record(priority, time.monotonic() - start_time)
+                        return
+                    remaining = self._remaining(priority, start_time, timeout)
+                    # 被唤醒（对话请求取得配额）或到达预计的补充时间后重试
+                    self._condition.wait(min(wait_seconds, 0.25, remaining))
+            finally:
+                self._leave(priority)
+    
+    async def aacquire(self, tokens: int, priority: str = INTERACTIVE, timeout: Optional[float] = None):
+        """acquire的异步版本，等待时不阻塞事件循环
+
+        取锁与扣除令牌（SQLite存储时可能等待其他进程的写事务）都在线程中执行。
+        """
+        start_time = time.monotonic()
+        await asyncio.to_thread(self._locked, self._enter, priority)
+        try:
+            while True:
+                wait_seconds = await asyncio.to_thread(self._poll, tokens, priority, start_time, timeout)
+                if wait_seconds == 0:
+                    return
+                await asyncio.sleep(wait_seconds)
+        finally:
+            await asyncio.to_thread(self._locked, self._leave, priority)
+    
+    def try_acquire(self, tokens: int, priority: str = INTERACTIVE) -> bool:
+        """不等待地尝试取得配额（用于对冲等可有可无的请求），成功返回True"""
+        with self._condition:
+            if self._try_acquire(tokens, priority) == 0:
+                self._record(priority, 0.0)
+                return True
+            return False
+    
+    def _poll(self, tokens: int, priority: str, start_time: float, timeout: Optional[float]) -> float:
+        """aacquire的一次尝试：取得配额返回0，否则返回下次尝试前应等待的秒数，已超时抛出RateLimitTimeout"""
+        with self._condition:
+            wait_seconds = self._try_acquire(tokens, priority)
+            if wait_seconds == 0:
+                self._record(priority, time.monotonic() - start_time)
+                return 0.0
+            return min(wait_seconds, 0.25, self._remaining(priority, start_time, timeout))
+    
+    def _locked(self, func, *args):
+        with self._condition:
+            return func(*args)
+    
+    def _enter(self, priority: str):
+        """登记等待中的对话请求（需持有锁）"""
+        if priority == INTERACTIVE:
+            self._interactive_waiting += 1
+    
+    def _leave(self, priority: str):
+        """对话请求结束等待后唤醒被让路的后台请求（需持有锁）"""
+        if priority == INTERACTIVE:
+            self._interactive_waiting -= 1
+            self._condition.notify_all()
+    
+    def _remaining(self, priority: str, start_time: float, timeout: Optional[float]) -> float:
+        """剩余可等待的秒数，已超时抛出RateLimitTimeout（需持有锁）"""
+        if timeout is None:
+            return float('inf')
+        remaining = timeout - (time.monotonic() - start_time)
+        if remaining <= 0:
+            self._stats[priority]['timeouts'] += 1
+            raise RateLimitTimeout(f"等待LLM调用配额超过 {timeout:.1f} 秒")
+        return remaining
+    
+    def record_usage(self, estimated_tokens: int, actual_tokens: int):
+        """调用完成后按实际token用量修正TPM桶（多退少补）"""
+        if not self.tokens_per_minute or actual_tokens == estimated_tokens:
+            return
+        limit = self.tokens_per_minute
+        self._store.adjust(f"{self.name}:tpm", estimated_tokens - actual_tokens, limit, limit / 60.0, time.time())
+    
+    def _record(self, priority: str, waited: float):
+        stats = self._stats[priority]
+        stats['acquired'] += 1
+        if waited > 0.001:
+            stats['waited'] += 1
+            stats['wait_seconds'] += waited
+            logger.debug(f"LLM调用等待配额 {waited:.2f} 秒（{priority}）")
+    
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """获取各优先级通道的统计：取得配额次数、等待次数、累计等待秒数、超时次数"""
+        with self._condition:
+            return {lane: dict(stats) for lane, stats in self._stats.items()}
+
+
+_limiters: Dict[str, LLMRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str, requests_per_minute: int, tokens_per_minute: int,
+                     background_reserve: float = 0.2, db_path: Optional[str] = None) -> Optional[LLMRateLimiter]:
+    """获取进程内按名称（通常为提供商与API密钥指纹）共享的限流器，未设置任何限额时返回None"""
+    if not requests_per_minute and not tokens_per_minute:
+        return None
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = LLMRateLimiter(requests_per_minute, tokens_per_minute, background_reserve, db_path, name)
+            _limiters[name] = limiter
+        return limiter
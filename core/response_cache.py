@@ -0,0 +1,182 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from loguru import logger
+
+
+# 键的组成或存储格式变化时递增，使旧的缓存回复失效
+RESPONSE_CACHE_VERSION = 1
+
+
+class ResponseCache:
+    """LLM回复的精确匹配缓存：进程内LRU + SQLite持久化（记忆数据库的 llm_response_cache 表）
+
+    键为 (缓存版本, 提供商, 模型, 温度, 完整消息列表) 的哈希，只有逐字节相同的请求才会命中，
+    适用于问候语、常见问题和评测重放等确定性的提示词。超过有效期的条目不再命中；
+    内存中按最近使用保留memory_entries条，数据库中超过max_entries条时按最近使用淘汰。
+    """
+    
+    def __init__(self, database, ttl_seconds: float = 3600.0, max_entries: int = 1000, memory_entries: int = 256):
+        self.database = database
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        
+        # cache_key -> 条目（含created_at），按最近使用排序
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0, 'memory_hits': 0, 'misses': 0, 'hit_latency_ms': 0.0,
+            'saved_input_tokens': 0, 'saved_output_tokens': 0, 'saved_latency_ms': 0.0
+        }
+    
+    def make_key(self, provider: str, model: str, temperature: float, messages: List[Dict[str, str]]) -> str:
+        """计算请求的缓存键"""
+        canonical = json.dumps(
+            [RESPONSE_CACHE_VERSION, provider, model, temperature,
+             [[msg["role"], msg["content"]] for msg in messages]],
+            ensure_ascii=False, separators=(',', ':')
+        )
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+    
+    def get(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """读取未过期的缓存条目（response、input_tokens、output_tokens、latency_ms），未命中时返回None"""
+        start_time = time.perf_counter()
+        now = time.time()
+        
+        with self._lock:
+            entry = self._memory.get(cache_key)
+            if entry is not None and entry['created_at'] <= now - self.ttl_seconds:
+                del self._memory[cache_key]
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(cache_key)
+                self._stats['memory_hits'] += 1
+        
+        if entry is None:
+            entry = self._load(cache_key, now)
+            if entry is None:
+                with self._lock:
+                    self._stats['misses'] += 1
+                return None
+            self._remember(cache_key, entry)
+        
+        with self._lock:
+            self._stats['hits'] += 1
+            self._stats['hit_latency_ms'] += (time.perf_counter() - start_time) * 1000
+            self._stats['saved_input_tokens'] += entry['input_tokens']
+            self._stats['saved_output_tokens'] += entry['output_tokens']
+            self._stats['saved_latency_ms'] += entry['latency_ms']
+        logger.debug(f"LLM回复命中缓存: {cache_key[:12]}")
+        return entry
+    
+    def put(self, cache_key: str, response: str, usage: Dict[str, Any], latency_ms: float, model: str = "") -> bool:
+        """写入回复及原始调用的token用量和耗时（用于统计节省量），并淘汰过期和超出上限的条目"""
+        now = time.time()
+        entry = {
+            'response': response,
+            'input_tokens': usage.get('input_tokens', 0) or 0,
+            'output_tokens': usage.get('output_tokens', 0) or 0,
+            'latency_ms': latency_ms,
+            'created_at': now
+        }
+        self._remember(cache_key, entry)
+        
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT OR REPLACE INTO llm_response_cache
+                        (cache_key, response, model, input_tokens, output_tokens, latency_ms,
+                         created_at, last_used_at, hit_count)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+                ''', (cache_key, response, model, entry['input_tokens'], entry['output_tokens'],
+                      latency_ms, now, now))
+                evicted = self._evict(cursor, now)
+                conn.commit()
+                
+                if evicted:
+                    logger.debug(f"淘汰 {evicted} 条LLM回复缓存")
+                return True
+        
+        except Exception as e:
+            logger.error(f"写入LLM回复缓存失败: {e}")
+            return False
+    
+    def _load(self, cache_key: str, now: float) -> Optional[Dict[str, Any]]:
+        """从数据库读取未过期的条目并更新使用时间"""
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT response, input_tokens, output_tokens, latency_ms, created_at
+                    FROM llm_response_cache
+                    WHERE cache_key = ? AND created_at > ?
+                ''', (cache_key, now - self.ttl_seconds))
+                row = cursor.fetchone()
+                if row is None:
+                    return None
+                
+                cursor.execute('''
+                    UPDATE llm_response_cache SET last_used_at = ?, hit_count = hit_count + 1
+                    WHERE cache_key = ?
+                ''', (now, cache_key))
+                conn.commit()
+                return {
+                    'response': row[0], 'input_tokens': row[1], 'output_tokens': row[2],
+                    'latency_ms': row[3], 'created_at': row[4]
+                }
+        
+        except Exception as e:
+            logger.error(f"读取LLM回复缓存失败: {e}")
+            return None
+    
+    def _remember(self, cache_key: str, entry: Dict[str, Any]):
+        """放入进程内LRU"""
+        with self._lock:
+            self._memory[cache_key] = entry
+            self._memory.move_to_end(cache_key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+    
+    def _evict(self, cursor, now: float) -> int:
+        """删除过期条目，再按最近使用时间删除超出上限的条目"""
+        cursor.execute('DELETE FROM llm_response_cache WHERE created_at <= ?', (now - self.ttl_seconds,))
+        evicted = cursor.rowcount
+        cursor.execute('''
+            DELETE FROM llm_response_cache WHERE cache_key IN (
+                SELECT cache_key FROM llm_response_cache
+                ORDER BY last_used_at DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_entries,))
+        return evicted + cursor.rowcount
+    
+    def clear(self) -> int:
+        """清空缓存，返回数据库中删除的条目数"""
+        with self._lock:
+            self._memory.clear()
+        try:
+            with self.database.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM llm_response_cache')
+                conn.commit()
+                return cursor.rowcount
+        
+        except Exception as e:
+            logger.error(f"清空LLM回复缓存失败: {e}")
+            return 0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计：命中率、命中时的平均读取耗时，以及累计节省的token数和LLM调用耗时"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['avg_hit_latency_ms'] = stats.pop('hit_latency_ms') / stats['hits'] if stats['hits'] else 0.0
+        return stats
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import math
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from loguru import logger
+
+
+# 向量维度（字符n-gram哈希到的桶数）
+EMBEDDING_DIMENSIONS = 1024
+
+# 计算相似度前去除的句末语气词（不含改变句意的"吗""吧"）与空白、标点
+_TRAILING_PARTICLES = re.compile(r'[呀啊呢哦嘛啦哟]+(?=[\s\.,!?;:~、，。！？；：～…]|$)')
+_IGNORED_CHARS = re.compile(r'[\s\.,!?;:~\-、，。！？；：～…"\'“”‘’（）()]+')
+
+
+def embed_text(text: str, ngram_sizes: Tuple[int, ...] = (1, 2)) -> Dict[int, float]:
+    """将文本转换为归一化的稀疏向量：字符n-gram哈希到固定数量的桶
+
+    只反映字面上的相近程度（"你好呀"与"你好"相同），不理解否定等语义差别，阈值不宜过低。
+    """
+    normalized = _IGNORED_CHARS.sub('', _TRAILING_PARTICLES.sub('', text.lower()))
+    vector: Dict[int, float] = {}
+    for size in ngram_sizes:
+        for start in range(len(normalized) - size + 1):
+            bucket = zlib.crc32(normalized[start:start + size].encode('utf-8')) % EMBEDDING_DIMENSIONS
+            vector[bucket] = vector.get(bucket, 0.0) + 1.0
+    
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    if not norm:
+        return {}
+    return {bucket: weight / norm for bucket, weight in vector.items()}
+
+
+def cosine_similarity(a: Dict[int, float], b: Dict[int, float]) -> float:
+    """两个归一化稀疏向量的余弦相似度"""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(bucket, 0.0) for bucket, weight in a.items())
+
+
+class SemanticResponseCache:
+    """LLM回复的语义缓存：措辞相近的用户输入复用已有回复（仅进程内，不持久化）
+
+    条目按 (作用域, 上下文摘要) 分组：作用域由调用方决定（通常为Prompt名称，必要时加上用户ID），
+    上下文摘要是除最后一条用户消息外全部消息的哈希，必须完全一致；最后一条用户消息的向量与
+    同组条目的余弦相似度达到阈值时命中。条目总数超过max_entries时按最近使用淘汰。
+    """
+    
+    def __init__(self, threshold: float = 0.9, max_entries: int = 1000):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        
+        # entry_id -> 条目，按最近使用排序；(作用域, 上下文摘要) -> 该组的entry_id列表
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._groups: Dict[Tuple[str, str], List[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0, 'misses': 0, 'evictions': 0, 'hit_similarity': 0.0,
+            'saved_input_tokens': 0, 'saved_output_tokens': 0, 'saved_latency_ms': 0.0
+        }
+    
+    def make_context_digest(self, provider: str, model: str, temperature: float,
+                            messages: List[Dict[str, str]]) -> str:
+        """计算上下文摘要：模型参数与最后一条用户消息之前的全部消息"""
+        canonical = json.dumps(
+            [provider, model, temperature, [[msg["role"], msg["content"]] for msg in messages[:-1]]],
+            ensure_ascii=False, separators=(',', ':')
+        )
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+    
+    def lookup(self, scope: str, context_digest: str, user_input: str) -> Optional[Dict[str, Any]]:
+        """查找同组中与用户输入最相近的条目，相似度达到阈值时返回（含response和similarity）"""
+        vector = embed_text(user_input)
+        with self._lock:
+            best_id, best_similarity = None, 0.0
+            for entry_id in self._groups.get((scope, context_digest), []):
+                similarity = cosine_similarity(vector, self._entries[entry_id]['vector'])
+                if similarity > best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            
+            if best_id is None or best_similarity < self.threshold:
+                self._stats['misses'] += 1
+                return None
+            
+            entry = self._entries[best_id]
+            self._entries.move_to_end(best_id)
+            self._stats['hits'] += 1
+            self._stats['hit_similarity'] += best_similarity
+            self._stats['saved_input_tokens'] += entry['input_tokens']
+            self._stats['saved_output_tokens'] += entry['output_tokens']
+            self._stats['saved_latency_ms'] += entry['latency_ms']
+        
+        logger.debug(f"LLM回复命中语义缓存: 相似度 {best_similarity:.2f}")
+        return {**entry, 'similarity': best_similarity}
+    
+    def add(self, scope: str, context_digest: str, user_input: str, response: str,
+            usage: Dict[str, Any], latency_ms: float):
+        """添加条目，超出上限时淘汰最久未使用的条目"""
+        vector = embed_text(user_input)
+        if not vector:
+            return
+        
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                'group': (scope, context_digest),
+                'user_input': user_input,
+                'vector': vector,
+                'response': response,
+                'input_tokens': usage.get('input_tokens', 0) or 0,
+                'output_tokens': usage.get('output_tokens', 0) or 0,
+                'latency_ms': latency_ms
+            }
+            self._groups.setdefault((scope, context_digest), []).append(entry_id)
+            
+            while len(self._entries) > self.max_entries:
+                evicted_id, evicted = self._entries.popitem(last=False)
+                group = self._groups[evicted['group']]
+                group.remove(evicted_id)
+                if not group:
+                    del self._groups[evicted['group']]
+                self._stats['evictions'] += 1
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计：命中率、命中的平均相似度、淘汰数，以及累计节省的token数和LLM调用耗时"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['avg_hit_similarity'] = stats.pop('hit_similarity') / stats['hits'] if stats['hits'] else 0.0
+        return stats
+
+
+_cache: Optional[SemanticResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache(threshold: float = 0.9, max_entries: int = 1000) -> SemanticResponseCache:
+    """获取进程内共享的语义缓存，使不同会话的Agent可以复用彼此的回复"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticResponseCache(threshold, max_entries)
+        return _cache
@@ -46,9 +46,11 @@ def main():
                 if not user_input:
                     continue
                 
-                # 获取AI回复
-                response = agent.chat(user_input)
-                print(f"小王子: {response}")
+                # 流式获取AI回复，逐块输出
+                print("小王子: ", end="", flush=True)
+                for chunk in agent.chat_stream(user_input):
+                    print(chunk, end="", flush=True)
+                print()
                 
                 # 显示记忆统计（调试用）
                 if agent.memory_update_mechanism.current_round % 5 == 0:
@@ -215,6 +215,21 @@ def display_memory_stats():
                 value="未初始化",
                 delta=None
             )
+    
+    # 后台记忆整合状态
+    if st.session_state.agent:
+        update_status = st.session_state.agent.get_memory_update_status()
+        state_labels = {
+            'idle': '空闲',
+            'queued': '排队中',
+            'running': '整合中…',
+            'completed': '已完成',
+            'failed': '失败'
+        }
+        caption = f"🧠 记忆整合: {state_labels.get(update_status.get('state'), '未知')}"
+        if update_status.get('error'):
+            caption += f"（{update_status['error']}）"
+        st.caption(caption)
 
 
 def display_chat_history():
@@ -248,10 +263,12 @@ def chat_interface():
                 "timestamp": datetime.now()
             })
             
-            # 获取AI回复
-            with st.spinner("小王子正在思考..."):
+            # 流式获取AI回复，边生成边显示
+            with st.chat_message("user"):
+                st.write(prompt)
+            with st.chat_message("assistant"):
                 try:
-                    response = st.session_state.agent.chat(prompt)
+                    response = st.write_stream(st.session_state.agent.chat_stream(prompt))
                     
                     # 添加AI回复到历史
                     st.session_state.chat_history.append({
@@ -702,13 +719,11 @@ def main():
             
             # 生成AI回复
             with st.chat_message("assistant"):
-                with st.spinner("小王子正在思考..."):
-                    if st.session_state.agent:
-                        response = st.session_state.agent.chat(prompt)
-                        st.markdown(response)
-                        st.session_state.messages.append({"role": "assistant", "content": response})
-                    else:
-                        st.error("Agent未初始化，请检查配置")
+                if st.session_state.agent:
+                    response = st.write_stream(st.session_state.agent.chat_stream(prompt))
+                    st.session_state.messages.append({"role": "assistant", "content": response})
+                else:
+                    st.error("Agent未初始化，请检查配置")
         
         # 显示系统信息
         st.markdown("---")
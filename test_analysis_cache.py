@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+测试记忆分析结果缓存
+验证相同对话不再调用LLM、提示词或对话变化时重新分析，以及有效期和数量上限淘汰
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core.llm import LLMInterface
+from core.memory import MemoryAnalysisCache, MemoryUpdateMechanism
+from core.memory.memory_database import MemoryDatabase
+
+
+CONVERSATIONS = [{'user': "我叫小明", 'ai': "你好小明！"}, {'user': "我喜欢玫瑰", 'ai': "玫瑰很美。"}]
+
+
+def _mechanism(config: Config, cache: MemoryAnalysisCache):
+    llm = LLMInterface(config)
+    calls = []
+    original_invoke = llm.invoke_json
+
+    def invoke_json(messages, validator):
+        calls.append(messages)
+        return original_invoke(messages, validator)
+
+    llm.invoke_json = invoke_json
+    mechanism = MemoryUpdateMechanism(config, llm)
+    mechanism.set_analysis_cache(cache)
+    return mechanism, calls
+
+
+def test_analysis_cache_hit():
+    """测试相同对话复用缓存的分析结果"""
+    print("🧪 测试记忆分析结果缓存...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_analysis_cache"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config(MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"), LLM_PROVIDER="fake")
+        cache = MemoryAnalysisCache(MemoryDatabase(config.MEMORY_DB_PATH))
+        mechanism, calls = _mechanism(config, cache)
+
+        # 1. 首次分析调用LLM并写入缓存
+        print("1. 首次分析...")
+        first = mechanism.update_memory(CONVERSATIONS, {})
+        assert len(calls) == 1 and not mechanism.last_cache_hit
+        assert first['factual']['identity'] == "小明"
+        print("   ✅ 调用LLM一次")
+
+        # 2. 相同对话（例如另一个进程的重试）命中缓存
+        print("2. 重复分析...")
+        other, other_calls = _mechanism(config, MemoryAnalysisCache(MemoryDatabase(config.MEMORY_DB_PATH)))
+        second = other.update_memory(CONVERSATIONS, {})
+        assert other_calls == [] and other.last_cache_hit
+        assert second == first
+        assert cache.get_stats()['total_hits'] == 1
+        print("   ✅ 命中缓存，未调用LLM")
+
+        # 3. 对话或模型变化时重新分析
+        print("3. 内容变化...")
+        mechanism.update_memory(CONVERSATIONS + [{'user': "今天天气不错", 'ai': "是呀。"}], {})
+        assert len(calls) == 2 and not mechanism.last_cache_hit
+        mechanism.llm.model = "another-model"
+        mechanism.update_memory(CONVERSATIONS, {})
+        assert len(calls) == 3
+        print("   ✅ 对话或模型变化时重新调用LLM")
+
+
+def test_analysis_cache_eviction():
+    """测试有效期和数量上限淘汰"""
+    print("🧪 测试记忆分析缓存淘汰...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database = MemoryDatabase(os.path.join(tmp_dir, "memory.sqlite"))
+
+        # 1. 超出数量上限时淘汰最久未使用的条目
+        print("1. 数量上限...")
+        cache = MemoryAnalysisCache(database, max_entries=2)
+        cache.put("a", {'n': 1})
+        cache.put("b", {'n': 2})
+        time.sleep(0.01)
+        assert cache.get("a") == {'n': 1}
+        cache.put("c", {'n': 3})
+        assert cache.get("b") is None
+        assert cache.get("a") == {'n': 1} and cache.get("c") == {'n': 3}
+        assert cache.get_stats()['entries'] == 2
+        print("   ✅ 淘汰最久未使用的条目")
+
+        # 2. 过期条目不再命中
+        print("2. 有效期...")
+        expiring = MemoryAnalysisCache(database, ttl_seconds=0.05)
+        expiring.put("d", {'n': 4})
+        assert expiring.get("d") == {'n': 4}
+        time.sleep(0.06)
+        assert expiring.get("d") is None
+        print("   ✅ 过期条目不再命中")
+
+
+if __name__ == "__main__":
+    print("🚀 开始测试记忆分析结果缓存")
+    print("=" * 50)
+
+    try:
+        test_analysis_cache_hit()
+        test_analysis_cache_eviction()
+        print("\n🎉 所有测试通过！")
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
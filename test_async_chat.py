@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+测试异步对话
+验证achat/achat_stream的回复与记忆写入，以及单个事件循环并发驱动多个会话
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core import LittlePrinceAgent
+
+
+def _config(tmp_dir: str, **kwargs) -> Config:
+    os.environ["LLM_API_KEY"] = "test_key_for_async_chat"
+    return Config(MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"), LLM_PROVIDER="fake", **kwargs)
+
+
+def test_achat():
+    """测试异步对话与记忆整合"""
+    print("🧪 测试异步对话...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        agent = LittlePrinceAgent(_config(tmp_dir, MEMORY_UPDATE_INTERVAL=2, MEMORY_UPDATE_BACKGROUND=False),
+                                  "user_async")
+
+        async def conversation():
+            first = await agent.achat("我叫小明")
+            chunks = [chunk async for chunk in agent.achat_stream("我喜欢玫瑰")]
+            return first, chunks
+
+        first, chunks = asyncio.run(conversation())
+        assert first == agent.llm.llm.responses[0]
+        assert len(chunks) > 1 and "".join(chunks) == agent.llm.llm.responses[0]
+        assert agent.get_last_turn_diagnostics()['first_token_ms'] is not None
+        memory = agent.memory_room.get_long_term_memory()
+        assert memory['factual']['identity'] == "小明" and memory['factual']['preferences'] == "玫瑰"
+        print("   ✅ 回复正确，达到整合轮数后写入长期记忆")
+
+
+def test_achat_concurrency():
+    """测试单个事件循环并发驱动多个会话"""
+    print("🧪 测试并发会话...")
+
+    sessions = 100
+    latency = 0.2
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = _config(tmp_dir, MEMORY_UPDATE_INTERVAL=1000)
+        agents = [LittlePrinceAgent(config, f"user_{i}") for i in range(sessions)]
+        for agent in agents:
+            agent.llm.llm.latency = latency
+
+        async def run_all():
+            return await asyncio.gather(*(agent.achat("你好") for agent in agents))
+
+        start = time.perf_counter()
+        replies = asyncio.run(run_all())
+        elapsed = time.perf_counter() - start
+
+        assert all(reply == agents[0].llm.llm.responses[0] for reply in replies)
+        assert all(agent.get_memory_stats()['short_term_count'] == 1 for agent in agents)
+        # 顺序执行需要 sessions * latency = 20 秒
+        assert elapsed < sessions * latency / 5, f"并发会话耗时 {elapsed:.2f}s"
+        print(f"   ✅ {sessions} 个会话在 {elapsed:.2f}s 内完成（单次LLM延迟 {latency}s）")
+
+
+if __name__ == "__main__":
+    print("🚀 开始测试异步对话")
+    print("=" * 50)
+
+    try:
+        test_achat()
+        test_achat_concurrency()
+        print("\n🎉 所有测试通过！")
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+测试记忆整合的单事务提交
+验证整合期间新增的对话不会丢失、轮计数正确扣减，以及提交失败时整体回滚
+"""
+
+import os
+import sys
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from core.memory.memory_database import MemoryDatabase
+
+
+def _memory(preferences: str = '玫瑰'):
+    return {
+        'factual': {'identity': '小明', 'preferences': preferences},
+        'episodic': [{'type': '用户经历', 'content': '第一次看日落', 'timestamp': ''}],
+        'semantic': {'values': '珍惜陪伴'}
+    }
+
+
+def _add_rounds(database: MemoryDatabase, user_id: str, start: int, count: int):
+    return [
+        database.add_short_term_memory(user_id, f"问题{i}", f"回答{i}", f"2024-01-01T00:00:{i:02d}", 10)
+        for i in range(start, start + count)
+    ]
+
+
+def test_commit_keeps_new_rounds():
+    """测试只删除本次分析过的短期记忆"""
+    print("🧪 测试整合提交保留分析期间的新对话...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database = MemoryDatabase(os.path.join(tmp_dir, "memory.sqlite"))
+        database.update_long_term_memory("user_a", _memory())
+
+        # 1. 分析前读取的对话，分析期间又新增两轮
+        print("1. 提交整合...")
+        analysed_ids = _add_rounds(database, "user_a", 0, 3)
+        assert all(analysed_ids)
+        database.save_conversation_summary("user_a", "较早的对话摘要", 2)
+        new_ids = _add_rounds(database, "user_a", 3, 2)
+
+        result = database.commit_consolidation("user_a", _memory('玫瑰和日落'), analysed_ids, round_counter=2)
+        assert result is not None
+        assert result['consumed'] == 3
+        assert result['round_counter'] == 2
+        assert set(result['diff']) == {'factual'}
+        print("   ✅ 整合结果已提交")
+
+        # 2. 新增的对话保留，ID不变；摘要已清空；长期记忆已更新
+        print("2. 检查提交后的状态...")
+        remaining = database.get_short_term_memory("user_a")
+        assert [row['id'] for row in remaining] == new_ids
+        assert database.get_conversation_summary("user_a")['summary'] == ""
+        assert database.get_long_term_memory("user_a")['factual']['preferences'] == '玫瑰和日落'
+        assert database.get_consolidation_state("user_a")['round_counter'] == 2
+        print("   ✅ 分析期间的新对话未丢失")
+
+        # 3. 不指定轮计数时按消耗的轮数扣减
+        print("3. 扣减轮计数...")
+        result = database.commit_consolidation("user_a", _memory('玫瑰和日落'), new_ids[:1])
+        assert result['round_counter'] == 1
+        assert result['diff'] == {}
+        assert [row['id'] for row in database.get_short_term_memory("user_a")] == new_ids[1:]
+        print("   ✅ 轮计数扣减正确")
+
+
+def test_commit_rolls_back_on_failure():
+    """测试提交中途失败时所有写入一起回滚"""
+    print("🧪 测试整合提交失败回滚...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database = MemoryDatabase(os.path.join(tmp_dir, "memory.sqlite"))
+        database.update_long_term_memory("user_a", _memory())
+        row_ids = _add_rounds(database, "user_a", 0, 3)
+        database.save_conversation_summary("user_a", "较早的对话摘要", 2)
+        version = database.get_memory_version("user_a")
+
+        # 长期记忆差异写入之后、删除短期记忆时出错
+        def failing_delete(cursor, user_id, ids):
+            raise RuntimeError("模拟写入失败")
+
+        database._delete_short_term_rows = failing_delete
+        result = database.commit_consolidation("user_a", _memory('玫瑰和日落'), row_ids)
+        assert result is None
+
+        assert database.get_long_term_memory("user_a") == _memory()
+        assert [row['id'] for row in database.get_short_term_memory("user_a")] == row_ids
+        assert database.get_conversation_summary("user_a")['summary'] == "较早的对话摘要"
+        assert database.get_memory_version("user_a") == version
+        print("   ✅ 失败时长期记忆、短期记忆和摘要均未改变")
+
+
+if __name__ == "__main__":
+    print("🚀 开始测试记忆整合的单事务提交")
+    print("=" * 50)
+
+    try:
+        test_commit_keeps_new_rounds()
+        test_commit_rolls_back_on_failure()
+        print("\n🎉 所有测试通过！")
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
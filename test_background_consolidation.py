@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+测试后台记忆整合
+验证触发整合的那一轮对话不等待记忆分析，整合状态可查询，同一用户的整合串行执行
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core import LittlePrinceAgent
+from core.memory import ConsolidationWorker
+
+
+def test_background_consolidation():
+    """测试对话轮不被记忆整合阻塞"""
+    print("🧪 测试后台记忆整合...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_background_consolidation"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config(
+            MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"),
+            LLM_PROVIDER="fake",
+            MEMORY_UPDATE_INTERVAL=3,
+            MEMORY_UPDATE_BACKGROUND=True
+        )
+        agent = LittlePrinceAgent(config, "user_background")
+        # 让记忆分析调用明显慢于普通回复
+        agent.memory_update_mechanism.llm = type(agent.llm)(config)
+        agent.memory_update_mechanism.llm.llm.latency = 0.5
+
+        # 1. 触发整合的那一轮立即返回
+        print("1. 触发整合...")
+        agent.chat("我叫小明")
+        agent.chat("我喜欢玫瑰")
+        start = time.perf_counter()
+        agent.chat("今天天气不错")
+        elapsed = time.perf_counter() - start
+        assert elapsed < 0.4, f"对话轮被整合阻塞: {elapsed:.2f}s"
+        assert agent.get_memory_update_status()['state'] in ('queued', 'running')
+        print(f"   ✅ 对话轮耗时 {elapsed * 1000:.0f}ms，整合在后台进行")
+
+        # 2. 整合完成后长期记忆已更新
+        print("2. 等待整合完成...")
+        assert agent.consolidation_worker.wait_idle("user_background", timeout=10)
+        status = agent.get_memory_update_status()
+        assert status['state'] == 'completed' and status['result']['completed'] >= 1
+        assert agent.memory_room.get_long_term_memory()['factual']['identity'] == "小明"
+        assert agent.get_memory_stats()['short_term_count'] == 0
+        print(f"   ✅ 状态: {status['state']}，长期记忆已写入")
+
+
+def test_per_user_serialization():
+    """测试同一用户的整合串行、排队任务合并"""
+    print("\n🧪 测试同一用户的整合串行...")
+
+    worker = ConsolidationWorker(max_workers=4)
+    active = {"user_a": 0}
+    max_active = {"user_a": 0}
+    lock = threading.Lock()
+    runs = []
+
+    def make_task(name):
+        def task():
+            with lock:
+                active["user_a"] += 1
+                max_active["user_a"] = max(max_active["user_a"], active["user_a"])
+            time.sleep(0.1)
+            with lock:
+                active["user_a"] -= 1
+            runs.append(name)
+            return name
+        return task
+
+    worker.submit("user_a", make_task("first"))
+    worker.submit("user_a", make_task("second"))
+    worker.submit("user_a", make_task("third"))
+    assert worker.wait_idle("user_a", timeout=5)
+
+    # 进行中时提交的任务只保留最新的一个
+    assert runs == ["first", "third"]
+    assert max_active["user_a"] == 1
+    status = worker.get_status("user_a")
+    assert status['runs'] == 2 and status['result'] == "third"
+    print(f"   ✅ 执行顺序: {runs}，最大并发: {max_active['user_a']}")
+
+    # 任务异常时记录失败状态
+    def failing_task():
+        raise RuntimeError("分析失败")
+
+    worker.submit("user_b", failing_task)
+    assert worker.wait_idle("user_b", timeout=5)
+    status = worker.get_status("user_b")
+    assert status['state'] == 'failed' and status['error'] == "分析失败"
+    print("   ✅ 异常任务状态为 failed")
+
+
+if __name__ == "__main__":
+    test_background_consolidation()
+    test_per_user_serialization()
+    print("\n🎉 后台记忆整合测试通过！")
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+测试离线批量记忆整合
+验证多用户并发整合、批量写入、失败统计（含批量写入失败），以及从检查点继续
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import consolidate_all
+from config import Config
+from core.llm import LLMInterface
+from core.memory import BatchConsolidator
+from core.memory.memory_database import MemoryDatabase
+
+
+def _seed_users(database: MemoryDatabase, count: int):
+    """为每个用户写入几轮对话"""
+    for i in range(count):
+        user_id = f"user_{i:02d}"
+        database.add_short_term_memory(user_id, f"我叫小明{i}", "你好呀！")
+        database.add_short_term_memory(user_id, "我喜欢玫瑰", "玫瑰很美。")
+
+
+def test_batch_consolidation():
+    """测试批量整合与检查点"""
+    print("🧪 测试离线批量记忆整合...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_batch_consolidation"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "memory.sqlite")
+        checkpoint_path = os.path.join(tmp_dir, "checkpoint.json")
+        config = Config(MEMORY_DB_PATH=db_path, LLM_PROVIDER="fake")
+        database = MemoryDatabase(db_path)
+        _seed_users(database, 12)
+
+        # 1. 部分用户失败
+        print("1. 首次运行...")
+        failing_users = {"user_03", "user_07"}
+        llms = []
+
+        def llm_factory():
+            llm = LLMInterface(config)
+            original_invoke = llm.invoke_json
+
+            def invoke_json(messages, validator):
+                if any(f"我叫小明{user[-1]}" in str(messages[0].content) for user in failing_users):
+                    validator.feed("不是JSON")
+                return original_invoke(messages, validator)
+
+            llm.invoke_json = invoke_json
+            llms.append(llm)
+            return llm
+
+        consolidator = BatchConsolidator(config, llm_factory, concurrency=3, batch_size=5,
+                                         checkpoint_path=checkpoint_path, database=database)
+        user_ids = consolidator.list_users()
+        assert len(user_ids) == 12
+
+        report = consolidator.run(user_ids)
+        assert report['completed'] == 10 and report['failed'] == 2
+        assert set(report['failures']) == failing_users
+        assert report['tokens'] > 0 and report['users_per_minute'] > 0
+        assert len(llms) <= 3
+        print(f"   ✅ 成功 {report['completed']}，失败 {report['failed']}，{report['tokens_per_minute']:.0f} tokens/分钟")
+
+        # 2. 成功的用户已写入长期记忆并清空短期记忆，失败的用户保持不变
+        print("2. 检查写入结果...")
+        assert database.get_long_term_memory("user_01")['factual']['identity'] == "小明1"
+        assert database.get_short_term_memory("user_01") == []
+        assert len(database.get_short_term_memory("user_03")) == 2
+        assert database.get_memory_version("user_01")['long_term_version'] == 1
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        assert len(checkpoint['completed']) == 10 and set(checkpoint['failed']) == failing_users
+        print("   ✅ 批量写入与检查点正确")
+
+        # 3. 从检查点继续时只处理失败的用户
+        print("3. 从检查点继续...")
+        failing_users.clear()
+        resumed = BatchConsolidator(config, llm_factory, concurrency=2,
+                                    checkpoint_path=checkpoint_path, database=database)
+        report = resumed.run(user_ids, resume=True)
+        assert report['resumed_from_checkpoint'] == 10
+        assert report['total'] == 2 and report['completed'] == 2
+        assert database.get_long_term_memory("user_03")['factual']['identity'] == "小明3"
+        print("   ✅ 只重试了失败的用户")
+
+
+def test_bulk_write_failure():
+    """测试批量写入失败的用户在报告中记为失败，命令行返回非零状态"""
+    print("🧪 测试批量写入失败...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_batch_consolidation"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "memory.sqlite")
+        config = Config(MEMORY_DB_PATH=db_path, LLM_PROVIDER="fake")
+        database = MemoryDatabase(db_path)
+        _seed_users(database, 4)
+
+        # 1. 报告
+        print("1. 报告...")
+        database.bulk_commit_consolidations = lambda results: False
+        consolidator = BatchConsolidator(config, lambda: LLMInterface(config), concurrency=2, batch_size=3,
+                                         database=database)
+        report = consolidator.run(consolidator.list_users())
+        assert report['completed'] == 0 and report['failed'] == 4
+        assert set(report['failures']) == {f"user_{i:02d}" for i in range(4)}
+        assert report['users_per_minute'] == 0
+        assert len(database.get_short_term_memory("user_00")) == 2
+        print(f"   ✅ 写入失败的用户记为失败: {report['failures']}")
+
+        # 2. 命令行
+        print("2. 命令行退出状态...")
+        original_bulk_commit = MemoryDatabase.bulk_commit_consolidations
+        original_argv = sys.argv
+        os.environ["MEMORY_DB_PATH"] = db_path
+        MemoryDatabase.bulk_commit_consolidations = lambda self, results: False
+        try:
+            sys.argv = ["consolidate_all.py", "--provider", "fake",
+                        "--checkpoint", os.path.join(tmp_dir, "checkpoint.json")]
+            assert consolidate_all.main() == 1
+            MemoryDatabase.bulk_commit_consolidations = original_bulk_commit
+            sys.argv.append("--resume")
+            assert consolidate_all.main() == 0
+            assert database.get_short_term_memory("user_00") == []
+        finally:
+            MemoryDatabase.bulk_commit_consolidations = original_bulk_commit
+            sys.argv = original_argv
+            del os.environ["MEMORY_DB_PATH"]
+        print("   ✅ 写入失败时返回1，重试成功后返回0")
+
+
+if __name__ == "__main__":
+    test_batch_consolidation()
+    test_bulk_write_failure()
+    print("\n🎉 离线批量记忆整合测试通过！")
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+测试持久化的轮数计数器与整合触发策略
+验证多个Agent服务同一用户时计数一致，以及按token数、字符数、空闲时间触发整合
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core import LittlePrinceAgent
+
+
+def _config(tmp_dir: str, **kwargs) -> Config:
+    os.environ["LLM_API_KEY"] = "test_key_for_consolidation_trigger"
+    return Config(
+        MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"),
+        LLM_PROVIDER="fake",
+        MEMORY_UPDATE_BACKGROUND=False,
+        **kwargs
+    )
+
+
+def test_persisted_round_counter():
+    """测试轮数计数器保存在数据库中，多个Agent共享"""
+    print("🧪 测试持久化的轮数计数器...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = _config(tmp_dir, MEMORY_UPDATE_INTERVAL=4)
+        agent_a = LittlePrinceAgent(config, "user_shared")
+        agent_b = LittlePrinceAgent(config, "user_shared")
+
+        # 1. 两个Agent交替服务同一用户
+        print("1. 交替对话...")
+        agent_a.chat("我叫小明")
+        agent_b.chat("我喜欢玫瑰")
+        agent_a.chat("今天天气不错")
+        state = agent_a.memory_room.get_consolidation_state()
+        assert state['round_counter'] == 3
+        assert state['pending_tokens'] > 0 and state['pending_chars'] > 0
+        assert agent_a.memory_update_mechanism.current_round == 3
+        print(f"   ✅ 计数器: {state['round_counter']} 轮，{state['pending_tokens']} tokens")
+
+        # 2. 新的Agent从数据库恢复计数，第4轮（不论由哪个Agent处理）触发整合
+        print("2. 恢复计数并触发整合...")
+        restarted = LittlePrinceAgent(config, "user_shared")
+        assert restarted.memory_update_mechanism.current_round == 3
+        agent_b.chat("我想去看日落")
+        state = agent_b.memory_room.get_consolidation_state()
+        assert state['round_counter'] == 0 and state['pending_tokens'] == 0
+        assert state['last_consolidated_at'] is not None
+        assert agent_b.memory_room.get_long_term_memory()['factual']['identity'] == "小明"
+        print("   ✅ 第4轮触发整合，计数已扣减")
+
+
+def test_interval_with_small_window():
+    """测试短期记忆窗口小于整合间隔时，滑出窗口的对话不会让下一批提前触发"""
+    print("🧪 测试窗口小于整合间隔...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = _config(tmp_dir, SHORT_TERM_MAX_ROUNDS=3, MEMORY_UPDATE_INTERVAL=5)
+        agent = LittlePrinceAgent(config, "user_small_window")
+        consolidated_rounds = []
+        for i in range(1, 16):
+            before = agent.memory_room.get_consolidation_state()['last_consolidated_at']
+            agent.chat(f"第{i}句话")
+            state = agent.memory_room.get_consolidation_state()
+            if state['last_consolidated_at'] != before:
+                consolidated_rounds.append(i)
+                assert state['round_counter'] == 0 and state['pending_tokens'] == 0 and state['pending_chars'] == 0
+
+        assert consolidated_rounds == [5, 10, 15], f"整合发生在: {consolidated_rounds}"
+        print(f"   ✅ 每 5 轮整合一次: {consolidated_rounds}")
+
+
+def test_volume_trigger():
+    """测试按累计token数触发整合"""
+    print("🧪 测试按token数触发整合...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = _config(tmp_dir, MEMORY_UPDATE_INTERVAL=100, MEMORY_UPDATE_TOKEN_THRESHOLD=1)
+        agent = LittlePrinceAgent(config, "user_volume")
+
+        mechanism = agent.memory_update_mechanism
+        mechanism.sync_state({'round_counter': 1, 'pending_tokens': 1, 'pending_chars': 10})
+        assert mechanism.get_trigger_reason() == "累计 1 tokens"
+
+        agent.chat("我叫小明，我住在一颗很小的星球上，每天都会照顾我的玫瑰")
+        assert agent.memory_room.get_consolidation_state()['round_counter'] == 0
+        assert agent.memory_room.get_long_term_memory()['factual']['identity'] == "小明"
+        print("   ✅ 累计token数达到阈值时触发整合")
+
+        config.MEMORY_UPDATE_TOKEN_THRESHOLD = 0
+        config.MEMORY_UPDATE_CHAR_THRESHOLD = 20
+        mechanism.sync_state({'round_counter': 1, 'pending_tokens': 5, 'pending_chars': 19})
+        assert mechanism.get_trigger_reason() is None
+        mechanism.sync_state({'round_counter': 1, 'pending_tokens': 5, 'pending_chars': 20})
+        assert mechanism.get_trigger_reason() == "累计 20 字符"
+        print("   ✅ 累计字符数达到阈值时触发整合")
+
+
+def test_idle_trigger():
+    """测试空闲一段时间后整合已累计的对话"""
+    print("🧪 测试空闲触发...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = _config(tmp_dir, MEMORY_UPDATE_INTERVAL=100, MEMORY_UPDATE_IDLE_SECONDS=600)
+        agent = LittlePrinceAgent(config, "user_idle")
+        agent.chat("我叫小明")
+        assert agent.memory_room.get_consolidation_state()['round_counter'] == 1
+
+        mechanism = agent.memory_update_mechanism
+        now = datetime.fromisoformat(mechanism.last_round_at)
+        assert mechanism.get_idle_reason(now + timedelta(seconds=599)) is None
+        assert mechanism.get_idle_reason(now + timedelta(seconds=600)) == "空闲 600 秒"
+        assert agent.consolidate_if_idle() is False
+
+        # 模拟上一轮对话发生在20分钟前：下一轮先整合此前的对话
+        with agent.memory_room.database.get_connection() as conn:
+            earlier = (datetime.now() - timedelta(minutes=20)).isoformat()
+            conn.execute('UPDATE consolidation_state SET last_round_at = ? WHERE user_id = ?', (earlier, "user_idle"))
+        agent.chat("我喜欢玫瑰")
+        state = agent.memory_room.get_consolidation_state()
+        assert state['round_counter'] == 1, "空闲前的对话应已整合，只剩本轮"
+        assert agent.memory_room.get_long_term_memory()['factual']['identity'] == "小明"
+        print("   ✅ 空闲后整合已累计的对话")
+
+
+if __name__ == "__main__":
+    print("🚀 开始测试整合触发策略")
+    print("=" * 50)
+
+    try:
+        test_persisted_round_counter()
+        test_interval_with_small_window()
+        test_volume_trigger()
+        test_idle_trigger()
+        print("\n🎉 所有测试通过！")
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+测试token预算内的上下文组装
+验证按优先级填充预算，以及短期记忆随行保存的token数
+"""
+
+import os
+import sys
+import sqlite3
+import tempfile
+import threading
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core.context_assembler import ContextAssembler
+from core.memory import MemoryRoom
+from utils import token_counter
+from utils.token_counter import count_conversation_tokens, count_messages_tokens
+
+
+def test_context_budget():
+    """测试上下文组装的token预算"""
+    print("🧪 测试token预算内的上下文组装...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_context_budget"
+
+    short_term_memory = [
+        {'user': f"第{i}个问题" * 20, 'ai': f"第{i}个回答" * 20, 'token_count': None}
+        for i in range(10)
+    ]
+    long_term_context = [{"role": "system", "content": "基于我对您的了解：\n\n事实记忆：\n- 用户身份：小明"}]
+
+    # 1. 预算充足时保留全部内容
+    print("1. 预算充足...")
+    config = Config(DEFAULT_CONTEXT_TOKEN_BUDGET=100000)
+    assembler = ContextAssembler(config)
+    messages = assembler.assemble("你是小王子", long_term_context, short_term_memory, "你好", "unknown-model")
+    assert len(messages) == 1 + 1 + 20 + 1
+    assert assembler.last_report['rounds_dropped'] == 0
+    print(f"   ✅ 全部保留，使用 {assembler.last_report['used_tokens']} tokens")
+
+    # 2. 预算不足时优先保留最近的对话
+    print("2. 预算受限...")
+    round_tokens = count_conversation_tokens(short_term_memory[0]['user'], short_term_memory[0]['ai'])
+    config = Config(CONTEXT_TOKEN_BUDGETS={"small-model": 50 + round_tokens * 3})
+    assembler = ContextAssembler(config)
+    messages = assembler.assemble("你是小王子", long_term_context, short_term_memory, "你好", "small-model")
+    assert messages[0] == {"role": "system", "content": "你是小王子"}
+    assert messages[1] == long_term_context[0]
+    assert messages[-1] == {"role": "user", "content": "你好"}
+    assert messages[-3]['content'] == short_term_memory[-1]['user']
+    assert assembler.last_report['rounds_included'] < len(short_term_memory)
+    assert count_messages_tokens(messages) <= assembler.last_report['budget']
+    print(f"   ✅ 保留最近 {assembler.last_report['rounds_included']} 轮对话，未超出预算")
+
+    # 3. 长期记忆过长时按行截断
+    print("3. 长期记忆截断...")
+    long_block = [{"role": "system", "content": "事实记忆：\n" + "\n".join(f"- 条目{i}" for i in range(500))}]
+    config = Config(CONTEXT_TOKEN_BUDGETS={"tiny-model": 200})
+    assembler = ContextAssembler(config)
+    messages = assembler.assemble("你是小王子", long_block, short_term_memory, "你好", "tiny-model")
+    assert assembler.last_report['long_term_trimmed']
+    assert messages[1]['content'].startswith("事实记忆：\n- 条目0")
+    assert assembler.last_report['used_tokens'] <= 200
+    print("   ✅ 长期记忆按行截断")
+
+
+def test_stored_token_counts():
+    """测试短期记忆随行保存token数"""
+    print("\n🧪 测试短期记忆token数保存...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_context_budget"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "memory.sqlite")
+        room = MemoryRoom(Config(MEMORY_DB_PATH=db_path), "user_tokens")
+        room.add_conversation("我喜欢看星星", "我也喜欢！")
+
+        expected = count_conversation_tokens("我喜欢看星星", "我也喜欢！")
+        with sqlite3.connect(db_path) as conn:
+            stored = conn.execute("SELECT token_count FROM short_term_memory").fetchone()[0]
+        assert stored == expected
+        assert room.get_short_term_memory()[0]['token_count'] == expected
+        print(f"   ✅ token数已随行保存: {stored}")
+
+
+
+def test_preload_encoding():
+    """测试后台预加载词表期间计数不等待，加载完成后使用tiktoken"""
+    print("\n🧪 测试tiktoken词表后台预加载...")
+    
+    if not token_counter.TIKTOKEN_AVAILABLE:
+        print("   ⏭️ 未安装tiktoken，跳过")
+        return
+    
+    release = threading.Event()
+    
+    class FakeEncoding:
+        def encode(self, text, disallowed_special=()):
+            return list(text)
+    
+    def slow_get_encoding(name):
+        release.wait(5)
+        return FakeEncoding()
+    
+    original_get_encoding = token_counter.tiktoken.get_encoding
+    original_state = (token_counter._encoding, token_counter._encoding_failed)
+    original_cache_dir = os.environ.get("TIKTOKEN_CACHE_DIR")
+    token_counter.tiktoken.get_encoding = slow_get_encoding
+    token_counter._encoding, token_counter._encoding_failed = None, False
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            token_counter.preload_encoding(cache_dir)
+            assert os.environ["TIKTOKEN_CACHE_DIR"] == cache_dir
+            
+            # 词表仍在加载：立即返回估算值
+            text = "hello little prince"
+            assert token_counter.count_tokens(text) == token_counter.estimate_tokens(text)
+            print("   ✅ 加载期间使用估算器，不等待下载")
+            
+            release.set()
+            for _ in range(100):
+                if token_counter._encoding is not None:
+                    break
+                time.sleep(0.01)
+            assert token_counter.count_tokens(text) == len(text)
+            print("   ✅ 加载完成后使用tiktoken计数")
+    finally:
+        release.set()
+        token_counter.tiktoken.get_encoding = original_get_encoding
+        token_counter._encoding, token_counter._encoding_failed = original_state
+        token_counter._encoding_loading = False
+        if original_cache_dir is None:
+            os.environ.pop("TIKTOKEN_CACHE_DIR", None)
+        else:
+            os.environ["TIKTOKEN_CACHE_DIR"] = original_cache_dir
+
+
+if __name__ == "__main__":
+    test_context_budget()
+    test_stored_token_counts()
+    test_preload_encoding()
+    print("\n🎉 上下文token预算测试通过！")
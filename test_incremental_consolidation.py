@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+测试增量记忆整合
+验证记忆摘要的token预算、增删改操作的应用，以及记忆增长时整合提示词长度保持稳定
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core import LittlePrinceAgent
+from core.memory import MemoryUpdateMechanism
+from utils.token_counter import count_tokens
+
+
+def _memory_with_episodes(count: int) -> dict:
+    """构造包含指定数量情节记忆的长期记忆"""
+    return {
+        'factual': {'identity': '小明', 'preferences': '玫瑰'},
+        'episodic': [
+            {'type': '用户经历', 'content': f'第{i}次聊到B-612星球上的日落和那朵骄傲的玫瑰', 'timestamp': ''}
+            for i in range(1, count + 1)
+        ],
+        'semantic': {'values': '珍惜陪伴'}
+    }
+
+
+def test_memory_digest_and_delta():
+    """测试记忆摘要与增删改操作"""
+    print("🧪 测试记忆摘要与增量操作...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_incremental"
+    mechanism = MemoryUpdateMechanism(Config(LLM_PROVIDER="fake"))
+    memory = _memory_with_episodes(100)
+
+    # 1. 摘要不超过预算，保留全部事实记忆和最近的情节记忆
+    print("1. 记忆摘要...")
+    digest = mechanism.build_memory_digest(memory, token_budget=300)
+    assert count_tokens(digest) <= 300 + 30
+    assert "identity: 小明" in digest and "values: 珍惜陪伴" in digest
+    assert "E100 " in digest and "E1 " not in digest
+    print(f"   ✅ 摘要 {count_tokens(digest)} tokens，包含最近的情节记忆")
+
+    # 2. 应用增删改操作
+    print("2. 应用操作...")
+    ops = [
+        {"op": "update", "section": "factual", "key": "preferences", "value": "玫瑰和日落"},
+        {"op": "add", "section": "factual", "key": "interests", "value": "看星星"},
+        {"op": "delete", "section": "semantic", "key": "values"},
+        {"op": "delete", "section": "episodic", "key": "E1"},
+        {"op": "update", "section": "episodic", "key": "E2", "value": {"content": "第2次聊天被更正"}},
+        {"op": "add", "section": "episodic", "value": {"type": "特殊时刻", "content": "第一次看到日出"}},
+        {"op": "update", "section": "factual", "key": "unknown_key", "value": "无效"},
+        {"op": "delete", "section": "episodic", "key": "E999"}
+    ]
+    updated, applied = mechanism.apply_memory_delta(memory, ops)
+    assert applied == 6
+    assert updated['factual'] == {'identity': '小明', 'preferences': '玫瑰和日落', 'interests': '看星星'}
+    assert updated['semantic'] == {}
+    assert len(updated['episodic']) == 100
+    assert updated['episodic'][0]['content'] == "第2次聊天被更正"
+    assert updated['episodic'][-1]['content'] == "第一次看到日出"
+    assert len(memory['episodic']) == 100 and memory['semantic'] == {'values': '珍惜陪伴'}
+    print("   ✅ 有效操作已应用，无效操作被忽略，原记忆未被修改")
+
+
+def test_incremental_prompt_stays_bounded():
+    """测试记忆增长时增量整合的提示词token数保持稳定"""
+    print("\n🧪 测试增量整合提示词长度...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_incremental"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config(
+            MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"),
+            LLM_PROVIDER="fake",
+            MEMORY_UPDATE_MODE="incremental",
+            MEMORY_DIGEST_TOKEN_BUDGET=400
+        )
+        agent = LittlePrinceAgent(config, "user_incremental")
+        mechanism = agent.memory_update_mechanism
+        turns = [{'user': '我叫小明，我喜欢玫瑰', 'ai': '你好呀！'}, {'user': '今天看了日落', 'ai': '真美。'}]
+
+        prompt_tokens = []
+        for episodes in (0, 50, 200, 800):
+            memory = _memory_with_episodes(episodes)
+            updated = mechanism.update_memory(turns, memory)
+            assert mechanism.last_error is None
+            prompt_tokens.append(agent.llm.last_usage['input_tokens'])
+            assert updated['factual']['identity'] == "小明"
+            assert len(updated['episodic']) == episodes + 1
+
+        assert max(prompt_tokens[1:]) - min(prompt_tokens[1:]) < 60
+        print(f"   ✅ 记忆 0/50/200/800 条时提示词 tokens: {prompt_tokens}")
+
+        # 无效结果不会静默覆盖原有记忆
+        def invalid_invoke(messages, validator):
+            validator.feed(json.dumps({"result": []}))
+            return validator.close()
+
+        original_invoke = agent.llm.invoke_json
+        agent.llm.invoke_json = invalid_invoke
+        memory = _memory_with_episodes(3)
+        assert mechanism.update_memory(turns, memory) == memory
+        assert mechanism.last_error
+        agent.llm.invoke_json = original_invoke
+        print("   ✅ 缺少ops时保留原有记忆并记录错误")
+
+
+if __name__ == "__main__":
+    test_memory_digest_and_delta()
+    test_incremental_prompt_stays_bounded()
+    print("\n🎉 增量记忆整合测试通过！")
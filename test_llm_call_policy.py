@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+测试LLM调用策略
+使用本地模拟的OpenAI兼容服务（可注入延迟和错误码），验证重试、超时与截止时间以及对冲请求
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core import LittlePrinceAgent
+from core.llm import LLMInterface
+
+
+FALLBACK = "抱歉，我现在无法回应，请稍后再试。"
+REPLY = "你好呀，朋友！"
+MESSAGES = [{"role": "user", "content": "你好"}]
+
+
+class MockLLMServer:
+    """本地模拟的 /v1/chat/completions 服务，按请求顺序执行预设的动作"""
+
+    def __init__(self, actions=(), default_latency: float = 0.0):
+        # 每个动作为 (延迟秒数, 状态码, 额外响应头)
+        self.actions = list(actions)
+        self.default_latency = default_latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # 保持连接，与真实服务一样复用连接池
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                latency, status, headers = server._next_action()
+                time.sleep(latency)
+                content_type = 'application/json'
+                if status == 200 and request.get('stream'):
+                    # 流式请求按SSE格式逐块返回
+                    content_type = 'text/event-stream'
+                    payload = ''.join(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                                      for chunk in server._stream_chunks()) + "data: [DONE]\n\n"
+                    payload = payload.encode('utf-8')
+                else:
+                    if status == 200:
+                        body = {
+                            "id": "chatcmpl-mock", "object": "chat.completion", "created": 0, "model": "gpt-4o-mini",
+                            "choices": [{"index": 0, "finish_reason": "stop",
+                                         "message": {"role": "assistant", "content": REPLY}}],
+                            "usage": {"prompt_tokens": 5, "completion_tokens": 6, "total_tokens": 11}
+                        }
+                    else:
+                        body = {"error": {"message": f"mock error {status}", "type": "server_error"}}
+                    payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', str(len(payload)))
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    @staticmethod
+    def _stream_chunks():
+        """流式回复的各个块：先是内容，最后一块带用量"""
+        for index, text in enumerate(("你好呀", "，朋友！")):
+            delta = {"role": "assistant", "content": text} if index == 0 else {"content": text}
+            yield {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o-mini",
+                   "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+        yield {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o-mini",
+               "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+               "usage": {"prompt_tokens": 5, "completion_tokens": 6, "total_tokens": 11}}
+
+    def _next_action(self):
+        with self._lock:
+            self.requests += 1
+            if self.actions:
+                return self.actions.pop(0)
+        return self.default_latency, 200, {}
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _llm(server: MockLLMServer, **policy) -> LLMInterface:
+    os.environ["LLM_API_KEY"] = "test_key_for_call_policy"
+    config = Config(LLM_PROVIDER="openai", LLM_MODEL="gpt-4o-mini", LLM_BASE_URL=server.base_url,
+                    LLM_CALL_RETRY_BASE_SECONDS=0.01, LLM_CALL_POLICIES={"openai": policy})
+    return LLMInterface(config)
+
+
+def test_retry():
+    """测试可重试错误的退避重试与不可重试错误"""
+    print("🧪 测试LLM调用重试...")
+
+    # 1. 两次503后成功
+    print("1. 服务端错误后重试...")
+    server = MockLLMServer([(0, 503, {}), (0, 503, {})])
+    try:
+        llm = _llm(server)
+        assert llm.generate(MESSAGES) == REPLY
+        assert server.requests == 3
+        stats = llm.get_call_stats()
+        assert stats['retries'] == 2 and stats['failures'] == 0
+        assert llm.last_usage['output_tokens'] == 6
+        print(f"   ✅ 重试后成功，统计: {stats}")
+    finally:
+        server.close()
+
+    # 2. 429按Retry-After等待
+    print("2. 限流...")
+    server = MockLLMServer([(0, 429, {'Retry-After': '0.3'})])
+    try:
+        llm = _llm(server)
+        start = time.perf_counter()
+        assert llm.generate(MESSAGES) == REPLY
+        assert time.perf_counter() - start >= 0.3
+        print("   ✅ 按Retry-After等待后重试")
+    finally:
+        server.close()
+
+    # 3. 400不重试
+    print("3. 不可重试的错误...")
+    server = MockLLMServer([(0, 400, {})])
+    try:
+        llm = _llm(server)
+        assert llm.generate(MESSAGES) == FALLBACK
+        assert server.requests == 1
+        assert llm.get_call_stats()['failures'] == 1
+        print("   ✅ 请求错误不重试")
+    finally:
+        server.close()
+
+
+def test_timeout_and_deadline():
+    """测试单次请求超时与整次调用的截止时间"""
+    print("🧪 测试LLM调用超时...")
+
+    server = MockLLMServer(default_latency=1.0)
+    try:
+        llm = _llm(server, timeout_seconds=0.2, deadline_seconds=0.5, max_retries=5)
+        start = time.perf_counter()
+        assert llm.generate(MESSAGES) == FALLBACK
+        elapsed = time.perf_counter() - start
+        assert elapsed < 0.8, f"超出截止时间: {elapsed:.2f}s"
+        stats = llm.get_call_stats()
+        assert stats['timeouts'] >= 2 and stats['failures'] == 1
+        print(f"   ✅ {elapsed * 1000:.0f}ms 内放弃，统计: {stats}")
+    finally:
+        server.close()
+
+
+def test_hedging():
+    """测试对冲请求：首个请求过慢时第二个请求先返回"""
+    print("🧪 测试对冲请求...")
+
+    server = MockLLMServer([(1.0, 200, {})], default_latency=0.05)
+    try:
+        llm = _llm(server, hedge=True, hedge_delay_seconds=0.2)
+        start = time.perf_counter()
+        assert llm.generate(MESSAGES) == REPLY
+        elapsed = time.perf_counter() - start
+        assert elapsed < 0.6, f"未使用对冲请求的结果: {elapsed:.2f}s"
+        stats = llm.get_call_stats()
+        assert stats['hedges'] == 1 and stats['hedge_wins'] == 1
+        print(f"   ✅ {elapsed * 1000:.0f}ms 返回（首个请求需1000ms），统计: {stats}")
+
+        # 请求足够快时不发对冲请求
+        llm.generate(MESSAGES)
+        assert llm.get_call_stats()['hedges'] == 1
+        print("   ✅ 正常请求不触发对冲")
+    finally:
+        server.close()
+
+
+def test_streams_and_async():
+    """测试流式与异步调用同样按策略重试：流在取得第一个块之前可重试"""
+    print("🧪 测试流式与异步调用...")
+
+    # 1. 流式调用：首个块之前的服务端错误被重试
+    print("1. 流式调用重试...")
+    server = MockLLMServer([(0, 503, {})])
+    try:
+        llm = _llm(server)
+        assert "".join(llm.stream(MESSAGES)) == REPLY
+        assert server.requests == 2 and llm.get_call_stats()['retries'] == 1
+        assert llm.last_usage['output_tokens'] == 6 and llm.last_usage['first_token_ms'] is not None
+        print("   ✅ 重试后逐块输出")
+    finally:
+        server.close()
+
+    # 2. 异步调用：超时的请求被取消后重试
+    print("2. 异步调用超时重试...")
+    server = MockLLMServer([(1.0, 200, {}), (0, 503, {})])
+    try:
+        llm = _llm(server, timeout_seconds=0.3)
+
+        async def collect():
+            return await llm.agenerate(MESSAGES), "".join([chunk async for chunk in llm.astream(MESSAGES)])
+
+        start = time.perf_counter()
+        assert asyncio.run(collect()) == (REPLY, REPLY)
+        elapsed = time.perf_counter() - start
+        stats = llm.get_call_stats()
+        assert elapsed < 0.9, f"超时的请求未被放弃: {elapsed:.2f}s"
+        assert stats['timeouts'] == 1 and stats['retries'] == 2 and stats['failures'] == 0
+        print(f"   ✅ {elapsed * 1000:.0f}ms 完成，统计: {stats}")
+    finally:
+        server.close()
+
+
+def test_executor_saturation():
+    """测试线程池（大小按提供商配置）已满时：排队超时的请求不再发出并单独计数，也不发对冲请求"""
+    print("🧪 测试线程池已满...")
+
+    release = threading.Event()
+    server = MockLLMServer()
+    hedge_server = MockLLMServer([(0.5, 200, {})])
+    try:
+        # 1. 线程池全部被占用，请求排队到超时后放弃，之后也不会再发出
+        print("1. 排队超时...")
+        llm = _llm(server, timeout_seconds=0.2, max_retries=0, max_concurrency=2)
+        pool = llm.call_policy.pool
+        assert pool.max_workers == 2
+        blockers = [pool.submit(release.wait, 5) for _ in range(pool.max_workers)]
+        assert pool.saturated()
+        assert llm.generate(MESSAGES) == FALLBACK
+        release.set()
+        for blocker in blockers:
+            blocker.result()
+        time.sleep(0.2)
+        stats = llm.get_call_stats()
+        assert server.requests == 0
+        assert stats['queued'] == 1 and stats['queue_timeouts'] == 1 and stats['timeouts'] == 0
+        print(f"   ✅ 排队超时的请求未发出，统计: {stats}")
+
+        # 2. 只剩一个空闲线程时，慢请求不发对冲
+        print("2. 跳过对冲...")
+        release.clear()
+        llm = _llm(hedge_server, hedge=True, hedge_delay_seconds=0.1, max_concurrency=2)
+        assert llm.call_policy.pool is pool
+        blockers = [pool.submit(release.wait, 5) for _ in range(pool.max_workers - 1)]
+        assert llm.generate(MESSAGES) == REPLY
+        stats = llm.get_call_stats()
+        assert stats['hedges'] == 0 and stats['hedges_skipped'] == 1 and hedge_server.requests == 1
+        print(f"   ✅ 线程池已满时不对冲，统计: {stats}")
+    finally:
+        release.set()
+        server.close()
+        hedge_server.close()
+
+
+def test_turn_deadline():
+    """测试对话的截止时间从本轮开始计时，构建上下文的耗时同样计入"""
+    print("🧪 测试整轮对话的截止时间...")
+
+    server = MockLLMServer(default_latency=0.4)
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.environ["LLM_API_KEY"] = "test_key_for_call_policy"
+            config = Config(LLM_PROVIDER="openai", LLM_MODEL="gpt-4o-mini", LLM_BASE_URL=server.base_url,
+                            MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"),
+                            LLM_CALL_POLICIES={"openai": {"deadline_seconds": 0.6, "max_retries": 0}})
+            agent = LittlePrinceAgent(config, "deadline_user")
+            assert agent.chat("你好") == REPLY
+
+            # 构建上下文用掉0.3秒后，剩余的时间不够一次0.4秒的请求
+            original_prepare = agent.prepare_turn_messages
+
+            def slow_prepare(user_input):
+                time.sleep(0.3)
+                return original_prepare(user_input)
+
+            agent.prepare_turn_messages = slow_prepare
+            start = time.perf_counter()
+            assert agent.chat("你好") == FALLBACK
+            elapsed = time.perf_counter() - start
+            assert elapsed < 0.7, f"超出本轮截止时间: {elapsed:.2f}s"
+            print(f"   ✅ {elapsed * 1000:.0f}ms 内放弃（截止时间600ms）")
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    print("🚀 开始测试LLM调用策略")
+    print("=" * 50)
+
+    try:
+        test_retry()
+        test_timeout_and_deadline()
+        test_hedging()
+        test_streams_and_async()
+        test_executor_saturation()
+        test_turn_deadline()
+        print("\n🎉 所有测试通过！")
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
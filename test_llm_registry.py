@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+测试LLM客户端注册表
+验证相同配置的Agent共用客户端和HTTP连接池、不同配置或密钥使用不同客户端，以及切换模型时从注册表取得客户端
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core import LittlePrinceAgent
+from core.llm import LLMInterface
+from core.llm_registry import LLMClientRegistry, get_llm_client_registry
+from test_llm_call_policy import MockLLMServer
+
+
+def _config(tmp_dir: str, **kwargs) -> Config:
+    os.environ["LLM_API_KEY"] = "test_key_for_llm_registry"
+    return Config(MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"), **kwargs)
+
+
+def test_shared_clients():
+    """测试相同配置共用客户端"""
+    print("🧪 测试LLM客户端注册表...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        registry = get_llm_client_registry()
+
+        # 1. 相同配置的多个Agent共用同一个客户端
+        print("1. 相同配置...")
+        first = LittlePrinceAgent(_config(tmp_dir, LLM_PROVIDER="deepseek"), "user_a")
+        second = LittlePrinceAgent(_config(tmp_dir, LLM_PROVIDER="deepseek"), "user_b")
+        assert first.llm.llm is second.llm.llm
+        print("   ✅ 共用客户端")
+
+        # 2. 温度或密钥不同时使用不同客户端，所有客户端共用HTTP连接池
+        print("2. 不同配置...")
+        warmer = LLMInterface(_config(tmp_dir, LLM_PROVIDER="deepseek", TEMPERATURE=1.0))
+        other_key = LLMInterface(_config(tmp_dir, LLM_PROVIDER="deepseek", LLM_API_KEY="another_key"))
+        assert warmer.llm is not first.llm.llm and other_key.llm is not first.llm.llm
+        assert warmer.llm.http_client is first.llm.llm.http_client
+        assert warmer.llm.http_async_client is first.llm.llm.http_async_client
+        print("   ✅ 按温度和密钥区分客户端，共用同步和异步连接池")
+
+        # 3. 切换模型是注册表查找，切回原模型时取得原客户端
+        print("3. 切换模型...")
+        original = first.llm.llm
+        first.switch_model("openai", "gpt-4o-mini")
+        assert first.llm.provider == "openai" and first.llm.llm.model_name == "gpt-4o-mini"
+        first.switch_model("deepseek", "deepseek-chat")
+        assert first.llm.llm is original
+        print(f"   ✅ 注册表统计: {registry.get_stats()}")
+
+        # 4. 切换失败时保持当前模型
+        print("4. 切换失败...")
+        try:
+            first.switch_model("unknown", "some-model")
+            assert False, "应当抛出异常"
+        except ValueError:
+            pass
+        assert first.llm.provider == "deepseek" and first.llm.llm is original
+        print("   ✅ 切换失败时保持当前模型")
+
+
+def test_shared_async_client():
+    """测试共享的异步HTTP客户端可以在多个事件循环中使用"""
+    print("🧪 测试共享异步HTTP客户端...")
+
+    server = MockLLMServer()
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            llm = LLMInterface(_config(tmp_dir, LLM_PROVIDER="openai", LLM_MODEL="gpt-4o-mini",
+                                       LLM_BASE_URL=server.base_url))
+            # 每次asyncio.run都是新的事件循环，连接池按事件循环区分，不会复用已关闭循环上的连接
+            for _ in range(2):
+                assert asyncio.run(llm.agenerate([{"role": "user", "content": "你好"}])) == "你好呀，朋友！"
+            assert server.requests == 2
+            print("   ✅ 两个事件循环中的异步调用都成功")
+    finally:
+        server.close()
+
+
+def test_registry_key():
+    """测试注册表键不包含明文密钥，本地模拟LLM不共享"""
+    print("🧪 测试注册表键...")
+
+    fingerprint = LLMClientRegistry.fingerprint("sk-secret")
+    assert "secret" not in fingerprint and len(fingerprint) == 16
+    assert fingerprint != LLMClientRegistry.fingerprint("sk-other")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = _config(tmp_dir, LLM_PROVIDER="fake")
+        assert LLMInterface(config).llm is not LLMInterface(config).llm
+    print("   ✅ 密钥只以指纹出现，本地模拟LLM每个接口单独创建")
+
+
+if __name__ == "__main__":
+    print("🚀 开始测试LLM客户端注册表")
+    print("=" * 50)
+
+    try:
+        test_shared_clients()
+        test_shared_async_client()
+        test_registry_key()
+        print("\n🎉 所有测试通过！")
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
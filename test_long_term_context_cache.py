@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+测试长期记忆上下文渲染缓存
+验证按版本缓存、增量重渲染以及命中率统计
+"""
+
+import os
+import sys
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core.memory import MemoryRoom, MemoryInteraction
+
+
+def test_long_term_context_cache():
+    """测试长期记忆上下文渲染缓存"""
+    print("🧪 测试长期记忆上下文渲染缓存...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_context_cache"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config(MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"))
+        room = MemoryRoom(config, "user_ctx")
+        interaction = MemoryInteraction(config)
+
+        room.update_long_term_memory({
+            'factual': {'identity': '小明', 'interests': '看星星'},
+            'episodic': [{'content': '第一次看流星雨'}],
+            'semantic': {'values': '友谊最重要'}
+        })
+
+        # 1. 渲染内容正确
+        print("1. 首次渲染...")
+        context = interaction.get_long_term_context(room, "little_prince_fan_v1")
+        expected = (
+            "基于我对您的了解：\n\n"
+            "事实记忆：\n- 用户身份：小明\n- 兴趣：看星星\n\n"
+            "最近经历：\n- 第一次看流星雨\n\n"
+            "语义记忆：\n- 价值观：友谊最重要\n\n"
+            "请以小王子的身份与用户对话，体现对用户的深度理解和关怀。"
+        )
+        assert context == [{"role": "system", "content": expected}]
+        assert context == interaction.format_long_term_context(room.get_long_term_memory())
+        print("   ✅ 渲染结果与直接格式化一致")
+
+        # 2. 相同版本命中缓存
+        print("2. 重复获取...")
+        for _ in range(3):
+            assert interaction.get_long_term_context(room, "little_prince_fan_v1") == context
+        stats = interaction.get_cache_stats()
+        assert stats['hits'] == 3 and stats['misses'] == 1
+        assert stats['hit_rate'] == 0.75
+        print(f"   ✅ 命中率: {stats['hit_rate']:.0%}")
+
+        # 3. 切换Prompt视为不同的缓存键
+        print("3. 切换Prompt...")
+        interaction.get_long_term_context(room, "little_prince_v1")
+        assert interaction.get_cache_stats()['misses'] == 2
+        print("   ✅ 不同Prompt重新生成")
+
+        # 4. 记忆更新后只重新渲染变化的部分
+        print("4. 增量重渲染...")
+        sections_rendered = interaction.get_cache_stats()['sections_rendered']
+        room.update_long_term_memory({
+            'factual': {'identity': '小明', 'interests': '看星星'},
+            'episodic': [{'content': '第一次看流星雨'}, {'content': '养了一只狐狸'}],
+            'semantic': {'values': '友谊最重要'}
+        })
+        context = interaction.get_long_term_context(room, "little_prince_v1")
+        assert "- 养了一只狐狸" in context[0]['content']
+        assert interaction.get_cache_stats()['sections_rendered'] == sections_rendered + 1
+        print("   ✅ 只有情节记忆被重新渲染")
+
+        # 5. 主动失效
+        print("5. 主动失效...")
+        interaction.invalidate_long_term_cache("user_ctx")
+        interaction.get_long_term_context(room, "little_prince_v1")
+        stats = interaction.get_cache_stats()
+        assert stats['misses'] == 4
+        assert stats['avg_render_time'] >= 0
+        print(f"   ✅ 失效后重新渲染，平均渲染耗时 {stats['avg_render_time'] * 1000:.3f}ms")
+
+
+if __name__ == "__main__":
+    test_long_term_context_cache()
+    print("\n🎉 长期记忆上下文缓存测试通过！")
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+测试长期记忆的结构哈希变更检测
+验证未变化的部分被跳过、只写入真正变化的条目，以及旧数据的哈希补算
+"""
+
+import os
+import sys
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from core.memory.memory_database import MemoryDatabase
+from core.memory.memory_hash import diff_memory, format_diff_summary
+
+
+def _memory():
+    return {
+        'factual': {'identity': '小明', 'preferences': '玫瑰'},
+        'episodic': [
+            {'type': '用户经历', 'content': '第一次看日落', 'timestamp': ''},
+            {'type': '情感亮点', 'content': '想念狐狸', 'timestamp': ''}
+        ],
+        'semantic': {'values': '珍惜陪伴'}
+    }
+
+
+def test_memory_hash_diff():
+    """测试按哈希比较并只写入变化"""
+    print("🧪 测试结构哈希变更检测...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database = MemoryDatabase(os.path.join(tmp_dir, "memory.sqlite"))
+        database.update_long_term_memory("user_a", _memory())
+        version = database.get_memory_version("user_a")['long_term_version']
+
+        # 1. 内容相同（事实记忆顺序不同）时没有差异，也不写入
+        print("1. 无变化...")
+        same = _memory()
+        same['factual'] = {'preferences': '玫瑰', 'identity': '小明'}
+        diff = diff_memory(database.get_memory_hashes("user_a"), same)
+        assert diff == {}
+        assert database.apply_long_term_diff("user_a", diff)
+        assert database.get_memory_version("user_a")['long_term_version'] == version
+        assert format_diff_summary(diff) == "无变化"
+        print("   ✅ 未变化的记忆不会被重写")
+
+        # 2. 只有变化的部分和条目被写入
+        print("2. 部分变化...")
+        changed = _memory()
+        changed['factual']['preferences'] = '玫瑰和日落'
+        changed['episodic'].append({'type': '特殊时刻', 'content': '看到流星', 'timestamp': ''})
+        stored = database.get_memory_hashes("user_a")
+        episodic_rows = [row_id for row_id, _ in stored['episodic']['entries']]
+        diff = diff_memory(stored, changed)
+        assert set(diff) == {'factual', 'episodic'}
+        assert [entry[1] for entry in diff['factual']['added']] == ['玫瑰和日落']
+        assert len(diff['factual']['removed']) == 1
+        assert len(diff['episodic']['added']) == 1 and diff['episodic']['removed'] == []
+        assert format_diff_summary(diff) == "factual +1 -1，episodic +1 -0，semantic 未变"
+
+        assert database.apply_long_term_diff("user_a", diff)
+        assert database.get_long_term_memory("user_a") == changed
+        stored = database.get_memory_hashes("user_a")
+        assert [row_id for row_id, _ in stored['episodic']['entries']][:2] == episodic_rows
+        assert diff_memory(stored, changed) == {}
+        print("   ✅ 只写入变化的条目，未变化的行保留")
+
+        # 3. 情节记忆顺序变化时整体重写，读取顺序与新记忆一致
+        print("3. 顺序变化...")
+        reordered = database.get_long_term_memory("user_a")
+        reordered['episodic'].insert(0, {'type': '用户经历', 'content': '更早的回忆', 'timestamp': ''})
+        assert database.apply_long_term_diff("user_a", diff_memory(database.get_memory_hashes("user_a"), reordered))
+        assert database.get_long_term_memory("user_a")['episodic'] == reordered['episodic']
+        print("   ✅ 情节记忆顺序保持一致")
+
+
+def test_hash_backfill_for_legacy_rows():
+    """测试旧数据缺少哈希时补算"""
+    print("\n🧪 测试旧数据哈希补算...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database = MemoryDatabase(os.path.join(tmp_dir, "memory.sqlite"))
+        database.update_long_term_memory("user_b", _memory())
+        with database.get_connection() as conn:
+            conn.execute("UPDATE long_term_memory SET content_hash = NULL")
+            conn.execute("DELETE FROM memory_section_hashes")
+
+        assert diff_memory(database.get_memory_hashes("user_b"), _memory()) == {}
+        with database.get_connection() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM long_term_memory WHERE content_hash IS NULL").fetchone()[0] == 0
+            assert conn.execute("SELECT COUNT(*) FROM memory_section_hashes").fetchone()[0] == 3
+        print("   ✅ 哈希已补算并写回")
+
+
+if __name__ == "__main__":
+    test_memory_hash_diff()
+    test_hash_backfill_for_legacy_rows()
+    print("\n🎉 结构哈希变更检测测试通过！")
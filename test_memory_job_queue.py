@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+测试持久化的记忆任务队列
+验证幂等入队、租约与超时重新领取、指数退避重试、死信，以及进程重启后继续执行整合任务
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core import LittlePrinceAgent
+from core.memory import MemoryJobQueue, MemoryJobRunner
+from core.memory.memory_database import MemoryDatabase
+
+
+def test_job_queue_lifecycle():
+    """测试任务的入队、领取、重试与死信"""
+    print("🧪 测试记忆任务队列...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database = MemoryDatabase(os.path.join(tmp_dir, "memory.sqlite"))
+        queue = MemoryJobQueue(database, lease_seconds=0.2, max_attempts=2, retry_base_seconds=0.1)
+
+        # 1. 相同幂等键只入队一次
+        print("1. 幂等入队...")
+        first = queue.enqueue('consolidate', 'user_a', {'first_id': 1, 'last_id': 5}, idempotency_key="consolidate:user_a:1-5")
+        second = queue.enqueue('consolidate', 'user_a', {'first_id': 1, 'last_id': 5}, idempotency_key="consolidate:user_a:1-5")
+        assert first == second
+        assert queue.get_stats()['pending'] == 1
+        print("   ✅ 重复入队返回同一任务")
+
+        # 2. 同一用户同时只有一个任务被领取
+        print("2. 领取任务...")
+        queue.enqueue('consolidate', 'user_a', {}, idempotency_key="consolidate:user_a:6-10")
+        queue.enqueue('consolidate', 'user_b', {}, idempotency_key="consolidate:user_b:1-5")
+        job_a = queue.lease()
+        job_b = queue.lease()
+        assert job_a['user_id'] == 'user_a' and job_a['payload'] == {'first_id': 1, 'last_id': 5}
+        assert job_b['user_id'] == 'user_b'
+        assert queue.lease() is None
+        assert queue.complete(job_a) and queue.complete(job_b)
+        print("   ✅ 同一用户的任务串行领取")
+
+        # 3. 租约过期后任务可被重新领取，旧租约无法再提交结果
+        print("3. 租约超时...")
+        stale = queue.lease()
+        assert stale is not None
+        time.sleep(0.25)
+        reclaimed = queue.lease()
+        assert reclaimed['id'] == stale['id'] and reclaimed['attempts'] == 2
+        assert not queue.complete(stale)
+        print("   ✅ 超时任务被重新领取")
+
+        # 4. 失败达到最大次数后进入死信，可手动重试
+        print("4. 失败与死信...")
+        assert queue.fail(reclaimed, "分析失败") == 'dead'
+        dead = queue.get_jobs(status='dead')
+        assert len(dead) == 1 and dead[0]['last_error'] == "分析失败"
+        assert queue.retry_dead(dead[0]['id'])
+        assert queue.get_job(dead[0]['id'])['status'] == 'pending'
+        print("   ✅ 死信任务可重新入队")
+
+
+def test_job_runner_retry_with_backoff():
+    """测试执行器按退避时间重试失败的任务"""
+    print("\n🧪 测试失败重试...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database = MemoryDatabase(os.path.join(tmp_dir, "memory.sqlite"))
+        queue = MemoryJobQueue(database, max_attempts=3, retry_base_seconds=0.1)
+        calls = []
+
+        def flaky_handler(job):
+            calls.append(time.time())
+            if len(calls) < 2:
+                raise RuntimeError("临时错误")
+
+        runner = MemoryJobRunner(queue, {'consolidate': flaky_handler}, concurrency=2)
+        queue.enqueue('consolidate', 'user_a', {}, idempotency_key="job-1")
+
+        assert runner.drain() == {'completed': 0, 'retried': 1, 'dead': 0}
+        # 退避时间未到时不会被领取
+        assert runner.drain() == {'completed': 0, 'retried': 0, 'dead': 0}
+        time.sleep(0.15)
+        assert runner.drain()['completed'] == 1
+        assert calls[1] - calls[0] >= 0.1
+        print(f"   ✅ 第2次执行成功，间隔 {calls[1] - calls[0]:.2f}s")
+
+
+def test_resume_after_restart():
+    """测试进程重启后继续执行未完成的整合任务"""
+    print("\n🧪 测试重启后继续执行...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_job_queue"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config(
+            MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"),
+            LLM_PROVIDER="fake",
+            MEMORY_UPDATE_INTERVAL=3,
+            MEMORY_UPDATE_BACKGROUND=False,
+            MEMORY_JOB_LEASE_SECONDS=0.1
+        )
+        agent = LittlePrinceAgent(config, "user_restart")
+
+        # 模拟进程在整合过程中退出：任务已被领取但未完成
+        agent.process_memory_jobs = lambda: agent.job_queue.lease("user_restart")
+        agent.chat("我叫小明")
+        agent.chat("你好")
+        agent.chat("再见")
+        assert agent.job_queue.get_stats()['running'] == 1
+        assert agent.get_memory_stats()['short_term_count'] == 3
+        print("   ✅ 整合任务已持久化")
+
+        # 租约过期后，新进程中的Agent继续执行该任务
+        time.sleep(0.15)
+        restarted = LittlePrinceAgent(config, "user_restart")
+        assert restarted.memory_room.get_long_term_memory()['factual']['identity'] == "小明"
+        assert restarted.get_memory_stats()['short_term_count'] == 0
+        stats = restarted.job_queue.get_stats()
+        assert stats['running'] == 0 and stats['done'] == 2
+        print("   ✅ 重启后整合任务已完成")
+
+
+def test_retry_without_traffic():
+    """测试失败的整合在用户不再对话时也会按退避时间重试"""
+    print("\n🧪 测试无对话时的定时重试...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_job_queue"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config(
+            MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"),
+            LLM_PROVIDER="fake",
+            MEMORY_UPDATE_INTERVAL=2,
+            MEMORY_JOB_RETRY_BASE_SECONDS=0.2
+        )
+        agent = LittlePrinceAgent(config, "user_retry_timer")
+
+        # 第一次整合失败，之后恢复正常
+        original_update = agent.execute_memory_update
+        attempts = []
+
+        def flaky_update():
+            attempts.append(time.time())
+            return len(attempts) > 1 and original_update()
+
+        agent.execute_memory_update = flaky_update
+        agent.chat("我叫小明")
+        agent.chat("你好")
+        agent.consolidation_worker.wait_idle("user_retry_timer")
+        assert len(attempts) == 1 and agent.job_queue.get_stats()['pending'] >= 1
+        print("   ✅ 首次整合失败，任务进入退避")
+
+        # 不再对话，退避到期后由定时器重试
+        deadline = time.time() + 5
+        while agent.job_queue.get_stats()['pending'] and time.time() < deadline:
+            time.sleep(0.05)
+        agent.consolidation_worker.wait_idle("user_retry_timer")
+        assert len(attempts) == 2 and attempts[1] - attempts[0] >= 0.2
+        assert agent.memory_room.get_long_term_memory()['factual']['identity'] == "小明"
+        assert agent.job_queue.get_stats()['pending'] == 0
+        print(f"   ✅ {attempts[1] - attempts[0]:.2f} 秒后自动重试成功")
+
+
+def test_unknown_job_type_not_retried():
+    """测试没有处理函数的任务类型（例如其它版本入队的任务）不会触发定时重试"""
+    print("\n🧪 测试未知类型的任务...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_job_queue"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config(MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"), LLM_PROVIDER="fake",
+                        MEMORY_JOB_CONCURRENCY=2)
+        agent = LittlePrinceAgent(config, "user_unknown_job")
+        agent.job_queue.enqueue('future_job', "user_unknown_job")
+
+        assert agent.job_queue.get_next_due_delay("user_unknown_job") == 0
+        assert agent.job_queue.get_next_due_delay("user_unknown_job", ['consolidate', 'summarize']) is None
+        counts = agent.process_memory_jobs()
+        assert not any(counts.values())
+        assert agent._job_retry_timer is None
+        assert agent.job_queue.get_stats()['pending'] == 1
+        print("   ✅ 未知类型的任务保持待执行，不触发定时重试")
+
+
+if __name__ == "__main__":
+    test_job_queue_lifecycle()
+    test_job_runner_retry_with_backoff()
+    test_resume_after_restart()
+    test_retry_without_traffic()
+    test_unknown_job_type_not_retried()
+    print("\n🎉 记忆任务队列测试通过！")
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+测试跨进程缓存失效
+验证PRAGMA data_version全局检查与每用户版本行能让进程内缓存及时失效
+"""
+
+import os
+import sys
+import subprocess
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core.memory import MemoryRoom, MemoryVersionTracker
+from core.memory.memory_database import MemoryDatabase
+
+
+def _write_from_other_process(db_path: str, user_id: str):
+    """在独立进程中写入一轮对话，模拟另一个Streamlit工作进程"""
+    script = (
+        "import sys; sys.path.insert(0, %r);"
+        "from core.memory.memory_database import MemoryDatabase;"
+        "MemoryDatabase(%r).add_short_term_memory(%r, '来自其它进程', '收到')"
+    ) % (os.path.dirname(os.path.abspath(__file__)), db_path, user_id)
+    subprocess.run([sys.executable, "-c", script], check=True)
+
+
+def test_version_tracker():
+    """测试版本跟踪器"""
+    print("🧪 测试记忆版本跟踪器...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "memory.sqlite")
+        database = MemoryDatabase(db_path)
+        tracker = MemoryVersionTracker(database)
+
+        # 1. 初始版本
+        print("1. 检查初始版本...")
+        version = tracker.get_version("user_a")
+        assert version == {'short_term_version': 0, 'long_term_version': 0}
+        assert not tracker.has_changed()
+        print("   ✅ 初始版本为0，且没有新的提交")
+
+        # 2. 其它连接写入后data_version变化，版本递增
+        print("2. 其它连接写入...")
+        MemoryDatabase(db_path).add_short_term_memory("user_a", "你好", "你好呀")
+        assert tracker.has_changed()
+        assert tracker.get_version("user_a")['short_term_version'] == 1
+        print("   ✅ data_version变化被检测到，短期记忆版本递增")
+
+        # 3. 其它进程写入
+        print("3. 其它进程写入...")
+        _write_from_other_process(db_path, "user_a")
+        version = tracker.get_version("user_a")
+        assert version['short_term_version'] == 2
+        assert version['long_term_version'] == 0
+        print(f"   ✅ 跨进程写入后版本: {version}")
+
+        # 4. 长期记忆更新只递增长期版本
+        print("4. 长期记忆更新...")
+        database.update_long_term_memory("user_a", {'factual': {'identity': '小明'}})
+        version = tracker.get_version("user_a")
+        assert version == {'short_term_version': 2, 'long_term_version': 1}
+        print("   ✅ 长期记忆版本递增")
+
+
+def test_stale_read_not_cached():
+    """测试回源读取期间有新的提交时，读到的旧版本不会写回缓存"""
+    print("\n🧪 测试并发读取与提交...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "memory.sqlite")
+        database = MemoryDatabase(db_path)
+        tracker = MemoryVersionTracker(database)
+        original_read = database.get_memory_version
+
+        # 本线程读到旧版本后、写回缓存前，另一个线程提交并检查到了变化
+        def read_then_commit(user_id):
+            version = original_read(user_id)
+            MemoryDatabase(db_path).add_short_term_memory(user_id, "你好", "你好呀")
+            assert tracker.has_changed()
+            return version
+
+        database.get_memory_version = read_then_commit
+        assert tracker.get_version("user_c")['short_term_version'] == 0
+        database.get_memory_version = original_read
+
+        assert not tracker.has_changed()
+        assert tracker.get_version("user_c")['short_term_version'] == 1
+        print("   ✅ 读取期间被清空的缓存不会写回旧版本")
+
+
+def test_memory_room_cache_invalidation():
+    """测试记忆房间缓存在跨进程写入后失效"""
+    print("\n🧪 测试记忆房间缓存失效...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_memory_version"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "memory.sqlite")
+        config = Config(MEMORY_DB_PATH=db_path)
+        room = MemoryRoom(config, "user_b")
+
+        # 1. 填充缓存
+        print("1. 填充缓存...")
+        room.update_long_term_memory({'factual': {'identity': '小明'}})
+        assert room.get_long_term_memory()['factual'] == {'identity': '小明'}
+        assert room.get_memory_stats()['short_term_count'] == 0
+        print("   ✅ 缓存已填充")
+
+        # 2. 返回值被修改不影响缓存
+        print("2. 修改返回值...")
+        room.get_long_term_memory()['factual']['identity'] = '被篡改'
+        assert room.get_long_term_memory()['factual']['identity'] == '小明'
+        print("   ✅ 缓存内容未被调用方修改")
+
+        # 3. 其它进程写入后缓存失效
+        print("3. 其它进程写入...")
+        MemoryDatabase(db_path).update_long_term_memory("user_b", {'factual': {'identity': '小红'}})
+        _write_from_other_process(db_path, "user_b")
+        assert room.get_long_term_memory()['factual'] == {'identity': '小红'}
+        assert room.get_memory_stats()['short_term_count'] == 1
+        print("   ✅ 缓存已失效并重新加载")
+
+
+if __name__ == "__main__":
+    test_version_tracker()
+    test_stale_read_not_cached()
+    test_memory_room_cache_invalidation()
+    print("\n🎉 跨进程缓存失效测试通过！")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+测试LangChain消息对象复用
+验证每轮只为新增消息创建对象，版本变化时缓存失效
+"""
+
+import os
+import sys
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core import LittlePrinceAgent
+from core.llm import LLMInterface
+
+
+def _build_messages(rounds: int, start: int = 0) -> list:
+    """构建包含系统提示词和若干轮对话的消息列表"""
+    messages = [{"role": "system", "content": "你是小王子"}]
+    for i in range(start, start + rounds):
+        messages.append({"role": "user", "content": f"问题{i}"})
+        messages.append({"role": "assistant", "content": f"回答{i}"})
+    return messages
+
+
+def test_message_conversion_cache():
+    """测试消息转换缓存"""
+    print("🧪 测试LangChain消息对象复用...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_message_cache"
+    llm = LLMInterface(Config(LLM_PROVIDER="fake"))
+
+    # 1. 首次转换全部新建
+    print("1. 首次转换...")
+    first = llm._convert_messages(_build_messages(5), "user_a", 1)
+    assert llm.get_conversion_stats() == {'converted': 11, 'reused': 0}
+    print("   ✅ 11条消息全部新建")
+
+    # 2. 新增一轮只新建两条
+    print("2. 追加一轮...")
+    second = llm._convert_messages(_build_messages(6), "user_a", 1)
+    assert llm.get_conversion_stats()['converted'] == 13
+    assert all(a is b for a, b in zip(first, second))
+    print("   ✅ 只为新的一轮创建消息对象")
+
+    # 3. 窗口滑动后按内容复用
+    print("3. 窗口滑动...")
+    third = llm._convert_messages(_build_messages(6, start=1), "user_a", 1)
+    assert llm.get_conversion_stats()['converted'] == 15
+    assert third[1] is second[3]
+    print("   ✅ 错位的消息按内容复用")
+
+    # 4. 版本变化与不同用户互不影响
+    print("4. 版本变化...")
+    llm._convert_messages(_build_messages(6, start=1), "user_a", 2)
+    assert llm.get_conversion_stats()['converted'] == 28
+    llm._convert_messages(_build_messages(1), "user_b", 1)
+    assert llm.get_conversion_stats()['converted'] == 31
+    print("   ✅ 版本变化后重新转换，用户之间隔离")
+
+
+def test_agent_reuses_messages():
+    """测试Agent对话时复用消息对象"""
+    print("\n🧪 测试Agent复用消息对象...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_message_cache"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config(MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"), LLM_PROVIDER="fake")
+        agent = LittlePrinceAgent(config, "user_agent")
+
+        agent.chat("你好")
+        converted_before = agent.llm.get_conversion_stats()['converted']
+        agent.chat("今天天气很好")
+        # 新建：首条系统消息（legacy布局包含每轮变化的记忆统计）、上一轮回复、本轮输入
+        assert agent.llm.get_conversion_stats()['converted'] - converted_before <= 3
+        print("   ✅ 每轮只新建常数个消息对象")
+
+
+if __name__ == "__main__":
+    test_message_conversion_cache()
+    test_agent_reuses_messages()
+    print("\n🎉 消息对象复用测试通过！")
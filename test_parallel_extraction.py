@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+测试按记忆部分并行提取
+验证三个部分并行调用并合并、单个部分超时或失败时保留其它部分，以及token用量合计
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core.llm import LLMInterface
+from core.memory import MemoryUpdateMechanism
+
+
+CONVERSATIONS = [{'user': "我叫小明", 'ai': "你好小明！"}, {'user': "我喜欢玫瑰", 'ai': "玫瑰很美。"}]
+
+
+def _existing():
+    return {
+        'factual': {'interests': '看日落'},
+        'episodic': [{'type': '用户经历', 'content': '第一次见面', 'timestamp': ''}],
+        'semantic': {'values': '珍惜陪伴'}
+    }
+
+
+def _mechanism(tmp_dir: str, slow_sections=(), broken_sections=(), **kwargs):
+    """创建并行模式的记忆更新机制，可让指定部分变慢或输出损坏"""
+    os.environ["LLM_API_KEY"] = "test_key_for_parallel_extraction"
+    config = Config(MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"), LLM_PROVIDER="fake",
+                    MEMORY_UPDATE_MODE="parallel", **kwargs)
+    llm = LLMInterface(config)
+    original_invoke = llm.invoke_json
+
+    def invoke_json(messages, validator):
+        system_text = str(messages[0].content)
+        if any(f"（{section}）" in system_text for section in slow_sections):
+            time.sleep(0.5)
+        if any(f"（{section}）" in system_text for section in broken_sections):
+            validator.feed("不是JSON")
+        return original_invoke(messages, validator)
+
+    llm.invoke_json = invoke_json
+    return MemoryUpdateMechanism(config, llm)
+
+
+def test_parallel_extraction():
+    """测试并行提取并合并"""
+    print("🧪 测试按记忆部分并行提取...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mechanism = _mechanism(tmp_dir)
+        updated = mechanism.update_memory(CONVERSATIONS, _existing())
+
+        assert mechanism.last_error is None and mechanism.last_section_errors == {}
+        assert updated['factual']['identity'] == "小明"
+        assert updated['factual']['preferences'] == "玫瑰"
+        assert updated['factual']['interests'] == "看日落"
+        assert [episode['content'] for episode in updated['episodic']] == ["第一次见面", "与小王子进行了2轮对话"]
+        assert updated['semantic']['values'] == "珍惜陪伴"
+        assert mechanism.last_usage['calls'] == 3
+        assert mechanism.last_usage['input_tokens'] > 0 and mechanism.last_usage['output_tokens'] > 0
+        print(f"   ✅ 三个部分合并完成，token用量: {mechanism.last_usage}")
+
+
+def test_section_timeout_and_failure():
+    """测试单个部分超时或失败时保留其它部分"""
+    print("🧪 测试单个部分超时或失败...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # 1. 情节记忆超时：不等待它，事实记忆照常写入
+        print("1. 部分超时...")
+        mechanism = _mechanism(tmp_dir, slow_sections=("episodic",), MEMORY_SECTION_TIMEOUT_SECONDS=0.2)
+        start = time.perf_counter()
+        updated = mechanism.update_memory(CONVERSATIONS, _existing())
+        elapsed = time.perf_counter() - start
+        assert elapsed < 0.45, f"等待了超时的部分: {elapsed:.2f}s"
+        assert mechanism.last_error is None
+        assert set(mechanism.last_section_errors) == {"episodic"}
+        assert updated['factual']['identity'] == "小明"
+        assert updated['episodic'] == _existing()['episodic']
+        print(f"   ✅ {elapsed * 1000:.0f}ms 内返回，超时的部分保留原有记忆")
+
+        # 2. 语义记忆输出损坏（修复重试后仍失败）
+        print("2. 部分失败...")
+        mechanism = _mechanism(tmp_dir, broken_sections=("semantic",))
+        updated = mechanism.update_memory(CONVERSATIONS, _existing())
+        assert mechanism.last_error is None
+        assert set(mechanism.last_section_errors) == {"semantic"}
+        assert updated['factual']['identity'] == "小明"
+        assert updated['semantic'] == _existing()['semantic']
+        print("   ✅ 失败的部分不影响其它部分")
+
+        # 3. 所有部分都失败时整次更新失败
+        print("3. 全部失败...")
+        mechanism = _mechanism(tmp_dir, broken_sections=("factual", "episodic", "semantic"))
+        updated = mechanism.update_memory(CONVERSATIONS, _existing())
+        assert mechanism.last_error is not None
+        assert updated == _existing()
+        print("   ✅ 全部失败时保留原有记忆并报告错误")
+
+
+if __name__ == "__main__":
+    print("🚀 开始测试按记忆部分并行提取")
+    print("=" * 50)
+
+    try:
+        test_parallel_extraction()
+        test_section_timeout_and_failure()
+        print("\n🎉 所有测试通过！")
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+测试缓存友好的提示词布局
+验证静态内容在前时每轮的稳定前缀，以及提供商缓存命中数的提取
+"""
+
+import os
+import sys
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage
+
+from config import Config
+from core import LittlePrinceAgent
+
+
+def _run_turns(layout: str, db_path: str, turns: int = 3) -> list:
+    """按指定布局对话若干轮，返回每轮的诊断信息"""
+    config = Config(MEMORY_DB_PATH=db_path, PROMPT_LAYOUT=layout, LLM_PROVIDER="openai", LLM_MODEL="gpt-4o-mini")
+    agent = LittlePrinceAgent(config, f"user_{layout}")
+    agent.llm.llm = FakeListChatModel(responses=["你好呀，朋友！"])
+
+    diagnostics = []
+    for i in range(turns):
+        agent.chat(f"第{i}句话")
+        diagnostics.append(agent.get_last_turn_diagnostics())
+    return agent, diagnostics
+
+
+def test_prompt_layout():
+    """测试提示词布局的前缀稳定性"""
+    print("🧪 测试缓存友好的提示词布局...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_prompt_layout"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "memory.sqlite")
+
+        # 1. legacy布局：记忆统计在首条系统消息中，前缀在第一条消息内就被打断
+        print("1. legacy布局...")
+        agent, legacy = _run_turns("legacy", db_path)
+        persona_bytes = len(agent.prompt_manager.get_system_prompt().encode('utf-8'))
+        assert legacy[0]['stable_prefix_bytes'] == 0
+        assert legacy[-1]['stable_prefix_bytes'] < persona_bytes + 100
+        print(f"   ✅ 稳定前缀: {legacy[-1]['stable_prefix_bytes']} 字节")
+
+        # 2. cache_friendly布局：人设和示例对话每轮完全相同
+        print("2. cache_friendly布局...")
+        agent, friendly = _run_turns("cache_friendly", db_path)
+        static_bytes = persona_bytes + sum(
+            len(message['content'].encode('utf-8')) for message in agent.prompt_manager.get_example_messages()
+        )
+        for item in friendly[1:]:
+            assert item['stable_prefix_bytes'] > static_bytes
+        assert friendly[-1]['stable_prefix_bytes'] > legacy[-1]['stable_prefix_bytes']
+        print(f"   ✅ 稳定前缀: {friendly[-1]['stable_prefix_bytes']}/{friendly[-1]['prompt_bytes']} 字节")
+
+
+def test_cache_hit_usage_extraction():
+    """测试从响应中提取提供商缓存命中数"""
+    print("\n🧪 测试缓存命中数提取...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_prompt_layout"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config(MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"), LLM_PROVIDER="openai", LLM_MODEL="gpt-4o-mini")
+        agent = LittlePrinceAgent(config, "user_usage")
+
+    deepseek_response = AIMessage(content="hi", response_metadata={
+        'token_usage': {'prompt_tokens': 1200, 'completion_tokens': 30, 'prompt_cache_hit_tokens': 1024}
+    })
+    assert agent.llm._extract_usage(deepseek_response)['cache_hit_tokens'] == 1024
+
+    openai_response = AIMessage(content="hi", usage_metadata={
+        'input_tokens': 1500, 'output_tokens': 20, 'total_tokens': 1520,
+        'input_token_details': {'cache_read': 1280}
+    })
+    usage = agent.llm._extract_usage(openai_response)
+    assert usage == {'input_tokens': 1500, 'output_tokens': 20, 'cache_hit_tokens': 1280}
+    print("   ✅ DeepSeek与OpenAI的缓存命中字段均可提取")
+
+
+if __name__ == "__main__":
+    test_prompt_layout()
+    test_cache_hit_usage_extraction()
+    print("\n🎉 提示词布局测试通过！")
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+测试LLM配额限流
+验证RPM/TPM令牌桶的等待与用量修正、对话请求优先于后台整合、后台保留余量，以及通过SQLite跨实例共享配额
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core.llm import LLMInterface
+from core.rate_limiter import BACKGROUND, INTERACTIVE, LLMRateLimiter, RateLimitTimeout
+from test_llm_call_policy import MESSAGES, REPLY, MockLLMServer
+
+
+def test_token_buckets():
+    """测试RPM耗尽后等待补充，以及TPM按实际用量多退少补"""
+    print("🧪 测试令牌桶...")
+
+    # 1. RPM：一分钟的配额可以突发使用，耗尽后按配额/60每秒补充
+    print("1. 每分钟请求数...")
+    limiter = LLMRateLimiter(requests_per_minute=120)
+    start = time.perf_counter()
+    for _ in range(120):
+        limiter.acquire(0)
+    assert time.perf_counter() - start < 0.2
+    start = time.perf_counter()
+    limiter.acquire(0)
+    waited = time.perf_counter() - start
+    assert 0.3 <= waited < 1.0, f"等待时间异常: {waited:.2f}s"
+    assert limiter.get_stats()[INTERACTIVE]['waited'] == 1
+    print(f"   ✅ 配额耗尽后等待 {waited * 1000:.0f}ms")
+
+    # 2. TPM：实际用量少于估算时退还差额
+    print("2. 每分钟token数...")
+    limiter = LLMRateLimiter(tokens_per_minute=600)
+    limiter.acquire(500)
+    limiter.record_usage(500, 100)
+    limiter.acquire(400, timeout=0.1)
+    try:
+        limiter.acquire(200, timeout=0.1)
+        assert False, "配额不足时应等待超时"
+    except RateLimitTimeout:
+        pass
+    assert limiter.get_stats()[INTERACTIVE]['timeouts'] == 1
+    print("   ✅ 按实际用量退还，配额不足时等待超时")
+
+
+def test_priority_lanes():
+    """测试对话请求优先于后台请求，以及后台请求的保留余量"""
+    print("🧪 测试优先级通道...")
+
+    # 1. 后台请求先开始等待，对话请求仍先取得配额
+    print("1. 对话请求优先...")
+    limiter = LLMRateLimiter(tokens_per_minute=6000, background_reserve=0.0)
+    limiter.acquire(6000)
+    order = []
+
+    def acquire(priority):
+        limiter.acquire(100, priority)
+        order.append(priority)
+
+    background = threading.Thread(target=acquire, args=(BACKGROUND,))
+    background.start()
+    time.sleep(0.1)
+    interactive = threading.Thread(target=acquire, args=(INTERACTIVE,))
+    interactive.start()
+    background.join(5)
+    interactive.join(5)
+    assert order == [INTERACTIVE, BACKGROUND], f"取得配额的顺序: {order}"
+    print(f"   ✅ 取得配额的顺序: {order}")
+
+    # 2. 后台请求不能用掉为对话保留的配额
+    print("2. 后台保留余量...")
+    limiter = LLMRateLimiter(tokens_per_minute=1000, background_reserve=0.2)
+    limiter.acquire(700, BACKGROUND)
+    try:
+        limiter.acquire(200, BACKGROUND, timeout=0.1)
+        assert False, "后台请求不应使用保留的配额"
+    except RateLimitTimeout:
+        pass
+    limiter.acquire(250, INTERACTIVE, timeout=0.1)
+    stats = limiter.get_stats()
+    assert stats[BACKGROUND]['timeouts'] == 1 and stats[INTERACTIVE]['acquired'] == 1
+    print(f"   ✅ 保留的配额只供对话使用，统计: {stats}")
+
+    # 3. RPM很小时后台通道仍至少有1个完整请求的配额
+    print("3. 低RPM下的后台请求...")
+    limiter = LLMRateLimiter(requests_per_minute=1, background_reserve=0.2)
+    rpm_request = limiter._bucket_requests(0, BACKGROUND)[0]
+    assert rpm_request[1] == 1 and rpm_request[4] == 0, f"后台请求的扣除量与保留量: {rpm_request}"
+    limiter.acquire(0, BACKGROUND, timeout=0.1)
+    try:
+        limiter.acquire(0, INTERACTIVE, timeout=0.1)
+        assert False, "后台请求应扣除完整的1个请求"
+    except RateLimitTimeout:
+        pass
+    assert limiter.get_stats()[BACKGROUND]['acquired'] == 1
+    print("   ✅ RPM=1时后台请求可取得配额并扣除完整的1个请求")
+
+
+def test_shared_sqlite_bucket():
+    """测试同一SQLite文件的多个限流器共享配额（模拟多个进程）"""
+    print("🧪 测试跨进程共享配额...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "rate_limits.sqlite")
+        first = LLMRateLimiter(requests_per_minute=2, db_path=db_path, name="deepseek:shared")
+        second = LLMRateLimiter(requests_per_minute=2, db_path=db_path, name="deepseek:shared")
+        first.acquire(0)
+        second.acquire(0)
+        try:
+            first.acquire(0, timeout=0.1)
+            assert False, "两个实例应共用一份配额"
+        except RateLimitTimeout:
+            pass
+        print("   ✅ 两个实例共用一份配额")
+
+
+def test_async_acquire_off_event_loop():
+    """测试异步取配额时SQLite写锁的等待不阻塞事件循环"""
+    print("🧪 测试异步取配额...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "rate_limits.sqlite")
+        limiter = LLMRateLimiter(requests_per_minute=60, db_path=db_path, name="deepseek:async")
+
+        # 另一个进程持有写事务0.5秒
+        locked = threading.Event()
+
+        def hold_write_lock():
+            conn = sqlite3.connect(db_path, isolation_level=None)
+            conn.execute('BEGIN IMMEDIATE')
+            locked.set()
+            time.sleep(0.5)
+            conn.execute('COMMIT')
+            conn.close()
+
+        holder = threading.Thread(target=hold_write_lock)
+        holder.start()
+        locked.wait(5)
+
+        async def run():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.02)
+                    ticks += 1
+
+            ticker = asyncio.ensure_future(tick())
+            await limiter.aacquire(0)
+            ticker.cancel()
+            return ticks
+
+        ticks = asyncio.run(run())
+        holder.join()
+        assert ticks >= 10, f"等待写锁期间事件循环被阻塞: {ticks}"
+        assert limiter.get_stats()[INTERACTIVE]['acquired'] == 1
+        print(f"   ✅ 等待写锁期间事件循环继续运行（{ticks}次）")
+
+
+def test_per_attempt_quota():
+    """测试重试与对冲请求同样扣除配额，配额不足时不发对冲请求"""
+    print("🧪 测试按请求扣除配额...")
+
+    def llm_for(server, api_key, rpm, **policy):
+        os.environ["LLM_API_KEY"] = api_key
+        return LLMInterface(Config(LLM_PROVIDER="openai", LLM_MODEL="gpt-4o-mini", LLM_BASE_URL=server.base_url,
+                                   LLM_RATE_LIMIT_RPM=rpm, LLM_CALL_RETRY_BASE_SECONDS=0.01,
+                                   LLM_CALL_POLICIES={"openai": policy}))
+
+    # 1. 重试的请求再取一份配额
+    print("1. 重试...")
+    server = MockLLMServer([(0, 503, {})])
+    try:
+        llm = llm_for(server, "test_key_for_retry_quota", 600)
+        assert llm.generate(MESSAGES) == REPLY
+        assert llm.rate_limiter.get_stats()[INTERACTIVE]['acquired'] == 2
+        print("   ✅ 两次请求扣除两份配额")
+    finally:
+        server.close()
+
+    # 2. 对冲请求再取一份配额；配额不足时不发对冲请求
+    print("2. 对冲...")
+    server = MockLLMServer([(0.5, 200, {}), (0, 200, {}), (0.5, 200, {})])
+    try:
+        llm = llm_for(server, "test_key_for_hedge_quota", 600, hedge=True, hedge_delay_seconds=0.1)
+        assert llm.generate(MESSAGES) == REPLY
+        assert llm.get_call_stats()['hedges'] == 1
+        assert llm.rate_limiter.get_stats()[INTERACTIVE]['acquired'] == 2
+
+        llm = llm_for(server, "test_key_for_hedge_no_quota", 1, hedge=True, hedge_delay_seconds=0.1)
+        assert llm.generate(MESSAGES) == REPLY
+        stats = llm.get_call_stats()
+        assert stats['hedges'] == 0 and stats['hedges_skipped'] == 1
+        assert llm.rate_limiter.get_stats()[INTERACTIVE]['acquired'] == 1
+        print(f"   ✅ 对冲请求扣除配额，配额不足时跳过，统计: {stats}")
+    finally:
+        server.close()
+
+
+def test_llm_interface_rate_limit():
+    """测试LLM接口共享限流器，对话与记忆整合分别使用对应的通道"""
+    print("🧪 测试LLM接口限流...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_rate_limiter"
+    config = Config(LLM_PROVIDER="fake", LLM_RATE_LIMIT_RPM=600, LLM_RATE_LIMIT_TPM=60000)
+    chat_llm = LLMInterface(config)
+    memory_llm = LLMInterface(config)
+    assert chat_llm.rate_limiter is memory_llm.rate_limiter
+
+    before = chat_llm.rate_limiter.get_stats()
+    chat_llm.generate([{"role": "user", "content": "你好"}])
+    memory_llm.invoke_direct(memory_llm._convert_messages([{"role": "user", "content": "总结一下"}]))
+    stats = chat_llm.rate_limiter.get_stats()
+    assert stats[INTERACTIVE]['acquired'] == before[INTERACTIVE]['acquired'] + 1
+    assert stats[BACKGROUND]['acquired'] == before[BACKGROUND]['acquired'] + 1
+    print(f"   ✅ 同一提供商与密钥共享限流器，统计: {stats}")
+
+    # 未配置限额时不限流
+    assert LLMInterface(Config(LLM_PROVIDER="fake")).rate_limiter is None
+    print("   ✅ 未配置限额时不限流")
+
+
+if __name__ == "__main__":
+    print("🚀 开始测试LLM配额限流")
+    print("=" * 50)
+
+    try:
+        test_token_buckets()
+        test_priority_lanes()
+        test_shared_sqlite_bucket()
+        test_async_acquire_off_event_loop()
+        test_per_attempt_quota()
+        test_llm_interface_rate_limit()
+        print("\n🎉 所有测试通过！")
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
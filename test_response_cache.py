@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+测试LLM回复精确匹配缓存
+验证相同请求复用回复且照常写入记忆、按Prompt启用、持久化、有效期与容量淘汰，以及命中统计
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core import LittlePrinceAgent
+from core.memory.memory_database import MemoryDatabase
+from core.response_cache import ResponseCache
+
+
+def _config(tmp_dir: str, **kwargs) -> Config:
+    os.environ["LLM_API_KEY"] = "test_key_for_response_cache"
+    return Config(MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"), LLM_PROVIDER="fake",
+                  RESPONSE_CACHE=True, **kwargs)
+
+
+def test_response_cache_hit():
+    """测试相同请求命中缓存"""
+    print("🧪 测试LLM回复缓存...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = _config(tmp_dir)
+
+        # 1. 首次请求调用LLM并写入缓存
+        print("1. 首次请求...")
+        first_agent = LittlePrinceAgent(config, "user_first")
+        reply = first_agent.chat("你好")
+        assert first_agent.llm.llm.call_count == 1
+        assert not first_agent.get_last_turn_diagnostics()['response_cache_hit']
+        print("   ✅ 调用LLM一次")
+
+        # 2. 另一个新用户发送完全相同的请求：不调用LLM，记忆照常写入
+        print("2. 相同请求...")
+        second_agent = LittlePrinceAgent(config, "user_second")
+        assert second_agent.chat("你好") == reply
+        assert second_agent.llm.llm.call_count == 0
+        assert second_agent.get_last_turn_diagnostics()['response_cache_hit']
+        assert second_agent.memory_room.get_short_term_memory()[-1]['ai'] == reply
+        stats = second_agent.get_response_cache_stats()
+        assert stats['hits'] == 1 and stats['memory_hits'] == 0
+        assert stats['saved_input_tokens'] > 0 and stats['saved_output_tokens'] > 0
+        print(f"   ✅ 命中缓存（从数据库读取），统计: {stats}")
+
+        # 3. 流式请求命中时整段返回
+        print("3. 流式请求...")
+        third_agent = LittlePrinceAgent(config, "user_third")
+        assert list(third_agent.chat_stream("你好")) == [reply]
+        assert third_agent.llm.llm.call_count == 0
+        print("   ✅ 流式请求同样命中")
+
+        # 4. 历史不同的请求不会命中
+        print("4. 不同请求...")
+        first_agent.chat("你好")
+        assert first_agent.llm.llm.call_count == 2
+        print("   ✅ 上下文不同时重新调用LLM")
+
+
+def test_response_cache_prompt_flag():
+    """测试按Prompt名称启用缓存"""
+    print("🧪 测试按Prompt启用回复缓存...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = _config(tmp_dir, RESPONSE_CACHE_PROMPTS=["little_prince_v1"])
+        agent = LittlePrinceAgent(config, "user_prompt_a")
+        assert not agent.use_response_cache()
+        agent.chat("你好")
+
+        other = LittlePrinceAgent(config, "user_prompt_b")
+        other.chat("你好")
+        assert other.llm.llm.call_count == 1
+        assert agent.get_response_cache_stats()['hits'] == 0
+
+        other.set_prompt("little_prince_v1")
+        assert other.use_response_cache()
+        print("   ✅ 只有列出的Prompt使用缓存")
+
+
+def test_response_cache_eviction():
+    """测试有效期、进程内LRU与数据库容量淘汰"""
+    print("🧪 测试回复缓存淘汰...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database = MemoryDatabase(os.path.join(tmp_dir, "memory.sqlite"))
+        usage = {'input_tokens': 10, 'output_tokens': 5}
+
+        # 1. 进程内只保留最近使用的条目，数据库中超过上限时淘汰最久未使用的条目
+        print("1. 容量上限...")
+        cache = ResponseCache(database, max_entries=2, memory_entries=1)
+        cache.put("a", "回复a", usage, 100.0)
+        cache.put("b", "回复b", usage, 100.0)
+        assert cache.get_stats()['memory_entries'] == 1
+        time.sleep(0.01)
+        assert cache.get("a")['response'] == "回复a"
+        assert cache.get_stats()['memory_hits'] == 0
+        cache.put("c", "回复c", usage, 100.0)
+        assert cache.get("b") is None
+        assert cache.get("c")['response'] == "回复c"
+        stats = cache.get_stats()
+        assert stats['memory_hits'] == 1 and stats['saved_latency_ms'] == 200.0
+        print("   ✅ 淘汰最久未使用的条目")
+
+        # 2. 过期条目不再命中
+        print("2. 有效期...")
+        expiring = ResponseCache(database, ttl_seconds=0.05)
+        expiring.put("d", "回复d", usage, 100.0)
+        assert expiring.get("d") is not None
+        time.sleep(0.06)
+        assert expiring.get("d") is None
+        assert ResponseCache(database, ttl_seconds=0.05).get("d") is None
+        print("   ✅ 过期条目不再命中")
+
+
+if __name__ == "__main__":
+    print("🚀 开始测试LLM回复缓存")
+    print("=" * 50)
+
+    try:
+        test_response_cache_hit()
+        test_response_cache_prompt_flag()
+        test_response_cache_eviction()
+        print("\n🎉 所有测试通过！")
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
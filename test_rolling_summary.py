@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+测试滚动对话摘要
+验证滑出短期记忆窗口的对话被增量并入摘要，并以摘要代替原文进入上下文
+"""
+
+import os
+import sys
+import tempfile
+import threading
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core import LittlePrinceAgent
+
+
+def test_rolling_summary():
+    """测试滚动对话摘要"""
+    print("🧪 测试滚动对话摘要...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_rolling_summary"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config(
+            MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"),
+            LLM_PROVIDER="fake",
+            SHORT_TERM_MAX_ROUNDS=3,
+            MEMORY_UPDATE_INTERVAL=100
+        )
+        agent = LittlePrinceAgent(config, "user_summary")
+
+        # 记录发送给摘要调用的对话
+        summarized_batches = []
+        original_update = agent.memory_update_mechanism.update_rolling_summary
+
+        def recording_update(overflow_turns):
+            summarized_batches.append([turn['user'] for turn in overflow_turns])
+            return original_update(overflow_turns)
+
+        agent.memory_update_mechanism.update_rolling_summary = recording_update
+
+        # 1. 窗口内不生成摘要
+        print("1. 窗口内对话...")
+        for i in range(3):
+            agent.chat(f"第{i}句话")
+        assert summarized_batches == []
+        assert agent.memory_room.get_conversation_summary() == ""
+        print("   ✅ 未超出窗口时不调用摘要")
+
+        # 2. 超出窗口后只发送滑出的对话（摘要在后台生成）
+        print("2. 超出窗口...")
+        agent.chat("第3句话")
+        agent.consolidation_worker.wait_idle("user_summary")
+        agent.chat("第4句话")
+        agent.consolidation_worker.wait_idle("user_summary")
+        assert summarized_batches == [["第0句话"], ["第1句话"]]
+        assert agent.get_memory_stats()['short_term_count'] == 3
+        summary = agent.memory_room.get_conversation_summary()
+        assert "第0句话" in summary and "第1句话" in summary
+        print(f"   ✅ 摘要增量更新: {summary}")
+
+        # 3. 上下文使用摘要代替原文
+        print("3. 上下文...")
+        context = agent.memory_interaction.get_context(agent.memory_room)
+        assert context[0] == {"role": "system", "content": f"此前对话摘要：\n{summary}"}
+        assert [m['content'] for m in context if m['role'] == 'user'] == ["第2句话", "第3句话", "第4句话"]
+        agent.chat("第5句话")
+        assert agent.context_assembler.last_report['summary_included']
+        print("   ✅ 摘要进入上下文，旧对话原文不再发送")
+
+        # 4. 回复不等待摘要调用，摘要生成期间沿用已有摘要
+        print("4. 后台生成摘要...")
+        agent.consolidation_worker.wait_idle("user_summary")
+        summary = agent.memory_room.get_conversation_summary()
+        started = threading.Event()
+        release = threading.Event()
+
+        def blocking_update(overflow_turns):
+            started.set()
+            release.wait(5)
+            return recording_update(overflow_turns)
+
+        agent.memory_update_mechanism.update_rolling_summary = blocking_update
+        agent.chat("第6句话")
+        assert started.wait(5)
+        assert agent.memory_room.get_conversation_summary() == summary
+        agent.chat("第7句话")
+        assert agent.context_assembler.last_report['summary_included']
+        release.set()
+        agent.consolidation_worker.wait_idle("user_summary")
+        # 摘要生成期间滑出窗口的对话不会被提前清理，由下一个任务并入摘要
+        assert summarized_batches[-2:] == [["第3句话"], ["第4句话"]]
+        assert agent.get_memory_stats()['short_term_count'] == 3
+        assert "第4句话" in agent.memory_room.get_conversation_summary()
+        print("   ✅ 摘要调用不阻塞回复，只清理已并入摘要的对话")
+
+        # 5. 记忆整合时摘要一并分析并清空
+        print("5. 记忆整合...")
+        agent.execute_memory_update()
+        assert agent.memory_room.get_conversation_summary() == ""
+        assert agent.get_memory_stats()['short_term_count'] == 0
+        print("   ✅ 整合后摘要已清空")
+
+
+if __name__ == "__main__":
+    test_rolling_summary()
+    print("\n🎉 滚动对话摘要测试通过！")
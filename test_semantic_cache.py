@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+测试LLM回复语义缓存
+验证措辞相近的输入复用回复、含长期记忆的回复不跨用户复用，以及容量上限淘汰
+"""
+
+import os
+import sys
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core import LittlePrinceAgent
+from core.semantic_cache import SemanticResponseCache, get_semantic_cache
+
+
+MEMORY = {'factual': {'identity': '小明'}, 'episodic': [], 'semantic': {}}
+
+
+def _config(tmp_dir: str, **kwargs) -> Config:
+    os.environ["LLM_API_KEY"] = "test_key_for_semantic_cache"
+    # 语义缓存在进程内共享，每个测试从空缓存开始
+    get_semantic_cache().clear()
+    return Config(MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"), LLM_PROVIDER="fake",
+                  SEMANTIC_CACHE=True, **kwargs)
+
+
+def test_semantic_cache_hit():
+    """测试措辞相近的输入命中缓存"""
+    print("🧪 测试LLM回复语义缓存...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = _config(tmp_dir)
+
+        # 1. 首次请求调用LLM
+        print("1. 首次请求...")
+        first_agent = LittlePrinceAgent(config, "user_first")
+        reply = first_agent.chat("你好")
+        assert first_agent.llm.llm.call_count == 1
+        print("   ✅ 调用LLM一次")
+
+        # 2. 另一个新用户换一种说法：复用回复，记忆照常写入
+        print("2. 相近的说法...")
+        second_agent = LittlePrinceAgent(config, "user_second")
+        assert second_agent.chat("你好呀！") == reply
+        assert second_agent.llm.llm.call_count == 0
+        assert second_agent.get_last_turn_diagnostics()['semantic_cache_hit']
+        assert second_agent.memory_room.get_short_term_memory()[-1]['ai'] == reply
+        stats = second_agent.get_response_cache_stats()['semantic']
+        assert stats['hits'] == 1 and stats['saved_output_tokens'] > 0
+        print(f"   ✅ 命中语义缓存，统计: {stats}")
+
+        # 3. 内容不同的输入不会命中
+        print("3. 不同的输入...")
+        third_agent = LittlePrinceAgent(config, "user_third")
+        third_agent.chat("给我讲讲狐狸的故事")
+        assert third_agent.llm.llm.call_count == 1
+        print("   ✅ 内容不同时调用LLM")
+
+
+def test_semantic_cache_user_isolation():
+    """测试长期记忆非空或按用户隔离时不跨用户复用"""
+    print("🧪 测试语义缓存的用户隔离...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # 1. 两个用户的长期记忆完全相同，提示词一致，仍不共享回复
+        print("1. 长期记忆非空...")
+        config = _config(tmp_dir)
+        agents = []
+        for user_id in ("user_memory_a", "user_memory_b"):
+            agent = LittlePrinceAgent(config, user_id)
+            agent.memory_room.database.update_long_term_memory(user_id, MEMORY)
+            agents.append(agent)
+        assert agents[0].semantic_cache_scope() != agents[1].semantic_cache_scope()
+        agents[0].chat("你好")
+        agents[1].chat("你好")
+        assert agents[1].llm.llm.call_count == 1
+        print("   ✅ 含长期记忆的回复不跨用户复用")
+
+        # 2. 同一用户重复相近的问题（上下文相同）时命中
+        agents[0].memory_room.clear_short_term_memory()
+        agents[0].chat("你好啊")
+        assert agents[0].llm.llm.call_count == 1
+        print("   ✅ 同一用户内照常复用")
+
+        # 3. 按用户隔离
+        print("2. 按用户隔离...")
+        config = _config(tmp_dir, SEMANTIC_CACHE_PER_USER=True)
+        first = LittlePrinceAgent(config, "user_isolated_a")
+        second = LittlePrinceAgent(config, "user_isolated_b")
+        first.chat("你好")
+        second.chat("你好")
+        assert second.llm.llm.call_count == 1
+        print("   ✅ 启用按用户隔离时不跨用户复用")
+
+
+def test_semantic_cache_eviction():
+    """测试容量上限淘汰"""
+    print("🧪 测试语义缓存淘汰...")
+
+    usage = {'input_tokens': 10, 'output_tokens': 5}
+    cache = SemanticResponseCache(threshold=0.9, max_entries=2)
+    cache.add("scope", "ctx", "你好", "回复1", usage, 100.0)
+    cache.add("scope", "ctx", "给我讲讲狐狸", "回复2", usage, 100.0)
+    assert cache.lookup("scope", "ctx", "你好呀")['response'] == "回复1"
+    cache.add("scope", "ctx", "今天天气不错", "回复3", usage, 100.0)
+
+    assert cache.lookup("scope", "ctx", "给我讲讲狐狸") is None
+    assert cache.lookup("scope", "ctx", "你好")['response'] == "回复1"
+    assert cache.lookup("other", "ctx", "你好") is None
+    assert cache.lookup("scope", "other", "你好") is None
+    stats = cache.get_stats()
+    assert stats['entries'] == 2 and stats['evictions'] == 1
+    print("   ✅ 淘汰最久未使用的条目，作用域和上下文不同时不命中")
+
+
+if __name__ == "__main__":
+    print("🚀 开始测试LLM回复语义缓存")
+    print("=" * 50)
+
+    try:
+        test_semantic_cache_hit()
+        test_semantic_cache_user_isolation()
+        test_semantic_cache_eviction()
+        print("\n🎉 所有测试通过！")
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
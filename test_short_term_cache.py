@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+测试短期记忆尾部缓存
+验证稳定状态下的对话轮次不会从数据库读取短期记忆
+"""
+
+import os
+import sys
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core.memory import MemoryRoom
+from core.memory.memory_database import MemoryDatabase
+
+
+class _CountingDatabase(MemoryDatabase):
+    """统计短期记忆查询次数的数据库"""
+
+    def __init__(self, db_path: str):
+        super().__init__(db_path)
+        self.short_term_reads = 0
+
+    def get_short_term_memory(self, user_id, limit=None):
+        self.short_term_reads += 1
+        return super().get_short_term_memory(user_id, limit)
+
+
+def test_short_term_tail_cache():
+    """测试短期记忆尾部缓存"""
+    print("🧪 测试短期记忆尾部缓存...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_short_term_cache"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "memory.sqlite")
+        config = Config(MEMORY_DB_PATH=db_path, SHORT_TERM_MAX_ROUNDS=3)
+        room = MemoryRoom(config, "user_tail")
+        room.database = _CountingDatabase(db_path)
+        room.version_tracker.database = room.database
+
+        # 1. 首次访问回源数据库
+        print("1. 首次访问...")
+        assert room.get_short_term_memory() == []
+        assert room.database.short_term_reads == 1
+        print("   ✅ 首次访问从数据库填充缓存")
+
+        # 2. 稳定状态的对话轮次不读取数据库
+        print("2. 连续对话...")
+        for i in range(5):
+            room.add_conversation(f"问题{i}", f"回答{i}")
+            memories = room.get_short_term_memory()
+        assert room.database.short_term_reads == 1
+        assert [m['user'] for m in memories] == ["问题2", "问题3", "问题4"]
+        assert memories == room.database.get_short_term_memory("user_tail", limit=3)
+        print("   ✅ 5轮对话均命中缓存，且与数据库内容一致")
+
+        # 3. 其它进程写入后回源
+        print("3. 其它进程写入...")
+        MemoryDatabase(db_path).add_short_term_memory("user_tail", "外部问题", "外部回答")
+        reads_before = room.database.short_term_reads
+        memories = room.get_short_term_memory()
+        assert room.database.short_term_reads == reads_before + 1
+        assert memories[-1]['user'] == "外部问题"
+        print("   ✅ 版本变化后重新从数据库加载")
+
+        # 4. 清理与清空同步更新缓存
+        print("4. 清理与清空...")
+        room.cleanup_short_term_memory_if_needed()
+        memories = room.get_short_term_memory()
+        assert [m['user'] for m in memories] == ["问题3", "问题4", "外部问题"]
+        room.clear_short_term_memory()
+        reads_before = room.database.short_term_reads
+        assert room.get_short_term_memory() == []
+        assert room.database.short_term_reads == reads_before
+        print("   ✅ 清理与清空后缓存保持一致")
+
+
+if __name__ == "__main__":
+    test_short_term_tail_cache()
+    print("\n🎉 短期记忆尾部缓存测试通过！")
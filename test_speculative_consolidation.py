@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+测试推测整合
+验证批次将满时提前分析、触发时直接提交暂存结果，以及推测期间记忆变化时重新分析
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core import LittlePrinceAgent
+
+
+def _agent(tmp_dir: str, user_id: str):
+    """创建启用推测整合的Agent，并统计记忆分析调用次数"""
+    os.environ["LLM_API_KEY"] = "test_key_for_speculative_consolidation"
+    config = Config(
+        MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"),
+        LLM_PROVIDER="fake",
+        MEMORY_UPDATE_INTERVAL=3,
+        MEMORY_UPDATE_BACKGROUND=True,
+        MEMORY_SPECULATIVE_ROUNDS=1,
+        MEMORY_ANALYSIS_CACHE=False
+    )
+    agent = LittlePrinceAgent(config, user_id)
+    analysis_calls = []
+    original_invoke = agent.llm.invoke_json
+
+    def invoke_json(messages, validator):
+        analysis_calls.append(messages)
+        return original_invoke(messages, validator)
+
+    agent.llm.invoke_json = invoke_json
+    return agent, analysis_calls
+
+
+def test_speculative_consolidation():
+    """测试触发时直接提交推测结果"""
+    print("🧪 测试推测整合...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        agent, analysis_calls = _agent(tmp_dir, "user_speculative")
+
+        # 1. 第2轮（距触发还差1轮）开始后台分析，结果只暂存
+        print("1. 提前分析...")
+        agent.chat("我叫小明")
+        agent.chat("我喜欢玫瑰")
+        assert agent.consolidation_worker.wait_idle("user_speculative", timeout=10)
+        assert len(analysis_calls) == 1
+        assert agent.memory_room.get_long_term_memory()['factual'].get('identity', '') == ""
+        print("   ✅ 推测分析完成，尚未提交")
+
+        # 2. 第3轮触发整合：不再调用LLM，直接提交，第3轮的对话留到下一批
+        print("2. 触发整合...")
+        agent.chat("今天天气不错")
+        assert agent.consolidation_worker.wait_idle("user_speculative", timeout=10)
+        assert len(analysis_calls) == 1
+        assert agent.memory_room.get_long_term_memory()['factual']['identity'] == "小明"
+        assert agent.get_memory_stats()['short_term_count'] == 1
+        assert agent.memory_room.get_consolidation_state()['round_counter'] == 1
+        print("   ✅ 直接提交推测结果，新对话继续累计")
+
+
+def test_trigger_while_speculating():
+    """测试推测分析尚未完成时到达触发轮：整合排在推测之后并使用其结果"""
+    print("🧪 测试推测进行中触发整合...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        agent, _ = _agent(tmp_dir, "user_racing")
+        # 记忆分析使用单独的慢速LLM，对话回复不受影响
+        slow_llm = type(agent.llm)(agent.config)
+        slow_llm.llm.latency = 0.3
+        analysis_calls = []
+        original_invoke = slow_llm.invoke_json
+
+        def invoke_json(messages, validator):
+            analysis_calls.append(messages)
+            return original_invoke(messages, validator)
+
+        slow_llm.invoke_json = invoke_json
+        agent.memory_update_mechanism.llm = slow_llm
+
+        agent.chat("我叫小明")
+        agent.chat("我喜欢玫瑰")
+        # 等推测读取这批对话并开始分析后再到达触发轮
+        for _ in range(100):
+            if analysis_calls:
+                break
+            time.sleep(0.01)
+        agent.chat("今天天气不错")
+        assert agent.consolidation_worker.wait_idle("user_racing", timeout=10)
+        assert len(analysis_calls) == 1
+        assert agent.memory_room.get_long_term_memory()['factual']['identity'] == "小明"
+        assert agent.get_memory_stats()['short_term_count'] == 1
+        print("   ✅ 触发的整合等待推测完成后直接提交")
+
+
+def test_speculation_discarded_on_change():
+    """测试推测期间长期记忆变化时重新分析"""
+    print("🧪 测试推测结果作废...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        agent, analysis_calls = _agent(tmp_dir, "user_changed")
+        agent.chat("我叫小明")
+        agent.chat("我喜欢玫瑰")
+        assert agent.consolidation_worker.wait_idle("user_changed", timeout=10)
+        assert len(analysis_calls) == 1
+
+        # 推测之后长期记忆被其它途径修改
+        agent.memory_room.database.update_long_term_memory("user_changed", {
+            'factual': {'interests': '看日落'}, 'episodic': [], 'semantic': {}
+        })
+
+        agent.chat("今天天气不错")
+        assert agent.consolidation_worker.wait_idle("user_changed", timeout=10)
+        assert len(analysis_calls) == 2
+        memory = agent.memory_room.get_long_term_memory()
+        assert memory['factual']['identity'] == "小明" and memory['factual']['interests'] == "看日落"
+        assert agent.get_memory_stats()['short_term_count'] == 0
+        print("   ✅ 记忆变化后按常规重新分析整批对话")
+
+
+def test_stale_speculation_dropped():
+    """测试推测分析完成前暂存位已被取走时，迟到的结果不会写回"""
+    print("🧪 测试迟到的推测结果...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        agent, analysis_calls = _agent(tmp_dir, "user_stale")
+        agent.llm.llm.latency = 0.3
+        agent.chat("我叫小明")
+        agent.chat("我喜欢玫瑰")
+        assert agent._speculation['state'] == 'running'
+
+        # 分析进行中暂存位被取走（整合开始或切换用户），推测结果随后才完成
+        assert agent._take_speculation(agent.memory_room.get_unconsolidated_memory(), "") is None
+        assert agent.consolidation_worker.wait_idle("user_stale", timeout=10)
+        assert len(analysis_calls) == 1
+        assert agent._speculation is None
+        print("   ✅ 迟到的推测结果已丢弃，下一批按常规分析")
+
+
+
+def test_failed_speculation_not_repeated():
+    """测试推测分析失败后，同一批对话不再推测，触发时按常规整合"""
+    print("🧪 测试推测失败...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        agent, analysis_calls = _agent(tmp_dir, "user_failed")
+        counting_invoke = agent.llm.invoke_json
+        failing = [True]
+
+        def invoke_json(messages, validator):
+            if failing[0]:
+                analysis_calls.append(messages)
+                raise RuntimeError("分析服务不可用")
+            return counting_invoke(messages, validator)
+
+        agent.llm.invoke_json = invoke_json
+        agent.chat("我叫小明")
+        agent.chat("我喜欢玫瑰")
+        assert agent.consolidation_worker.wait_idle("user_failed", timeout=10)
+        assert len(analysis_calls) == 1
+        assert agent._speculation['state'] == 'failed'
+
+        # 失败状态留在暂存位：不再提交推测
+        assert agent.start_speculative_consolidation() is False
+
+        # 暂存位被取走后，同一批对话也不再调用分析
+        assert agent._take_speculation(agent.memory_room.get_unconsolidated_memory(), "") is None
+        assert agent.start_speculative_consolidation() is True
+        assert agent.consolidation_worker.wait_idle("user_failed", timeout=10)
+        assert len(analysis_calls) == 1
+        print("   ✅ 同一批对话不再重复推测")
+
+        # 触发整合按常规分析并提交
+        failing[0] = False
+        agent.chat("今天天气不错")
+        assert agent.consolidation_worker.wait_idle("user_failed", timeout=10)
+        assert len(analysis_calls) == 2
+        assert agent.memory_room.get_long_term_memory()['factual']['identity'] == "小明"
+        print("   ✅ 触发时按常规整合")
+
+
+if __name__ == "__main__":
+    print("🚀 开始测试推测整合")
+    print("=" * 50)
+
+    try:
+        test_speculative_consolidation()
+        test_trigger_while_speculating()
+        test_speculation_discarded_on_change()
+        test_stale_speculation_dropped()
+        test_failed_speculation_not_repeated()
+        print("\n🎉 所有测试通过！")
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
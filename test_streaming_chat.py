@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+测试流式对话
+验证回复逐块输出、流结束后才写入记忆并检查整合，以及首token时间的记录
+"""
+
+import os
+import sys
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core import LittlePrinceAgent
+
+
+def _agent(tmp_dir: str, user_id: str, **kwargs):
+    """创建使用本地模拟LLM的Agent"""
+    os.environ["LLM_API_KEY"] = "test_key_for_streaming_chat"
+    config = Config(MEMORY_DB_PATH=os.path.join(tmp_dir, "memory.sqlite"), LLM_PROVIDER="fake", **kwargs)
+    return LittlePrinceAgent(config, user_id)
+
+
+def test_chat_stream():
+    """测试流式回复与流结束后的记忆写入"""
+    print("🧪 测试流式对话...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        agent = _agent(tmp_dir, "user_stream", MEMORY_UPDATE_INTERVAL=2, MEMORY_UPDATE_BACKGROUND=False)
+        agent.llm.llm.latency_per_output_token = 0.01
+
+        # 1. 回复逐块输出，输出过程中尚未写入短期记忆
+        print("1. 逐块输出...")
+        chunks = []
+        for chunk in agent.chat_stream("我叫小明"):
+            if not chunks:
+                assert agent.get_memory_stats()['short_term_count'] == 0
+            chunks.append(chunk)
+        assert len(chunks) > 1
+        reply = "".join(chunks)
+        last_turn = agent.memory_room.get_short_term_memory()[-1]
+        assert last_turn['user'] == "我叫小明" and last_turn['ai'] == reply
+        print(f"   ✅ 共 {len(chunks)} 块，流结束后写入短期记忆")
+
+        # 2. 首token时间早于完整回复
+        print("2. 首token时间...")
+        diagnostics = agent.get_last_turn_diagnostics()
+        assert diagnostics['first_token_ms'] is not None
+        assert diagnostics['first_token_ms'] < agent.llm.last_usage['total_ms']
+        assert diagnostics['input_tokens'] > 0
+        print(f"   ✅ 首token {diagnostics['first_token_ms']:.0f}ms / 总耗时 {agent.llm.last_usage['total_ms']:.0f}ms")
+
+        # 3. 流结束后照常检查整合
+        print("3. 整合检查...")
+        "".join(agent.chat_stream("我喜欢玫瑰"))
+        memory = agent.memory_room.get_long_term_memory()
+        assert memory['factual']['identity'] == "小明"
+        assert agent.memory_room.get_consolidation_state()['round_counter'] == 0
+        print("   ✅ 达到整合轮数后写入长期记忆")
+
+
+def test_chat_stream_abandoned():
+    """测试调用方提前停止时不写入记忆"""
+    print("🧪 测试提前停止的流式对话...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        agent = _agent(tmp_dir, "user_abandoned")
+        stream = agent.chat_stream("我叫小明")
+        next(stream)
+        stream.close()
+        assert agent.get_memory_stats()['short_term_count'] == 0
+        assert agent.memory_room.get_consolidation_state()['round_counter'] == 0
+        print("   ✅ 未完成的回复不写入短期记忆")
+
+
+if __name__ == "__main__":
+    print("🚀 开始测试流式对话")
+    print("=" * 50)
+
+    try:
+        test_chat_stream()
+        test_chat_stream_abandoned()
+        print("\n🎉 所有测试通过！")
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+测试记忆分析的结构化输出
+验证流式JSON校验在输出损坏时提前中止、格式校验，以及修复重试
+"""
+
+import json
+import os
+import sys
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from core.fake_llm import FakeChatModel
+from core.llm import LLMInterface
+from core.memory import MemoryUpdateMechanism
+from core.memory.structured_output import (
+    MEMORY_ANALYSIS_SCHEMA, StreamingJSONValidator, StructuredOutputError, validate_memory_analysis
+)
+
+
+def _expect_error(chunks, message):
+    """逐块输入，断言在某一块上抛出包含message的错误，返回出错前已接收的块数"""
+    validator = StreamingJSONValidator(MEMORY_ANALYSIS_SCHEMA)
+    for index, chunk in enumerate(chunks):
+        try:
+            validator.feed(chunk)
+        except StructuredOutputError as e:
+            assert message in str(e), str(e)
+            return index
+    try:
+        validator.close()
+    except StructuredOutputError as e:
+        assert message in str(e), str(e)
+        return len(chunks)
+    raise AssertionError("未检测到错误")
+
+
+def test_streaming_validator():
+    """测试流式JSON校验"""
+    print("🧪 测试流式JSON校验...")
+
+    # 1. 合法输出（允许代码块标记）
+    print("1. 合法输出...")
+    validator = StreamingJSONValidator(MEMORY_ANALYSIS_SCHEMA)
+    text = '```json\n{"factual": {"identity": "小明 \\"明明\\""}, "episodic": [{"content": "看日落 {}"}], "semantic": {}}\n```'
+    for start in range(0, len(text), 5):
+        validator.feed(text[start:start + 5])
+    assert validator.close()['factual']['identity'] == '小明 "明明"'
+    print("   ✅ 分块输入解析成功")
+
+    # 2. 损坏的流在出问题的块上立即中止
+    print("2. 提前中止...")
+    assert _expect_error(["抱歉，", "我无法", "完成"], "不是以JSON对象开头") == 0
+    assert _expect_error(['{"factual": {}, ', '"summary": ', '"..."', '}'], "未知字段: summary") == 1
+    assert _expect_error(['{"episodic": ', '{"type": ""}', '}'], "episodic 应为 array") == 1
+    assert _expect_error(['{"factual": {"identity": "a"]', '}'], "括号不匹配") == 0
+    assert _expect_error(['{"factual": {}}', ' 以上是分析结果'], "多余内容") == 1
+    assert _expect_error(['{"factual": {"identity": "小'], "JSON不完整") == 1
+    print("   ✅ 损坏的输出在到达时即被发现")
+
+    # 3. 解析后的格式校验
+    print("3. 格式校验...")
+    result = validate_memory_analysis({"factual": {"interests": ["看星星", "画画"], "unknown": "x"}})
+    assert result['factual']['interests'] == "看星星、画画"
+    assert "unknown" not in result['factual'] and result['episodic'] == []
+    try:
+        validate_memory_analysis({"episodic": ["只有字符串"]})
+        raise AssertionError("应当校验失败")
+    except StructuredOutputError as e:
+        assert "episodic[0]" in str(e)
+    print("   ✅ 格式校验通过")
+
+
+class _BrokenThenValidModel(FakeChatModel):
+    """第一次记忆分析返回损坏的输出，之后按正常逻辑返回"""
+
+    broken_outputs: list = []
+    seen_messages: list = []
+
+    def _respond(self, messages):
+        self.seen_messages.append(messages)
+        content, input_tokens, output_tokens = super()._respond(messages)
+        if self.broken_outputs:
+            content = self.broken_outputs.pop(0)
+        return content, input_tokens, output_tokens
+
+
+def test_repair_retry():
+    """测试输出损坏时的一次修复重试"""
+    print("\n🧪 测试修复重试...")
+
+    os.environ["LLM_API_KEY"] = "test_key_for_structured_output"
+    config = Config(LLM_PROVIDER="fake")
+    llm = LLMInterface(config)
+    turns = [{'user': '我叫小明', 'ai': '你好呀！'}]
+
+    # 1. 第一次损坏，修复后成功
+    print("1. 修复成功...")
+    llm.llm = _BrokenThenValidModel(broken_outputs=['{"factual": {"identity": "小明"}, "note": "多余字段"}'],
+                                    seen_messages=[])
+    mechanism = MemoryUpdateMechanism(config, llm)
+    memory = mechanism.update_memory(turns, {'factual': {}, 'episodic': [], 'semantic': {}})
+    assert mechanism.last_error is None
+    assert memory['factual']['identity'] == "小明"
+    assert len(llm.llm.seen_messages) == 2
+    repair_request = llm.llm.seen_messages[1][-1].content
+    assert "未知字段: note" in repair_request
+    print("   ✅ 修复请求包含具体错误，重试后解析成功")
+
+    # 2. 修复后仍然失败：保留原记忆并记录错误，不静默返回空结构
+    print("2. 修复失败...")
+    llm.llm = _BrokenThenValidModel(broken_outputs=["不是JSON", "还是不是JSON"], seen_messages=[])
+    existing = {'factual': {'identity': '小红'}, 'episodic': [], 'semantic': {}}
+    memory = mechanism.update_memory(turns, existing)
+    assert memory == existing
+    assert "修复重试后" in mechanism.last_error
+    assert len(llm.llm.seen_messages) == 2
+    print(f"   ✅ 错误已记录: {mechanism.last_error}")
+
+
+if __name__ == "__main__":
+    test_streaming_validator()
+    test_repair_retry()
+    print("\n🎉 结构化输出测试通过！")
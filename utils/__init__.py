@@ -1,3 +1,4 @@
 from .logger import setup_logger
+from .token_counter import count_tokens, count_messages_tokens, count_conversation_tokens
 
-__all__ = ['setup_logger']
+__all__ = ['setup_logger', 'count_tokens', 'count_messages_tokens', 'count_conversation_tokens']
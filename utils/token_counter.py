@@ -0,0 +1,108 @@
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+from loguru import logger
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# 每条消息的固定开销（角色标记、分隔符等）
+MESSAGE_TOKEN_OVERHEAD = 4
+
+_CJK_PATTERN = re.compile(r'[　-〿㐀-䶿一-鿿＀-￯]')
+
+_encoding = None
+_encoding_failed = False
+_encoding_loading = False
+_encoding_lock = threading.Lock()
+
+
+def _load_encoding():
+    """加载tiktoken词表（本地缓存中没有时会下载），结果对所有线程可见"""
+    global _encoding, _encoding_failed, _encoding_loading
+    
+    try:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        encoding = None
+        logger.warning(f"tiktoken词表加载失败，使用本地估算器计数: {e}")
+    
+    with _encoding_lock:
+        _encoding = encoding
+        _encoding_failed = encoding is None
+        _encoding_loading = False
+
+
+def preload_encoding(cache_dir: Optional[str] = None):
+    """在后台线程加载tiktoken词表，应在应用启动时调用
+
+    加载完成前count_tokens使用本地估算器，对话不会等待词表下载。
+    cache_dir为预先放入词表文件的目录（即tiktoken的TIKTOKEN_CACHE_DIR），
+    离线部署时可避免联网下载。
+    """
+    global _encoding_loading
+    
+    if cache_dir:
+        os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+    
+    with _encoding_lock:
+        if not TIKTOKEN_AVAILABLE or _encoding is not None or _encoding_failed or _encoding_loading:
+            return
+        _encoding_loading = True
+    
+    threading.Thread(target=_load_encoding, name="tiktoken-preload", daemon=True).start()
+
+
+def _get_encoding():
+    """获取tiktoken编码：未预加载时在当前线程懒加载；正在加载或加载失败（如离线环境无法下载词表）时返回None"""
+    global _encoding_loading
+    
+    if _encoding is not None or _encoding_failed or not TIKTOKEN_AVAILABLE:
+        return _encoding
+    
+    with _encoding_lock:
+        if _encoding is not None or _encoding_failed or _encoding_loading:
+            return _encoding
+        _encoding_loading = True
+    
+    _load_encoding()
+    return _encoding
+
+
+def estimate_tokens(text: str) -> int:
+    """本地估算token数：中文字符约1个token，其它字符约4个字符1个token"""
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+
+def count_tokens(text: str) -> int:
+    """计算文本的token数，优先使用tiktoken，不可用时回退到估算器"""
+    if not text:
+        return 0
+    
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def count_message_tokens(message: Dict[str, str]) -> int:
+    """计算单条消息的token数（含消息开销）"""
+    return count_tokens(message.get("content", "")) + MESSAGE_TOKEN_OVERHEAD
+
+
+def count_messages_tokens(messages: List[Dict[str, str]]) -> int:
+    """计算消息列表的token总数"""
+    return sum(count_message_tokens(message) for message in messages)
+
+
+def count_conversation_tokens(user_input: str, ai_response: str) -> int:
+    """计算一轮对话（用户消息 + 助手回复）的token数"""
+    return count_tokens(user_input) + count_tokens(ai_response) + 2 * MESSAGE_TOKEN_OVERHEAD